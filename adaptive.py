@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+""" Adaptive sampling: burst to high rate when watched counters spike """
+
+import logging
+
+from logger import define_logger
+
+
+class AdaptiveException(Exception):
+    """ Bad adaptive sampling settings """
+    pass
+
+
+def parse_watch(text):
+    """ Parse watch in format group:counter[:threshold]
+        Return (group, counter, threshold or None) """
+    fields = text.split(":")
+    if len(fields) not in (2, 3):
+        raise AdaptiveException("Bad watch '%s', group:counter[:threshold]"
+                                " expected" % text)
+    try:
+        threshold = float(fields[2]) if len(fields) == 3 else None
+    except ValueError:
+        raise AdaptiveException("Bad threshold in watch '%s'" % text)
+    return fields[0], fields[1], threshold
+
+
+class CounterBaseline(object):
+    """ Rolling baseline of one counter (exponentially weighted) """
+
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.mean = None
+        self.var = 0.0
+        self.count = 0
+        # previous sum and avgcount of latency counter
+        self.last_pair = None
+
+    def interval_value(self, value):
+        """ Return value for the last interval:
+            average for latency counters, value as is for others """
+        if not isinstance(value, dict):
+            return float(value)
+        pair = (value["sum"], value["avgcount"])
+        last = self.last_pair
+        self.last_pair = pair
+        if last is None or pair[1] <= last[1]:
+            return None
+        return float(pair[0] - last[0]) / (pair[1] - last[1])
+
+    def update(self, value, alpha=None):
+        """ Add value to baseline with own or given weight """
+        if alpha is None:
+            alpha = self.alpha
+        self.count += 1
+        if self.mean is None:
+            self.mean = value
+            return
+        delta = value - self.mean
+        self.mean += alpha * delta
+        self.var = (1 - alpha) * (self.var + alpha * delta ** 2)
+
+
+class AdaptiveSampler(object):
+    """ Chooses sampling interval by watched counters
+        Sampling is done with base interval, until one of watched counters
+        of any daemon exceeds its threshold (or baseline + k * deviation,
+        if threshold isn't set). Then burst interval is used during burst
+        window after the last spike. Spikes are added to baseline with
+        smaller weight, so a lasting change of level becomes new normal """
+
+    def __init__(self, base_interval, burst_interval, burst_window, watch,
+                 k=3.0, alpha=0.1, warmup=5, min_rise=0.5,
+                 spike_alpha=0.02):
+        if burst_interval <= 0 or burst_window <= 0:
+            raise AdaptiveException("Burst interval and window"
+                                    " must be positive")
+        self.base_interval = base_interval
+        self.burst_interval = burst_interval
+        self.burst_window = burst_window
+        # list of (group, counter, threshold)
+        self.watch = watch
+        self.k = k
+        self.alpha = alpha
+        self.spike_alpha = spike_alpha
+        self.warmup = warmup
+        # minimal rise over baseline mean to be a spike (part of mean)
+        self.min_rise = min_rise
+        # (daemon, group, counter) -> CounterBaseline
+        self.baselines = {}
+        self.burst_until = 0
+
+    def get_interval(self, now):
+        """ Return effective interval at now """
+        if now < self.burst_until:
+            return min(self.burst_interval, self.base_interval)
+        return self.base_interval
+
+    def update(self, perf_list, now):
+        """ Check perf dump for spikes and start or prolong burst
+            Return True, if spike is found """
+        spike = False
+        for daemon, groups in perf_list.items():
+            if not isinstance(groups, dict):
+                continue
+            for group, counter, threshold in self.watch:
+                value = groups.get(group, {}).get(counter)
+                if value is None:
+                    continue
+                key = (daemon, group, counter)
+                baseline = self.baselines.get(key)
+                if baseline is None:
+                    baseline = CounterBaseline(self.alpha)
+                    self.baselines[key] = baseline
+                value = baseline.interval_value(value)
+                if value is None:
+                    continue
+                if self.is_spike(baseline, value, threshold):
+                    spike = True
+                    # only the spike, which starts burst, is worth info
+                    level = logging.DEBUG if now < self.burst_until \
+                        else logging.INFO
+                    logging.getLogger(__name__).log(
+                        level, "Spike of %s %s %s: %s", daemon, group,
+                        counter, value)
+                    baseline.update(value, self.spike_alpha)
+                else:
+                    baseline.update(value)
+
+        if spike:
+            self.burst_until = now + self.burst_window
+        return spike
+
+    def is_spike(self, baseline, value, threshold):
+        """ Check value against threshold or baseline """
+        if threshold is not None:
+            return value > threshold
+        if baseline.count < self.warmup:
+            return False
+        rise = max(self.k * baseline.var ** 0.5,
+                   self.min_rise * abs(baseline.mean))
+        return value > baseline.mean + rise
+
+    def get_config(self):
+        """ Return settings as dict for answers """
+        return {"burst_interval": self.burst_interval,
+                "burst_window": self.burst_window,
+                "watch": [list(item) for item in self.watch],
+                "k": self.k}
+
+
+define_logger(__name__)
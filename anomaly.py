@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+""" Online detection of slow OSDs by comparison with their peers
+    Every interval values of each counter are compared over all OSDs
+    by robust z-score: 0.6745 * (value - median) / MAD """
+
+import json
+import logging
+
+import samples
+from logger import define_logger
+
+
+# prefix of alert records in result file
+ALERT_PREFIX = "alert"
+
+# MAD of normal distribution is 0.6745 of its deviation
+MAD_SCALE = 0.6745
+
+
+def median(values):
+    """ Median of sorted list """
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+class AnomalyDetector(object):
+    """ Sink, which finds OSDs with latencies much bigger than their peers
+        Alerts are dicts with kind:
+        'outlier' - OSD becomes outlier,
+        'sustained' - OSD is outlier during sustain intervals,
+        'recovered' - OSD isn't outlier anymore,
+        'expired' - outlier OSD doesn't report the counter anymore
+        They are given to emit function """
+
+    def __init__(self, interval, emit, threshold=3.5, sustain=5,
+                 min_peers=3, min_mad_ratio=0.05, diff=False):
+        self.emit = emit
+        self.threshold = threshold
+        self.sustain = sustain
+        self.min_peers = min_peers
+        # MAD is not less than this part of median,
+        # so equal peers don't make any difference an outlier
+        self.min_mad_ratio = min_mad_ratio
+        self.averager = samples.PairAverager(diff)
+        # every interval is {(group, counter): {daemon: value}}
+        self.buckets = samples.IntervalBuckets(interval)
+        # (daemon, group, counter) -> number of outlier intervals in a row
+        self.streaks = {}
+        self.hosts = {}
+
+    def add(self, host, dump):
+        """ Add latencies of OSDs from dump, check finished intervals """
+        timestamp = dump.get("time")
+        if timestamp is None:
+            return
+        values = self.buckets.get(timestamp)
+        if values is None:
+            # interval is checked already, late dump is dropped
+            return
+        for daemon, group, counter, value in samples.iter_counters(dump):
+            if samples.osd_name(daemon) is None or \
+                    not samples.is_pair(value):
+                continue
+            value = self.averager.value((daemon, group, counter), value)
+            if value is None:
+                continue
+            self.hosts[daemon] = host
+            values.setdefault((group, counter), {})[daemon] = value
+        for start, finished in self.buckets.finished():
+            self.check(start, finished)
+
+    def flush(self):
+        """ Check all pending intervals """
+        for start, values in self.buckets.flush():
+            self.check(start, values)
+
+    def check(self, timestamp, values):
+        """ Find outliers of one interval """
+        for (group, counter), by_daemon in values.items():
+            if len(by_daemon) < self.min_peers:
+                continue
+            ordered = sorted(by_daemon.values())
+            center = median(ordered)
+            mad = median(sorted(abs(value - center) for value in ordered))
+            mad = max(mad, self.min_mad_ratio * abs(center))
+            for daemon, value in by_daemon.items():
+                key = (daemon, group, counter)
+                if mad > 0:
+                    score = MAD_SCALE * (value - center) / mad
+                else:
+                    score = 0.0
+                # only slow OSDs are interesting
+                if score > self.threshold:
+                    streak = self.streaks.get(key, 0) + 1
+                    self.streaks[key] = streak
+                    if streak == 1:
+                        kind = "outlier"
+                    elif streak == self.sustain:
+                        kind = "sustained"
+                    else:
+                        continue
+                elif key in self.streaks:
+                    streak = self.streaks.pop(key)
+                    kind = "recovered"
+                else:
+                    continue
+                self.emit({"kind": kind,
+                           "time": timestamp,
+                           "host": self.hosts.get(daemon),
+                           "daemon": daemon,
+                           "group": group,
+                           "counter": counter,
+                           "value": value,
+                           "median": center,
+                           "mad": mad,
+                           "score": score,
+                           "intervals": streak})
+        self.expire(timestamp, values)
+
+    def expire(self, timestamp, values):
+        """ Drop streaks of OSDs, which are missing in finished interval,
+            otherwise they stay outliers forever """
+        for key in sorted(self.streaks):
+            daemon, group, counter = key
+            if daemon in values.get((group, counter), {}):
+                continue
+            streak = self.streaks.pop(key)
+            self.emit({"kind": "expired",
+                       "time": timestamp,
+                       "host": self.hosts.get(daemon),
+                       "daemon": daemon,
+                       "group": group,
+                       "counter": counter,
+                       "intervals": streak})
+
+
+def format_alert(alert):
+    """ Alert as record of result file """
+    return ALERT_PREFIX + json.dumps(alert)
+
+
+def log_alert(alert):
+    """ Write alert to log """
+    logger = logging.getLogger(__name__)
+    if alert["kind"] == "recovered":
+        logger.info("%s %s/%s recovered after %i intervals", alert["daemon"],
+                    alert["group"], alert["counter"], alert["intervals"])
+    elif alert["kind"] == "expired":
+        logger.info("%s %s/%s isn't reported after %i outlier intervals",
+                    alert["daemon"], alert["group"], alert["counter"],
+                    alert["intervals"])
+    else:
+        logger.warning("%s %s %s/%s: %.4g, peers median %.4g, score %.1f,"
+                       " %i intervals", alert["kind"], alert["daemon"],
+                       alert["group"], alert["counter"], alert["value"],
+                       alert["median"], alert["score"], alert["intervals"])
+
+
+define_logger(__name__)
@@ -1,15 +1,17 @@
 #!/usr/bin/env python
 """ Ceph communications """
 
+import os
 import json
-import glob
+import socket
+import struct
 import logging
-from os.path import splitext, basename
-
-import sh
 
 from logger import define_logger
 
+# sh module is big and slow to import, it is imported only by functions,
+# which call ceph tool. Perf data is read from admin sockets directly.
+
 
 class CephException(Exception):
     """ Exceptions from ceph call"""
@@ -22,6 +24,7 @@ class ParameterException(Exception):
 
 def get_osds_list():
     """ Get list of osds id"""
+    import sh
     try:
         res = sh.ceph.osd.ls()
         osd_list = [osd_id
@@ -39,6 +42,7 @@ def get_osds_list():
 
 def get_mons_or_mds_ips(who):
     """ Return mon ip list """
+    import sh
     try:
         ips = set()
         if who == "mon":
@@ -73,6 +77,7 @@ def get_mons_or_mds_ips(who):
 
 def get_osds_ips(osd_list):
     """ Get osd's ips """
+    import sh
     try:
         ips = set()
         for osd_id in osd_list:
@@ -91,44 +96,99 @@ def get_osds_ips(osd_list):
         raise CephException("Execution error")
 
 
+def get_osd_domains():
+    """ Return dict osd name -> {crush bucket type: bucket name}
+        for all buckets above osd in crush tree """
+    import sh
+    try:
+        tree = json.loads(str(sh.ceph.osd.tree("-f", "json")))
+    except sh.CommandNotFound:
+        logger = logging.getLogger(__name__)
+        logger.error("Ceph command not found")
+        raise CephException("Command not found")
+    except:
+        logger = logging.getLogger(__name__)
+        logger.error("Ceph command 'osd tree' execution error")
+        raise CephException("Execution error")
+
+    nodes = dict((node["id"], node) for node in tree["nodes"])
+    parents = {}
+    for node in tree["nodes"]:
+        for child in node.get("children", []):
+            parents[child] = node["id"]
+    domains = {}
+    for node in tree["nodes"]:
+        if node["type"] != "osd":
+            continue
+        osd_domains = domains.setdefault(node["name"], {})
+        parent = parents.get(node["id"])
+        while parent is not None:
+            osd_domains[nodes[parent]["type"]] = nodes[parent]["name"]
+            parent = parents.get(parent)
+    return domains
+
+
 def get_socket_list(path):
     """ Returns list of sockets (ceph creatures) on node"""
-    sock_list = [splitext(basename(sock))[0]
-                 for sock in glob.glob(path + "*.asok")]
+    try:
+        names = sorted(os.listdir(path))
+    except OSError:
+        return []
+    sock_list = [name[:-len(".asok")]
+                 for name in names if name.endswith(".asok")]
     return sock_list
 
 
+def admin_socket_command(sock_path, command):
+    """ Send command to ceph admin socket and return raw answer
+        (the same protocol, as 'ceph --admin-daemon' uses) """
+    if not isinstance(command, basestring):
+        command = " ".join(command)
+    request = json.dumps({"prefix": command}) + "\0"
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(10)
+        sock.connect(sock_path)
+        sock.sendall(request)
+        # answer is 4 bytes of length in network order and data
+        size = struct.unpack(">I", recv_exactly(sock, 4))[0]
+        return recv_exactly(sock, size)
+    finally:
+        sock.close()
+
+
+def recv_exactly(sock, size):
+    """ Receive exactly size bytes from stream socket """
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            raise socket.error("Admin socket closed connection")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return "".join(chunks)
+
+
 def get_perf_data(socket_list, command, path):
     """ Basic command to return schemas or dumps
         of listed ceph creatures perfs"""
     logger = logging.getLogger(__name__)
-    try:
-        res = {}
-        for sock in socket_list:
-            try:
-                cmd = "%s/%s.asok" % (path, sock)
-                # if command == "dump":
-                #     raw = sh.ceph.perf.dump(admin_daemon=cmd)
-                # elif command == "schema":
-                #     raw = sh.ceph.perf.schema(admin_daemon=cmd)
-                # else:
-                #     raise ParameterException("'%s' in get_perf_data"
-                #                              " instead of dump/schema" % command)
-                raw = sh.ceph(command, admin_daemon=cmd)
-                res[sock] = json.loads(str(raw))
-            except sh.ErrorReturnCode_22:
-                # no such command for this daemon - it's normal,
-                # because I don't filter commands by types (osd/mon)
-                logger.warning("No command %s for socket %s", command, sock)
-
-        return res
-
-    except sh.CommandNotFound:
-        logger.error("Ceph command not found")
-        raise CephException("Command not found")
-    except:
-        logger.error("Ceph command '%s' execution error", cmd)
-        raise CephException("Execution error")
+    res = {}
+    for sock in socket_list:
+        cmd = os.path.join(path, sock + ".asok")
+        try:
+            raw = admin_socket_command(cmd, command)
+        except socket.error as e:
+            logger.error("Admin socket '%s' error: %s", cmd, e)
+            raise CephException("Execution error")
+        try:
+            res[sock] = json.loads(raw)
+        except ValueError:
+            # no such command for this daemon - it's normal,
+            # because I don't filter commands by types (osd/mon)
+            logger.warning("No command %s for socket %s", command, sock)
+
+    return res
 
 
 define_logger(__name__)
@@ -3,22 +3,79 @@
 import os
 import glob
 import json
-import subprocess
+import stat
+import time
+import fcntl
+import socket
+import struct
 import os.path
 
-import psutil
+try:
+    import psutil
+    PROCESS_GONE_ERRORS = (IOError, OSError, psutil.NoSuchProcess)
+    ACCESS_DENIED_ERRORS = (psutil.AccessDenied,)
+except ImportError:
+    # procfs backend is used
+    psutil = None
+    PROCESS_GONE_ERRORS = (IOError, OSError)
+    ACCESS_DENIED_ERRORS = ()
+
+import procfs
+from execute import check_output
+
+
+# config keys with paths to data of every service type
+SRV_PATH_KEYS = ['osd_data', 'osd_journal', 'mds_data', 'mon_data']
+
+# network name -> (config key of address, config key of network)
+SRV_NET_KEYS = {'public': ('public_addr', 'public_network'),
+                'cluster': ('cluster_addr', 'cluster_network')}
+
+# /proc/net/snmp and /proc/net/netstat fields -> metric name
+TCP_FIELDS = [('Tcp:InSegs', 'in segments'),
+              ('Tcp:OutSegs', 'out segments'),
+              ('Tcp:RetransSegs', 'retransmits'),
+              ('Tcp:InErrs', 'in errors'),
+              ('TcpExt:TCPLostRetransmit', 'lost retransmits'),
+              ('TcpExt:TCPTimeouts', 'timeouts'),
+              ('TcpExt:PruneCalled', 'prune called'),
+              ('TcpExt:RcvPruned', 'rcv pruned'),
+              ('TcpExt:OfoPruned', 'ofo pruned'),
+              ('TcpExt:TCPMemoryPressures', 'memory pressures'),
+              ('TcpExt:TCPBacklogDrop', 'backlog drops'),
+              ('TcpExt:TCPRcvQDrop', 'rcvq drops'),
+              ('TcpExt:ListenOverflows', 'listen overflows')]
+
+SIOCGIFADDR = 0x8915
 
 
 class CEPHSrvInfo(object):
+    # cumulative counters of process, which are reported as interval deltas
+    delta_fields = ['user_time', 'sys_time', 'vol_ctx', 'invol_ctx',
+                    'rd_bytes', 'wr_bytes']
+
     def __init__(self, name, pid, cpu=0, mem=0):
         self.name = name
         self.pid = pid
         self.cpu = cpu
         self.mem = mem
+        # values for the last interval
+        self.user_time = 0
+        self.sys_time = 0
+        self.vol_ctx = 0
+        self.invol_ctx = 0
+        self.rd_bytes = 0
+        self.wr_bytes = 0
+        # current values
+        self.threads = 0
+        self.rss = mem
+        self.pss = 0
+        # config key -> block device
+        self.disks = {}
 
     def __str__(self):
         templ = '<Service {0.name}: pid={0.pid},' + \
-                'cpu={0.cpu}%, mem={0.mem}B>'
+                'cpu={0.cpu}%, mem={0.mem}B, threads={0.threads}>'
         return templ.format(self)
 
 
@@ -32,6 +89,38 @@ class CEPHDiskInfo(object):
         self.wr_bytes = wr_bytes
         self.rd_time = rd_time
         self.wr_time = wr_time
+        # values for the last interval, as iostat -x shows them
+        self.rd_iops = 0.0
+        self.wr_iops = 0.0
+        self.rd_bps = 0.0
+        self.wr_bps = 0.0
+        self.rd_await = 0.0
+        self.wr_await = 0.0
+        self.avg_await = 0.0
+        self.avg_queue = 0.0
+        self.util = 0.0
+
+    def set_interval_stats(self, old, new, interval):
+        """ Compute interval values from two diskstats samples
+            (tuples in procfs.DISKSTATS_FIELDS order) and interval in secs
+        """
+        delta = dict((field, new_val - old_val)
+                     for field, new_val, old_val
+                     in zip(procfs.DISKSTATS_FIELDS, new, old))
+        self.rd_iops = delta['rd_cnt'] / interval
+        self.wr_iops = delta['wr_cnt'] / interval
+        self.rd_bps = delta['rd_sectors'] * 512 / interval
+        self.wr_bps = delta['wr_sectors'] * 512 / interval
+        if delta['rd_cnt'] > 0:
+            self.rd_await = float(delta['rd_time']) / delta['rd_cnt']
+        if delta['wr_cnt'] > 0:
+            self.wr_await = float(delta['wr_time']) / delta['wr_cnt']
+        ios = delta['rd_cnt'] + delta['wr_cnt']
+        if ios > 0:
+            self.avg_await = float(delta['rd_time'] + delta['wr_time']) / ios
+        # diskstats times are in ms
+        self.avg_queue = delta['weighted_io_time'] / (interval * 1000)
+        self.util = min(100.0, delta['io_time'] / (interval * 10))
 
     def __str__(self):
         message = 'DISK {0.name}: read count {0.rd_cnt}' + \
@@ -43,67 +132,357 @@ class CEPHDiskInfo(object):
         return message.format(self)
 
 
-def get_ceph_srv_info(ceph_socket_path = '/var/run/ceph/'):
-    """ Return list of CEPHSrvInfo for all CEPH services on the local node """
+class CEPHNetInfo(object):
+    def __init__(self, name):
+        self.name = name
+        # values per second for the last interval
+        self.rx_bytes = 0.0
+        self.tx_bytes = 0.0
+        self.rx_packets = 0.0
+        self.tx_packets = 0.0
+        self.rx_drop = 0.0
+        self.tx_drop = 0.0
+        self.rx_errs = 0.0
+        self.tx_errs = 0.0
+
+    def set_interval_stats(self, old, new, interval):
+        """ Compute rates from two /proc/net/dev samples
+            (tuples in procfs.NETDEV_FIELDS order) and interval in secs
+        """
+        for field, new_val, old_val in zip(procfs.NETDEV_FIELDS, new, old):
+            if hasattr(self, field):
+                setattr(self, field, (new_val - old_val) / interval)
+
+    def __str__(self):
+        message = 'NET {0.name}: rx {0.rx_bytes}B/s' + \
+                  ', tx {0.tx_bytes}B/s' + \
+                  ', rx drops {0.rx_drop}/s' + \
+                  ', tx drops {0.tx_drop}/s'
+        return message.format(self)
+
+
+class CEPHSrvMeta(object):
+    """ Metadata of CEPH service, which is valid until daemon restart """
+    def __init__(self, name, sock_ino, pid, start_time, paths, disks,
+                 parents, ifaces):
+        self.name = name
+        self.sock_ino = sock_ino
+        self.pid = pid
+        self.start_time = start_time
+        # config key -> path and config key -> block device
+        self.paths = paths
+        self.disks = disks
+        # partition -> whole device
+        self.parents = parents
+        # network name -> interface
+        self.ifaces = ifaces
+        # long-lived process handle and its previous sample
+        self.process = None
+        self.last_sample = None
+        self.last_time = None
+
+    def is_valid(self, sock_ino):
+        """ Check, that service was not restarted since metadata creation """
+        return self.sock_ino == sock_ino and \
+            get_pid_start_time(self.pid) == self.start_time
+
+    def __str__(self):
+        templ = '<Meta {0.name}: pid={0.pid}, disks={0.disks}>'
+        return templ.format(self)
+
+
+# service name -> CEPHSrvMeta
+_srv_meta_cache = {}
+
+# reader with opened /proc files, shared by all ticks
+_proc_reader = procfs.ProcReader()
+
+# previous /proc/diskstats sample
+_last_diskstats = {}
+
+# previous /proc/net/dev and /proc/net/{snmp,netstat} samples
+_last_netstats = {}
+
+
+def get_ceph_srv_info(ceph_socket_path = '/var/run/ceph/', backend="psutil",
+                      pss=False):
+    """ Return list of CEPHSrvInfo for all CEPH services on the local node
+        backend is 'psutil' or 'procfs'
+        pss is read only on request, smaps of big process are slow to read
+    """
     services = []
-    for name, pid in get_ceph_pids(ceph_socket_path):
-        process = psutil.Process(pid)
-        services.append(CEPHSrvInfo(name,
-                                    pid,
-                                    process.get_cpu_percent(),
-                                    process.memory_info().rss))
+    for meta in get_ceph_srv_meta(ceph_socket_path):
+        try:
+            if backend == "psutil":
+                if meta.process is None:
+                    meta.process = psutil.Process(meta.pid)
+                sample = sample_process(meta.process, pss)
+            else:
+                sample = sample_process_procfs(meta.pid, pss)
+        except PROCESS_GONE_ERRORS:
+            # daemon is restarting, metadata will be recreated on next tick
+            continue
+        except ACCESS_DENIED_ERRORS:
+            # other daemons must be sampled anyway
+            continue
+        sample_time = time.time()
+
+        info = CEPHSrvInfo(meta.name, meta.pid)
+        info.disks = meta.disks
+        info.threads = sample['threads']
+        info.rss = info.mem = sample['rss']
+        info.pss = sample['pss']
+        if meta.last_sample is not None:
+            for field in CEPHSrvInfo.delta_fields:
+                setattr(info, field,
+                        sample[field] - meta.last_sample[field])
+            interval = sample_time - meta.last_time
+            if interval > 0:
+                cpu_time = info.user_time + info.sys_time
+                info.cpu = 100.0 * cpu_time / interval
+
+        meta.last_sample = sample
+        meta.last_time = sample_time
+        services.append(info)
     return services
 
 
+def sample_process(process, pss=False):
+    """ Return dict of process counters, all of them are read
+        by one pass over /proc (smaps for pss is read separately)
+    """
+    with process.oneshot():
+        cpu_times = process.cpu_times()
+        ctx = process.num_ctx_switches()
+        threads = process.num_threads()
+        rss = process.memory_info().rss
+        io = process.io_counters()
+
+    pss_value = 0
+    if pss:
+        try:
+            pss_value = getattr(process.memory_full_info(), 'pss', 0)
+        except ACCESS_DENIED_ERRORS:
+            # smaps is unreadable, rss is reported anyway
+            pass
+
+    return {'user_time': cpu_times.user,
+            'sys_time': cpu_times.system,
+            'vol_ctx': ctx.voluntary,
+            'invol_ctx': ctx.involuntary,
+            'threads': threads,
+            'rss': rss,
+            'pss': pss_value,
+            'rd_bytes': io.read_bytes,
+            'wr_bytes': io.write_bytes}
+
+
+def sample_process_procfs(pid, pss=False):
+    """ Same as sample_process, but /proc is read directly """
+    user_time, sys_time, threads, _, rss = _proc_reader.pid_stat(pid)
+    vol_ctx, invol_ctx = _proc_reader.pid_ctx_switches(pid)
+    rd_bytes, wr_bytes = _proc_reader.pid_io(pid)
+    pss_value = 0
+    if pss:
+        try:
+            pss_value = _proc_reader.pid_pss(pid)
+        except (IOError, OSError):
+            # smaps_rollup is unreadable, rss is reported anyway
+            pass
+
+    return {'user_time': user_time,
+            'sys_time': sys_time,
+            'vol_ctx': vol_ctx,
+            'invol_ctx': invol_ctx,
+            'threads': threads,
+            'rss': rss,
+            'pss': pss_value,
+            'rd_bytes': rd_bytes,
+            'wr_bytes': wr_bytes}
+
+
 def get_ceph_drv_info(ceph_socket_path = '/var/run/ceph/'):
     """ Return list of CEPHDiskInfo for all disks that used by CEPH on the
         local node
+        /proc/diskstats is read directly for any backend, because
+        psutil doesn't provide weighted io time
     """
     disks_info = []
-    stat = psutil.disk_io_counters(perdisk=True)
+    stat = _proc_reader.diskstats()
+    stat_time = time.time()
+    last_stat = _last_diskstats.get("stat", {})
+    interval = stat_time - _last_diskstats.get("time", stat_time)
+    _last_diskstats["stat"] = stat
+    _last_diskstats["time"] = stat_time
+
     for drv in get_ceph_disk(ceph_socket_path):
         info = CEPHDiskInfo(drv)
         disk = os.path.basename(drv)
         if disk in stat:
-            info.rd_cnt = stat[disk].read_count
-            info.wr_cnt = stat[disk].write_count
-            info.rd_bytes = stat[disk].read_bytes
-            info.wr_bytes = stat[disk].write_bytes
-            info.rd_time = stat[disk].read_time
-            info.wr_time = stat[disk].write_time
+            values = dict(zip(procfs.DISKSTATS_FIELDS, stat[disk]))
+            info.rd_cnt = values['rd_cnt']
+            info.wr_cnt = values['wr_cnt']
+            # diskstats sectors are always 512 bytes
+            info.rd_bytes = values['rd_sectors'] * 512
+            info.wr_bytes = values['wr_sectors'] * 512
+            info.rd_time = values['rd_time']
+            info.wr_time = values['wr_time']
+            if disk in last_stat and interval > 0:
+                info.set_interval_stats(last_stat[disk], stat[disk], interval)
 
         disks_info.append(info)
 
     return disks_info
 
 
+def get_ceph_net_info(ceph_socket_path = '/var/run/ceph/'):
+    """ Return list of CEPHNetInfo for all interfaces of CEPH public
+        and cluster networks on the local node
+    """
+    ifaces = []
+    for meta in get_ceph_srv_meta(ceph_socket_path):
+        for iface in meta.ifaces.values():
+            if iface not in ifaces:
+                ifaces.append(iface)
+
+    stat = _proc_reader.net_dev()
+    stat_time = time.time()
+    last_stat = _last_netstats.get("dev", {})
+    interval = stat_time - _last_netstats.get("dev time", stat_time)
+    _last_netstats["dev"] = stat
+    _last_netstats["dev time"] = stat_time
+
+    nets_info = []
+    for iface in ifaces:
+        info = CEPHNetInfo(iface)
+        if iface in stat and iface in last_stat and interval > 0:
+            info.set_interval_stats(last_stat[iface], stat[iface], interval)
+        nets_info.append(info)
+
+    return nets_info
+
+
+def get_tcp_info():
+    """ Return dict TCP_FIELDS metric name -> value per second
+        for the last interval
+    """
+    stat = _proc_reader.net_snmp("snmp")
+    stat.update(_proc_reader.net_snmp("netstat"))
+    stat_time = time.time()
+    last_stat = _last_netstats.get("tcp", stat)
+    interval = stat_time - _last_netstats.get("tcp time", stat_time)
+    _last_netstats["tcp"] = stat
+    _last_netstats["tcp time"] = stat_time
+
+    info = {}
+    for field, name in TCP_FIELDS:
+        delta = stat.get(field, 0) - last_stat.get(field, 0)
+        info[name] = delta / interval if interval > 0 else 0.0
+    return info
+
+
 def get_ceph_pids(ceph_socket_path = '/var/run/ceph/'):
     """ Return list tuple (NAME, PID) as list of SrvInfo for all CEPH
         services on local node.
     """
-    pids = []
-    for srv in get_srv_list(ceph_socket_path):
-        cfg = get_srv_config(ceph_socket_path, srv)
-        with open(cfg['pid_file'], 'r') as file_fd:
-            pids.append((srv, int(file_fd.read())))
-    return pids
+    return [(meta.name, meta.pid)
+            for meta in get_ceph_srv_meta(ceph_socket_path)]
 
 
 def get_ceph_disk(ceph_socket_path = '/var/run/ceph/'):
     """ Return list of disk devices wich is used by all
         CEPH services on local node.
+        Whole devices of used partitions are included too
     """
     disks = []
-    for srv in get_srv_list(ceph_socket_path):
-        cfg = get_srv_config(ceph_socket_path, srv)
-        for key in ['osd_data', 'osd_journal', 'mds_data', 'mon_data']:
-            mnt_point = cfg[key]
-            disk = get_disk_by_mountpoint(find_mount_point(mnt_point))
-            if disk not in disks:
+    for meta in get_ceph_srv_meta(ceph_socket_path):
+        for key in SRV_PATH_KEYS:
+            disk = meta.disks.get(key)
+            if disk is not None and disk not in disks:
                 disks.append(disk)
+            parent = meta.parents.get(disk)
+            if parent is not None and parent not in disks:
+                disks.append(parent)
     return disks
 
 
+def get_ceph_srv_meta(ceph_socket_path = '/var/run/ceph/'):
+    """ Return list of CEPHSrvMeta for all CEPH services on local node.
+        'config show' is called only for new or restarted services
+    """
+    metas = []
+    partitions = None
+    for srv in get_srv_list(ceph_socket_path):
+        sock = os.path.join(ceph_socket_path, srv + ".asok")
+        try:
+            sock_ino = os.stat(sock).st_ino
+        except OSError:
+            # socket is removed right now - daemon is stopping
+            continue
+
+        meta = _srv_meta_cache.get(srv)
+        if meta is None or not meta.is_valid(sock_ino):
+            if partitions is None:
+                partitions = _proc_reader.partitions()
+            if meta is not None:
+                # files of old process can't be reused
+                _proc_reader.forget_pid(meta.pid)
+            meta = create_srv_meta(ceph_socket_path, srv,
+                                   sock_ino, partitions)
+            _srv_meta_cache[srv] = meta
+        metas.append(meta)
+
+    # forget services, which are gone
+    names = set(meta.name for meta in metas)
+    for srv in _srv_meta_cache.keys():
+        if srv not in names:
+            _proc_reader.forget_pid(_srv_meta_cache[srv].pid)
+            del _srv_meta_cache[srv]
+
+    return metas
+
+
+def create_srv_meta(ceph_socket_path, name, sock_ino, partitions):
+    """ Collect metadata of service with expensive calls """
+    cfg = get_srv_config(ceph_socket_path, name)
+    with open(cfg['pid_file'], 'r') as file_fd:
+        pid = int(file_fd.read())
+
+    paths = {}
+    disks = {}
+    parents = {}
+    for key in SRV_PATH_KEYS:
+        path = cfg.get(key)
+        # services have paths of other types in config too
+        if not path or not os.path.exists(path):
+            continue
+        paths[key] = path
+        disks[key] = get_disk_by_path(path, partitions)
+        parent = get_parent_disk(disks[key])
+        if parent is not None:
+            parents[disks[key]] = parent
+
+    ifaces = {}
+    iface_addrs = get_iface_addrs()
+    for net, (addr_key, network_key) in SRV_NET_KEYS.items():
+        iface = get_iface_by_config(cfg.get(addr_key, ""),
+                                    cfg.get(network_key, ""),
+                                    iface_addrs)
+        if iface is not None:
+            ifaces[net] = iface
+
+    return CEPHSrvMeta(name, sock_ino, pid, get_pid_start_time(pid),
+                       paths, disks, parents, ifaces)
+
+
+def get_pid_start_time(pid):
+    """ Return start time of process in jiffies (None if no process)"""
+    try:
+        return _proc_reader.pid_stat(pid)[3]
+    except (IOError, OSError):
+        return None
+
+
 def get_srv_list(ceph_socket_path):
     """ Returns list of srv (ceph creatures) on node """
     return [os.path.splitext(os.path.basename(sock))[0]
@@ -114,28 +493,86 @@ def get_srv_config(ceph_socket_path, name):
     """ Get CEPH Service Config """
     cmd = "ceph --admin-daemon %s/%s.asok config show" % \
         (ceph_socket_path, name)
-    try:
-        raw_out = eval(subprocess.check_output(cmd, shell=True))
-    except AttributeError:
-        # hack for python < 2.6
-        PIPE = subprocess.PIPE
-        p = subprocess.Popen(cmd, shell=True, stdin=PIPE,
-                             stdout=PIPE, stderr=subprocess.STDOUT)
-        raw_out = p.stdout.read()
+    # warnings go to stderr and must not be parsed as json
+    return json.loads(check_output(cmd, shell=True))
+
 
-    return json.loads(raw_out)
+def get_disk_by_path(path, partitions=None):
+    """ Return disk, which holds path (path can be device itself) """
+    real_path = os.path.realpath(path)
+    # journal is often a link to partition
+    if stat.S_ISBLK(os.stat(real_path).st_mode):
+        return real_path
+    return get_disk_by_mountpoint(find_mount_point(real_path), partitions)
 
 
-def get_disk_by_mountpoint(mnt_point):
+def get_disk_by_mountpoint(mnt_point, partitions=None):
     """ Return disk of mountpoint """
-    diskparts = psutil.disk_partitions()
-    for item in diskparts:
+    if partitions is None:
+        partitions = _proc_reader.partitions()
+    # last mount on mountpoint hides previous ones
+    for item in reversed(partitions):
         if item.mountpoint == mnt_point:
             return os.path.realpath(item.device)
 
     raise OSError("Can't define disk for {0!r}".format(mnt_point))
 
 
+def get_parent_disk(disk):
+    """ Return whole device of partition (None if disk is not partition) """
+    sys_path = os.path.join("/sys/class/block", os.path.basename(disk))
+    if not os.path.exists(os.path.join(sys_path, "partition")):
+        return None
+    parent = os.path.basename(os.path.dirname(os.path.realpath(sys_path)))
+    return os.path.join("/dev", parent)
+
+
+def get_iface_addrs():
+    """ Return dict interface -> IPv4 address for all interfaces """
+    addrs = {}
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        for iface in _proc_reader.net_dev():
+            try:
+                req = struct.pack('256s', iface[:15])
+                res = fcntl.ioctl(sock.fileno(), SIOCGIFADDR, req)
+            except IOError:
+                # interface without IPv4 address
+                continue
+            addrs[iface] = socket.inet_ntoa(res[20:24])
+    finally:
+        sock.close()
+    return addrs
+
+
+def get_iface_by_config(addr, networks, iface_addrs):
+    """ Return interface for service address or networks from config
+        address looks like 1.2.3.4:6800/1234, networks - 1.2.3.0/24,...
+    """
+    ip = addr.split(":")[0]
+    for iface, iface_ip in iface_addrs.items():
+        if ip == iface_ip:
+            return iface
+
+    # address is not specified - daemon binds to ip from networks
+    for network in networks.replace(" ", ",").split(","):
+        if "/" not in network:
+            continue
+        net_ip, _, prefix = network.partition("/")
+        try:
+            net = struct.unpack("!I", socket.inet_aton(net_ip))[0]
+        except socket.error:
+            # IPv6 networks are not supported
+            continue
+        mask = (0xffffffff << (32 - int(prefix))) & 0xffffffff
+        for iface, iface_ip in iface_addrs.items():
+            iface_int = struct.unpack("!I", socket.inet_aton(iface_ip))[0]
+            if iface_int & mask == net & mask:
+                return iface
+
+    return None
+
+
 def find_mount_point(path):
     """ Find mount point by provided path """
     path = os.path.abspath(path)
@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+""" Correlation of OSD latencies with system metrics
+    Latencies of every OSD and system metrics of its process, of its data
+    and journal devices and of its node come in the same dumps, so they
+    are aligned by sample time. For every pair (latency, metric) Pearson
+    correlation is computed with lags up to --lag samples and in rolling
+    windows, pairs are ranked per OSD by the strongest correlation.
+    numpy is used for vectorized math, if it is installed.
+    python correlate.py test.log --lag 3 --window 60 --top 5 """
+
+import sys
+import json
+import math
+import argparse
+
+try:
+    import numpy
+except ImportError:
+    # pure python math is used
+    numpy = None
+
+import samples
+import resultlog
+
+
+SYSTEM_METRICS = "system metrics"
+
+# osd latencies, which are explained by default
+DEFAULT_COUNTERS = ["osd.op_latency", "osd.op_r_latency", "osd.op_w_latency",
+                    "osd.op_w_process_latency", "osd.subop_w_latency",
+                    "filestore.journal_latency", "filestore.apply_latency",
+                    "filestore.commitcycle_latency"]
+
+# config keys of service devices in system metrics -> feature prefix
+DEVICE_KEYS = {"osd_data": "data", "osd_journal": "journal"}
+
+# entity of system metrics with devices of daemons
+DEVICES = "devices"
+
+# node wide entities of system metrics
+NODE_ENTITIES = ("node cpu", "tcp")
+NET_PREFIX = "net "
+
+# growing metrics, they are turned into rates
+CUMULATIVE_METRICS = set(["user time", "system time",
+                          "voluntary ctx switches", "involuntary ctx switches",
+                          "read bytes", "write bytes", "read count",
+                          "write count", "read time", "write time"])
+
+# series must be known in this part of samples
+MIN_COVERAGE = 0.9
+
+# correlation in window is strong, when it is not less
+STRONG = 0.5
+
+
+class CorrelateException(Exception):
+    """ Not enough data """
+    pass
+
+
+class Aligner(object):
+    """ Collects latencies (targets) and system metrics (features)
+        of every OSD by sample time """
+
+    def __init__(self, counters=None, diff=False):
+        # names 'group.counter' of targets, None - all latencies
+        self.counters = counters
+        self.averager = samples.PairAverager(diff)
+        self.rates = samples.RateTracker(diff)
+        # osd -> {time: {name: value}}
+        self.targets = {}
+        self.features = {}
+
+    def add(self, dump, host=None):
+        """ Add OSDs of dump from host """
+        timestamp = dump.get("time")
+        if timestamp is None:
+            return
+        metrics = dump.get(SYSTEM_METRICS, {})
+        node = {}
+        for entity, values in metrics.items():
+            if entity in NODE_ENTITIES or entity.startswith(NET_PREFIX):
+                self.add_metrics(node, (host, entity), entity, values,
+                                 timestamp)
+        for daemon, groups in dump.items():
+            osd = samples.osd_name(daemon)
+            if osd is None or not isinstance(groups, dict):
+                continue
+            targets = self.targets.setdefault(osd, {}).setdefault(timestamp,
+                                                                  {})
+            for group, counters in groups.items():
+                if not isinstance(counters, dict):
+                    continue
+                for counter, value in counters.items():
+                    name = group + "." + counter
+                    if not samples.is_pair(value) or \
+                            (self.counters is not None and
+                             name not in self.counters):
+                        continue
+                    value = self.averager.value((daemon, name), value)
+                    if value is not None:
+                        targets[name] = value
+            if daemon not in metrics:
+                continue
+            features = self.features.setdefault(osd, {}).setdefault(
+                timestamp, {})
+            features.update(node)
+            process = metrics[daemon]
+            self.add_metrics(features, osd, "process", process, timestamp)
+            # older files have devices among process metrics
+            devices = metrics.get(DEVICES, {}).get(daemon, process)
+            for key, prefix in DEVICE_KEYS.items():
+                device = devices.get(key)
+                if device in metrics:
+                    self.add_metrics(features, osd, prefix, metrics[device],
+                                     timestamp)
+
+    def add_metrics(self, features, owner, prefix, values, timestamp):
+        """ Add numbers of system metrics entity as features """
+        for metric, value in values.items():
+            if not samples.is_number(value):
+                continue
+            name = prefix + "/" + metric
+            if metric in CUMULATIVE_METRICS:
+                value = self.rates.rate((owner, name), value, timestamp)
+                if value is None:
+                    continue
+            features[name] = value
+
+    def osds(self):
+        """ Sorted OSDs with both targets and features """
+        return osd_sort(set(self.targets) & set(self.features))
+
+    def columns(self, osd):
+        """ Return (times, target names, target columns, feature names,
+            feature columns) of OSD
+            Series known in less than MIN_COVERAGE of samples are dropped,
+            gaps are filled by previous values """
+        targets, features = self.targets[osd], self.features[osd]
+        times = sorted(set(targets) & set(features))
+        target_names = covered(targets, times)
+        feature_names = covered(features, times)
+        rows = []
+        last = {}
+        for timestamp in times:
+            row = dict(targets[timestamp])
+            row.update(features[timestamp])
+            last.update(row)
+            if all(name in last for name in target_names + feature_names):
+                rows.append((timestamp, dict(last)))
+        return ([timestamp for timestamp, _ in rows],
+                target_names, [[row[name] for _, row in rows]
+                               for name in target_names],
+                feature_names, [[row[name] for _, row in rows]
+                                for name in feature_names])
+
+
+def osd_sort(names):
+    """ Sort OSD names by ids """
+    return sorted(names, key=lambda name: int(name.split(".")[1]))
+
+
+def covered(series, times):
+    """ Sorted names, which are known in MIN_COVERAGE of times """
+    counts = {}
+    for timestamp in times:
+        for name in series[timestamp]:
+            counts[name] = counts.get(name, 0) + 1
+    return sorted(name for name, count in counts.items()
+                  if count >= MIN_COVERAGE * len(times))
+
+
+def lag_slices(size, lag):
+    """ Return (target slice, feature slice) for feature leading target
+        by lag samples """
+    if lag >= 0:
+        return slice(lag, size), slice(0, size - lag)
+    return slice(0, size + lag), slice(-lag, size)
+
+
+def pearson(xs, ys):
+    """ Correlation of two lists (None, if it is undefined) """
+    size = len(xs)
+    if size < 2:
+        return None
+    mean_x = sum(xs) / float(size)
+    mean_y = sum(ys) / float(size)
+    sxx = syy = sxy = 0.0
+    for x, y in zip(xs, ys):
+        sxx += (x - mean_x) ** 2
+        syy += (y - mean_y) ** 2
+        sxy += (x - mean_x) * (y - mean_y)
+    if sxx <= 0 or syy <= 0:
+        return None
+    return sxy / math.sqrt(sxx * syy)
+
+
+def to_list(matrix):
+    """ Nested lists from numpy array, NaN becomes None """
+    return [[None if math.isnan(value) else value for value in row]
+            for row in matrix.tolist()]
+
+
+def cross_correlations(targets, features, max_lag):
+    """ Return {lag: [[correlation of target and feature]]} """
+    size = len(targets[0]) if targets else 0
+    result = {}
+    if numpy is not None:
+        target_rows = numpy.array(targets, dtype=float).T
+        feature_rows = numpy.array(features, dtype=float).T
+    for lag in range(-max_lag, max_lag + 1):
+        if size - abs(lag) < 2:
+            continue
+        target_slice, feature_slice = lag_slices(size, lag)
+        if numpy is None:
+            result[lag] = [[pearson(feature[feature_slice],
+                                    target[target_slice])
+                            for feature in features] for target in targets]
+            continue
+        ys = target_rows[target_slice]
+        xs = feature_rows[feature_slice]
+        ys = ys - ys.mean(axis=0)
+        xs = xs - xs.mean(axis=0)
+        norms = numpy.outer(numpy.sqrt((ys * ys).sum(axis=0)),
+                            numpy.sqrt((xs * xs).sum(axis=0)))
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            matrix = ys.T.dot(xs) / norms
+        matrix[~numpy.isfinite(matrix)] = numpy.nan
+        result[lag] = to_list(matrix)
+    return result
+
+
+def standardize(values):
+    """ Values with zero mean and unit deviation (constant - all zeros),
+        so sums in windows don't lose precision """
+    mean = sum(values) / float(len(values))
+    dev = math.sqrt(sum((value - mean) ** 2 for value in values) /
+                    len(values))
+    if dev == 0:
+        return [0.0] * len(values)
+    return [(value - mean) / dev for value in values]
+
+
+def rolling_correlation(xs, ys, window):
+    """ List of correlations in sliding windows (None, where undefined) """
+    xs, ys = standardize(xs), standardize(ys)
+    if len(xs) < window:
+        return []
+    if numpy is not None:
+        x = numpy.array(xs)
+        y = numpy.array(ys)
+        sums = []
+        for series in (x, y, x * x, y * y, x * y):
+            cumsum = numpy.concatenate(([0.0], numpy.cumsum(series)))
+            sums.append(cumsum[window:] - cumsum[:-window])
+        sx, sy, sxx, syy, sxy = sums
+        norms = numpy.sqrt((window * sxx - sx * sx) * (window * syy - sy * sy))
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            result = (window * sxy - sx * sy) / norms
+        result[~(norms > 1e-6)] = numpy.nan
+        return to_list(result.reshape(1, -1))[0]
+    result = []
+    sx = sum(xs[:window])
+    sy = sum(ys[:window])
+    sxx = sum(x * x for x in xs[:window])
+    syy = sum(y * y for y in ys[:window])
+    sxy = sum(x * y for x, y in zip(xs[:window], ys[:window]))
+    for index in range(window, len(xs) + 1):
+        norm = (window * sxx - sx * sx) * (window * syy - sy * sy)
+        result.append((window * sxy - sx * sy) / math.sqrt(norm)
+                      if norm > 1e-12 else None)
+        if index == len(xs):
+            break
+        old_x, old_y, x, y = xs[index - window], ys[index - window], \
+            xs[index], ys[index]
+        sx += x - old_x
+        sy += y - old_y
+        sxx += x * x - old_x * old_x
+        syy += y * y - old_y * old_y
+        sxy += x * y - old_x * old_y
+    return result
+
+
+def rolling_summary(values, sign):
+    """ Median, min and part of windows with strong correlation of the
+        same sign """
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return {"median": None, "min": None, "stable": 0.0}
+    strong = [value for value in values if value * sign >= STRONG]
+    return {"median": values[len(values) // 2],
+            "min": values[0],
+            "stable": len(strong) / float(len(values))}
+
+
+def rank_osd(times, target_names, targets, feature_names, features,
+             max_lag, window, top):
+    """ Return list of top pairs of OSD sorted by strongest correlation """
+    lags = cross_correlations(targets, features, max_lag)
+    best = {}
+    for lag, matrix in lags.items():
+        for target_index, row in enumerate(matrix):
+            for feature_index, value in enumerate(row):
+                key = (target_index, feature_index)
+                if value is None:
+                    continue
+                # smaller lag wins for equal correlations
+                if key not in best or abs(value) > abs(best[key][0]) or \
+                        (abs(value) == abs(best[key][0]) and
+                         abs(lag) < abs(best[key][1])):
+                    best[key] = (value, lag)
+    ranked = sorted(best.items(), key=lambda item: -abs(item[1][0]))[:top]
+    steps = sorted(new - old for old, new in zip(times[:-1], times[1:]))
+    step = steps[len(steps) // 2] if steps else 0
+    result = []
+    for (target_index, feature_index), (value, lag) in ranked:
+        target_slice, feature_slice = lag_slices(len(times), lag)
+        rolling = rolling_correlation(
+            features[feature_index][feature_slice],
+            targets[target_index][target_slice], window)
+        result.append({"counter": target_names[target_index],
+                       "metric": feature_names[feature_index],
+                       "r": value,
+                       "lag": lag,
+                       "lag secs": lag * step,
+                       "rolling": rolling_summary(rolling,
+                                                  1 if value > 0 else -1)})
+    return result
+
+
+def correlate(aligner, max_lag=3, window=30, top=5, min_samples=30):
+    """ Return {osd: ranked pairs} and ranking of pairs over cluster:
+        list of {"counter", "metric", "mean r", "osds"}, osds - number of
+        OSDs, where pair is in top """
+    if window < 2:
+        raise CorrelateException("Rolling window must be at least 2 samples")
+    per_osd = {}
+    for osd in aligner.osds():
+        times, target_names, targets, feature_names, features = \
+            aligner.columns(osd)
+        if len(times) < max(min_samples, window) or not target_names or \
+                not feature_names:
+            continue
+        per_osd[osd] = rank_osd(times, target_names, targets, feature_names,
+                                features, max_lag, window, top)
+    if not per_osd:
+        raise CorrelateException("Not enough samples of OSDs with system"
+                                 " metrics (collect them with -m)")
+    pairs = {}
+    for ranked in per_osd.values():
+        for item in ranked:
+            pairs.setdefault((item["counter"], item["metric"]),
+                             []).append(item["r"])
+    cluster = [{"counter": counter, "metric": metric,
+                "mean r": sum(values) / len(values), "osds": len(values)}
+               for (counter, metric), values in pairs.items()]
+    cluster.sort(key=lambda item: (-item["osds"], -abs(item["mean r"])))
+    return per_osd, cluster
+
+
+def format_report(per_osd, cluster):
+    """ Text lines of ranking """
+    lines = ["cluster: pairs in top of most OSDs"]
+    for item in cluster:
+        lines.append("  {0[counter]} ~ {0[metric]}: mean r {0[mean r]:+.2f}"
+                     " in {0[osds]} osds".format(item))
+    for osd in osd_sort(per_osd):
+        lines.append(osd)
+        for item in per_osd[osd]:
+            rolling = item["rolling"]
+            median = "-" if rolling["median"] is None else \
+                "%+.2f" % rolling["median"]
+            lines.append("  {0[counter]} ~ {0[metric]}: r {0[r]:+.2f}"
+                         " lag {0[lag]} ({0[lag secs]:.3g}s), rolling median"
+                         " {1}, stable {2:.0%}".format(item, median,
+                                                       rolling["stable"]))
+    return lines
+
+
+def parse_command_args(argv):
+    """ Command line parser """
+    parser = argparse.ArgumentParser(description="Rank correlations of OSD"
+                                     " latencies with system metrics")
+    parser.add_argument("filename", type=str,
+                        help="Result file of perfserver (with index)")
+    parser.add_argument("--start", type=str,
+                        help="Unix time or 'YYYY-MM-DD HH:MM[:SS]'")
+    parser.add_argument("--end", type=str,
+                        help="Unix time or 'YYYY-MM-DD HH:MM[:SS]'")
+    parser.add_argument("--node", type=str,
+                        help="Only OSDs of node with this ip")
+    parser.add_argument("--counters", type=str, nargs="+",
+                        help="Latencies GROUP.COUNTER to explain ('all' for"
+                             " all latencies, main osd and filestore ones"
+                             " by default)")
+    parser.add_argument("--lag", type=int, default=3,
+                        help="Max lag in samples (3 by default)")
+    parser.add_argument("--window", type=int, default=30,
+                        help="Rolling window in samples (30 by default)")
+    parser.add_argument("--top", type=int, default=5,
+                        help="Number of pairs for every OSD (5 by default)")
+    parser.add_argument("--min-samples", type=int, default=30,
+                        help="OSDs with less samples are skipped (30 by"
+                             " default)")
+    parser.add_argument("--diff", "-d", action="store_true",
+                        help="Data was collected with -d")
+    parser.add_argument("--output", "-o", type=str,
+                        help="Save ranking to json file")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    """ Print ranking of correlations """
+    args = parse_command_args(argv[1:])
+    if args.counters == ["all"]:
+        counters = None
+    else:
+        counters = args.counters or DEFAULT_COUNTERS
+    aligner = Aligner(counters, args.diff)
+    try:
+        start, end = resultlog.parse_time(args.start), \
+            resultlog.parse_time(args.end)
+        reader = resultlog.ResultLogReader(args.filename)
+        try:
+            for _, host, dump in reader.dumps(start, end, args.node):
+                aligner.add(dump, host)
+        finally:
+            reader.close()
+        per_osd, cluster = correlate(aligner, args.lag, args.window,
+                                     args.top, args.min_samples)
+    except (resultlog.ResultLogException, samples.SamplesException,
+            CorrelateException) as e:
+        sys.stderr.write("%s\n" % e)
+        return 1
+    for line in format_report(per_osd, cluster):
+        print line
+    if args.output is not None:
+        with open(args.output, "w") as output:
+            json.dump({"osds": per_osd, "cluster": cluster}, output,
+                      indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv))
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+""" Live terminal view of OSDs sorted by the worst latency """
+
+import time
+import curses
+import logging
+
+import samples
+
+
+# column title, width, row field, format
+COLUMNS = [("OSD", 10, "daemon", "%s"),
+           ("HOST", 16, "host", "%s"),
+           ("R OP/S", 9, "op_r", "%.1f"),
+           ("W OP/S", 9, "op_w", "%.1f"),
+           ("R MB/S", 9, "op_r_out_bytes", "%.2f"),
+           ("W MB/S", 9, "op_w_in_bytes", "%.2f"),
+           ("R LAT MS", 10, "op_r_latency", "%.2f"),
+           ("W LAT MS", 10, "op_w_latency", "%.2f")]
+
+# osd counters shown as rates and their multipliers
+RATE_COUNTERS = {"op_r": 1,
+                 "op_w": 1,
+                 "op_r_out_bytes": 1.0 / 2 ** 20,
+                 "op_w_in_bytes": 1.0 / 2 ** 20}
+
+# osd counters shown as average in interval (secs are shown as ms)
+LATENCY_COUNTERS = {"op_r_latency": 1000,
+                    "op_w_latency": 1000}
+
+OSD_GROUP = "osd"
+
+
+class Dashboard(object):
+    """ Sink, which shows OSD stats in curses screen
+        Screen is redrawn not often then refresh secs,
+        only changed cells are written """
+
+    def __init__(self, refresh=1, diff=False):
+        self.refresh = refresh
+        self.rates = samples.RateTracker(diff)
+        self.averager = samples.PairAverager(diff)
+        # daemon -> dict of row fields
+        self.rows = {}
+        self.screen = None
+        # (line, column) -> text on screen
+        self.cells = {}
+        self.size = None
+        self.last_draw = 0
+        self.dumps = 0
+
+    def start(self):
+        """ Init screen, logging is muted not to break it """
+        self.screen = curses.initscr()
+        curses.noecho()
+        curses.cbreak()
+        try:
+            curses.curs_set(0)
+        except curses.error:
+            # terminal can't hide cursor
+            pass
+        logging.disable(logging.WARNING)
+
+    def stop(self):
+        """ Restore terminal """
+        if self.screen is not None:
+            curses.nocbreak()
+            curses.echo()
+            curses.endwin()
+            self.screen = None
+        logging.disable(logging.NOTSET)
+
+    def add(self, host, dump):
+        """ Update rows by dump and redraw screen, if it is time """
+        timestamp = dump.get("time", time.time())
+        self.dumps += 1
+        for daemon, groups in dump.items():
+            if samples.osd_name(daemon) is None or \
+                    not isinstance(groups, dict) or \
+                    OSD_GROUP not in groups:
+                continue
+            row = self.rows.setdefault(daemon,
+                                       {"daemon": samples.osd_name(daemon)})
+            row["host"] = host
+            self.update_row(row, daemon, groups[OSD_GROUP], timestamp)
+        now = time.time()
+        if now - self.last_draw >= self.refresh:
+            self.last_draw = now
+            self.draw()
+
+    def update_row(self, row, daemon, counters, timestamp):
+        """ Set row fields by osd counters """
+        for name, scale in RATE_COUNTERS.items():
+            if name in counters:
+                rate = self.rates.rate((daemon, name), counters[name],
+                                       timestamp)
+                row[name] = None if rate is None else rate * scale
+        for name, scale in LATENCY_COUNTERS.items():
+            if name in counters:
+                value = self.averager.value((daemon, name), counters[name])
+                # no ops in interval - latency is unknown
+                row[name] = None if value is None else value * scale
+
+    def sorted_rows(self):
+        """ Rows sorted by the worst of latencies """
+        def worst(row):
+            return max(row.get(name) or 0 for name in LATENCY_COUNTERS)
+        return sorted(self.rows.values(), key=worst, reverse=True)
+
+    def draw(self):
+        """ Write changed cells and refresh screen """
+        if self.screen is None:
+            return
+        size = self.screen.getmaxyx()
+        if size != self.size:
+            # all cells are drawn again after resize
+            self.size = size
+            self.cells = {}
+            self.screen.clear()
+        height, width = size
+        self.set_cell(0, 0, width,
+                      "%i OSDs, %i dumps, %s" % (len(self.rows), self.dumps,
+                                                 time.strftime("%H:%M:%S")))
+        lines = [dict((field, title) for title, _, field, _ in COLUMNS)]
+        lines += self.sorted_rows()[:height - 3]
+        for line_no, row in enumerate(lines, 2):
+            pos = 0
+            for col_no, (_, col_width, field, fmt) in enumerate(COLUMNS):
+                value = row.get(field)
+                if value is None:
+                    text = "-"
+                elif line_no == 2:
+                    text = value
+                else:
+                    text = fmt % value
+                # numbers are aligned to the right
+                if col_no > 1:
+                    text = text.rjust(col_width - 1)
+                self.set_cell(line_no, pos, min(col_width, width - pos - 1),
+                              text)
+                pos += col_width
+                if pos >= width - 1:
+                    break
+        # rows of gone OSDs
+        for line_no in range(len(lines) + 2, height - 1):
+            self.set_cell(line_no, 0, width - 1, "")
+        self.screen.noutrefresh()
+        curses.doupdate()
+
+    def set_cell(self, line, pos, size, text):
+        """ Write text to screen, if it isn't there already """
+        if size <= 0:
+            return
+        text = text[:size - 1].ljust(size - 1)
+        if self.cells.get((line, pos)) == text:
+            return
+        self.cells[(line, pos)] = text
+        try:
+            self.screen.addstr(line, pos, text)
+        except curses.error:
+            # the last cell of screen can't be written
+            pass
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+""" Export of result file to columnar files for pandas and other tools
+    Data is written in long format, one row per counter value:
+        timestamp, node, daemon, group, counter, value
+    Latencies (avgcount/sum) are exported as their average in interval,
+    system metrics have daemon 'system metrics'.
+    Records are streamed by batches, so memory doesn't depend on file size.
+    Rows are buffered per node, every batch has rows of one node sorted
+    by counter, daemon and time.
+    Parquet (pyarrow required) - every batch is a row group, strings are
+    dictionary encoded, filters on node skip row groups of other nodes:
+        pyarrow.parquet.read_table("test.parquet",
+                                   filters=[("node", "=", "192.168.0.5")])
+    NPZ (numpy required) - every batch is part file in output folder,
+    strings are codes of dictionaries in manifest.json, which also lists
+    nodes and counters of parts, so read_npz loads only parts of needed
+    nodes.
+    python export.py test.log test.parquet --start '2015-12-01 14:00' """
+
+import os
+import sys
+import json
+import argparse
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+import samples
+import resultlog
+
+
+COLUMNS = ["timestamp", "node", "daemon", "group", "counter", "value"]
+STRING_COLUMNS = ["node", "daemon", "group", "counter"]
+
+MANIFEST = "manifest.json"
+
+# buffered rows, the biggest node buffer is written as row group of
+# parquet file or npz part file, when they are reached
+BATCH_ROWS = 200000
+
+
+class ExportException(Exception):
+    """ No library for format or bad npz folder """
+    pass
+
+
+def iter_rows(dumps, diff=False):
+    """ Yield rows (timestamp, node, daemon, group, counter, value)
+        from (time, node, dump) of result file """
+    averager = samples.PairAverager(diff)
+    for timestamp, node, dump in dumps:
+        timestamp = dump.get("time", timestamp)
+        node = node or ""
+        for daemon, group, counter, value in samples.iter_counters(dump):
+            value = averager.value((node, daemon, group, counter), value)
+            if value is not None:
+                yield timestamp, node, daemon, group, counter, float(value)
+
+
+def iter_batches(rows, size=BATCH_ROWS):
+    """ Yield lists of rows of one node sorted by counter, daemon and time
+        Not more than size rows are buffered """
+    # node -> rows
+    buffers = {}
+    buffered = 0
+    for row in rows:
+        buffers.setdefault(row[1], []).append(row)
+        buffered += 1
+        if buffered >= size:
+            node = max(buffers, key=lambda name: len(buffers[name]))
+            batch = buffers.pop(node)
+            buffered -= len(batch)
+            yield sort_batch(batch)
+    for node in sorted(buffers):
+        yield sort_batch(buffers[node])
+
+
+def sort_batch(batch):
+    """ Sort rows of node, so rows of counter are close to each other """
+    batch.sort(key=lambda row: (row[4], row[2], row[3], row[0]))
+    return batch
+
+
+class ParquetExporter(object):
+    """ Writes batches as row groups of parquet file """
+
+    def __init__(self, filename, compression="snappy"):
+        if pyarrow is None:
+            raise ExportException("pyarrow is required for parquet")
+        strings = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+        self.schema = pyarrow.schema(
+            [pyarrow.field("timestamp", pyarrow.timestamp("us"))] +
+            [pyarrow.field(name, strings) for name in STRING_COLUMNS] +
+            [pyarrow.field("value", pyarrow.float64())])
+        self.writer = pyarrow.parquet.ParquetWriter(
+            filename, self.schema, compression=compression,
+            use_dictionary=True)
+
+    def write(self, batch):
+        """ Write batch of rows """
+        columns = zip(*batch)
+        arrays = [pyarrow.array([int(timestamp * 1000000)
+                                 for timestamp in columns[0]],
+                                type=pyarrow.timestamp("us"))]
+        arrays.extend(pyarrow.array(column, type=pyarrow.string())
+                      .dictionary_encode() for column in columns[1:5])
+        arrays.append(pyarrow.array(columns[5], type=pyarrow.float64()))
+        table = pyarrow.Table.from_arrays(arrays, schema=self.schema)
+        self.writer.write_table(table, row_group_size=len(batch))
+
+    def close(self):
+        """ Finish file """
+        self.writer.close()
+
+
+class NpzExporter(object):
+    """ Writes batches as npz part files with string codes """
+
+    def __init__(self, path, compression=True):
+        if numpy is None:
+            raise ExportException("numpy is required for npz")
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.save = numpy.savez_compressed if compression else numpy.savez
+        # column -> list of strings, code is index
+        self.dictionaries = dict((name, []) for name in STRING_COLUMNS)
+        # column -> {string: code}
+        self.codes = dict((name, {}) for name in STRING_COLUMNS)
+        self.parts = []
+
+    def code(self, column, value):
+        """ Code of string in dictionary of column """
+        codes = self.codes[column]
+        code = codes.get(value)
+        if code is None:
+            code = len(codes)
+            codes[value] = code
+            self.dictionaries[column].append(value)
+        return code
+
+    def write(self, batch):
+        """ Write batch of rows to the next part file """
+        columns = zip(*batch)
+        arrays = {"timestamp": numpy.array(columns[0], dtype=numpy.float64),
+                  "value": numpy.array(columns[5], dtype=numpy.float64)}
+        for name, column in zip(STRING_COLUMNS, columns[1:5]):
+            arrays[name] = numpy.array([self.code(name, value)
+                                        for value in column],
+                                       dtype=numpy.int32)
+        filename = "part-%05i.npz" % len(self.parts)
+        self.save(os.path.join(self.path, filename), **arrays)
+        self.parts.append({"file": filename,
+                           "rows": len(batch),
+                           "start": min(columns[0]),
+                           "end": max(columns[0]),
+                           "node": sorted(set(arrays["node"].tolist())),
+                           "counter": sorted(set(
+                               arrays["counter"].tolist()))})
+        # manifest is valid after every part
+        self.write_manifest()
+
+    def write_manifest(self):
+        """ Save dictionaries and parts list """
+        manifest = os.path.join(self.path, MANIFEST)
+        with open(manifest + ".tmp", "w") as manifest_file:
+            json.dump({"columns": COLUMNS,
+                       "dictionaries": self.dictionaries,
+                       "parts": self.parts}, manifest_file)
+        os.rename(manifest + ".tmp", manifest)
+
+    def close(self):
+        """ Finish export """
+        self.write_manifest()
+
+
+def read_npz(path, nodes=None, counters=None):
+    """ Return dict column -> numpy array of rows of npz export with
+        given nodes and counters, parts without them are not read """
+    if numpy is None:
+        raise ExportException("numpy is required for npz")
+    try:
+        with open(os.path.join(path, MANIFEST)) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (IOError, ValueError) as e:
+        raise ExportException("Bad npz export %s: %s" % (path, e))
+    dictionaries = manifest["dictionaries"]
+    wanted = {}
+    for name, values in (("node", nodes), ("counter", counters)):
+        if values is not None:
+            wanted[name] = [code for code, value
+                            in enumerate(dictionaries[name])
+                            if value in values]
+    parts = []
+    for part in manifest["parts"]:
+        if any(not set(part[name]) & set(codes)
+               for name, codes in wanted.items()):
+            continue
+        data = numpy.load(os.path.join(path, part["file"]))
+        mask = numpy.ones(part["rows"], dtype=bool)
+        for name, codes in wanted.items():
+            mask &= numpy.in1d(data[name], codes)
+        parts.append(dict((name, data[name][mask]) for name in COLUMNS))
+    result = {}
+    for name in COLUMNS:
+        if parts:
+            column = numpy.concatenate([part[name] for part in parts])
+        else:
+            column = numpy.array([], dtype=numpy.int32
+                                 if name in STRING_COLUMNS else
+                                 numpy.float64)
+        if name in STRING_COLUMNS:
+            column = numpy.array(dictionaries[name] or [""],
+                                 dtype=object)[column]
+        result[name] = column
+    return result
+
+
+def create_exporter(output, export_format):
+    """ Exporter by format: parquet, npz or auto (by installed libs) """
+    if export_format == "auto":
+        if pyarrow is not None:
+            export_format = "parquet"
+        elif numpy is not None:
+            export_format = "npz"
+        else:
+            raise ExportException("Install pyarrow (parquet) or numpy (npz)")
+    if export_format == "parquet":
+        return ParquetExporter(output)
+    return NpzExporter(output)
+
+
+def export(dumps, exporter, diff=False, batch_rows=BATCH_ROWS):
+    """ Write rows of dumps by batches, return number of rows """
+    count = 0
+    try:
+        for batch in iter_batches(iter_rows(dumps, diff), batch_rows):
+            exporter.write(batch)
+            count += len(batch)
+    finally:
+        exporter.close()
+    return count
+
+
+def parse_command_args(argv):
+    """ Command line parser """
+    parser = argparse.ArgumentParser(description="Export result file to"
+                                     " parquet file or npz folder")
+    parser.add_argument("filename", type=str,
+                        help="Result file of perfserver (with index)")
+    parser.add_argument("output", type=str,
+                        help="Parquet file or folder for npz parts")
+    parser.add_argument("--format", "-f", type=str, default="auto",
+                        choices=["auto", "parquet", "npz"],
+                        help="Output format (parquet, if pyarrow is"
+                             " installed, npz otherwise)")
+    parser.add_argument("--start", type=str,
+                        help="Unix time or 'YYYY-MM-DD HH:MM[:SS]'")
+    parser.add_argument("--end", type=str,
+                        help="Unix time or 'YYYY-MM-DD HH:MM[:SS]'")
+    parser.add_argument("--node", type=str,
+                        help="Only records from node with this ip")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS,
+                        help="Buffered rows, row group or part file is"
+                             " not bigger (%i by default)" % BATCH_ROWS)
+    parser.add_argument("--diff", "-d", action="store_true",
+                        help="Data was collected with -d")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    """ Export result file """
+    args = parse_command_args(argv[1:])
+    try:
+        start, end = resultlog.parse_time(args.start), \
+            resultlog.parse_time(args.end)
+        reader = resultlog.ResultLogReader(args.filename)
+        try:
+            exporter = create_exporter(args.output, args.format)
+            count = export(reader.dumps(start, end, args.node), exporter,
+                           args.diff, args.batch_rows)
+        finally:
+            reader.close()
+    except (resultlog.ResultLogException, samples.SamplesException,
+            ExportException) as e:
+        sys.stderr.write("%s\n" % e)
+        return 1
+    print "%i rows exported to %s" % (count, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv))
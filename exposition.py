@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+""" Prometheus text exposition of the last received values
+    Every counter is a sample with labels host, daemon, group and counter:
+        ceph_counter - numbers,
+        ceph_counter_sum and ceph_counter_count - latencies (avgcount/sum),
+        so average latency is rate(sum) / rate(count)
+        (in diff mode they are values of the last interval)
+    Text of every host is rendered, when its dump is received, so scrape
+    only joins ready strings """
+
+import threading
+
+import samples
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# (family name, type, help)
+FAMILIES = [("ceph_counter", "gauge", "Value of ceph perf counter or system"
+             " metric"),
+            ("ceph_counter_sum", "counter", "Sum of ceph latency counter"),
+            ("ceph_counter_count", "counter", "Number of ops of ceph latency"
+             " counter"),
+            ("ceph_sample_time_seconds", "gauge", "Time of the last sample"
+             " of host")]
+
+LABELS = ("host", "daemon", "group", "counter")
+
+
+def escape(value):
+    """ Escape label value """
+    if isinstance(value, unicode):
+        value = value.encode("utf-8")
+    return value.replace("\\", "\\\\").replace("\"", "\\\"") \
+        .replace("\n", "\\n")
+
+
+def format_value(value):
+    """ Sample value, longs have no 'L' suffix """
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class Exposition(object):
+    """ Sink, which keeps rendered text of the last dump of every host """
+
+    def __init__(self, diff=False):
+        # in diff mode growing counters are differences
+        self.types = dict((family, "gauge" if diff else metric_type)
+                          for family, metric_type, _ in FAMILIES)
+        self.lock = threading.Lock()
+        # family -> {host: rendered lines}
+        self.blocks = dict((family, {}) for family, _, _ in FAMILIES)
+        # (host, daemon, group, counter) -> rendered labels
+        self.labels = {}
+
+    def get_labels(self, key):
+        """ Rendered labels of series, they are cached """
+        labels = self.labels.get(key)
+        if labels is None:
+            labels = "{" + ",".join("%s=\"%s\"" % (name, escape(value))
+                                    for name, value in zip(LABELS, key)) + \
+                "} "
+            self.labels[key] = labels
+        return labels
+
+    def add(self, host, dump):
+        """ Render counters of dump received from host """
+        numbers, sums, counts = [], [], []
+        for daemon, group, counter, value in samples.iter_counters(dump):
+            labels = self.get_labels((host, daemon, group, counter))
+            if samples.is_pair(value):
+                sums.append("ceph_counter_sum" + labels +
+                            format_value(value["sum"]))
+                counts.append("ceph_counter_count" + labels +
+                              format_value(value["avgcount"]))
+            else:
+                numbers.append("ceph_counter" + labels + format_value(value))
+        rendered = {"ceph_counter": numbers,
+                    "ceph_counter_sum": sums,
+                    "ceph_counter_count": counts}
+        if samples.is_number(dump.get("time")):
+            rendered["ceph_sample_time_seconds"] = [
+                "ceph_sample_time_seconds{host=\"%s\"} %s" %
+                (escape(host), format_value(dump["time"]))]
+        with self.lock:
+            for family, lines in rendered.items():
+                if lines:
+                    self.blocks[family][host] = "\n".join(lines) + "\n"
+                else:
+                    self.blocks[family].pop(host, None)
+
+    def render(self):
+        """ Text of all hosts for scrape """
+        with self.lock:
+            blocks = [self.blocks[family].values()
+                      for family, _, _ in FAMILIES]
+        text = []
+        for (family, _, help_text), host_blocks in zip(FAMILIES, blocks):
+            if not host_blocks:
+                continue
+            text.append("# HELP %s %s\n# TYPE %s %s\n" %
+                        (family, help_text, family, self.types[family]))
+            text.extend(host_blocks)
+        return "".join(text)
@@ -1,9 +1,26 @@
+#!/usr/bin/env python
+""" Analysis of server result file: statistics of latency and queue
+    counters of every daemon, saved as tables and json to resses folder.
+    File is split to chunks on record boundaries, chunks are mapped
+    to memory and processed in parallel, their partial statistics
+    are merged at the end.
+    With checkpoint file merged statistics and offset in result file
+    are saved after run, so the next run processes only new records.
+    Statistics are kept in time buckets, so stats of time windows and
+    of phases found by changes of cluster throughput are merged from
+    buckets without reading the file again """
+
 import re
 import os
 import sys
 import json
+import mmap
+import argparse
+import multiprocessing
 
-import texttable
+import samples
+import resultlog
+from sketch import DDSketch, SketchException
 
 
 filterok = ["queue", "latency"]
@@ -15,10 +32,25 @@ schema = {"avg": {"format": "[{0[avg]:.3g}, {0[dev]:.3g}]", "header": "[avg, dev
 
 logname = "test.log"
 
-if len(sys.argv) > 1:
-    logname = sys.argv[1]
-    # if len(sys.argv) > 2:
-    #     filterword = sys.argv[2]
+RECORD_SEPARATOR = "\n---\n"
+DUMP_PREFIX = "template"
+
+# chunks are not smaller, than this
+MIN_CHUNK = 2 ** 20
+
+CHECKPOINT_VERSION = 2
+
+# counter of osd operations, its rate is throughput of cluster
+OPS_COUNTER = ("osd", "op")
+
+# throughput below this is idle, its changes are not relative
+PHASE_MIN_RATE = 1.0
+
+
+class FilterException(Exception):
+    """ Bad checkpoint file or corrupt records """
+    pass
+
 
 def natural_sort(l):
     convert = lambda text: int(text) if text.isdigit() else text.lower()
@@ -48,73 +80,510 @@ def get_type(name):
     return "other"
 
 
+class CounterStats(object):
+    """ Mergeable statistics of counter values """
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.sumsq = 0.0
+        self.max = None
+        # min is the first value or the least positive one after it
+        self.first = None
+        self.min_positive = None
+        self.sketch = DDSketch()
+
+    def add(self, val):
+        """ Add value """
+        if self.count == 0:
+            self.first = val
+        self.count += 1
+        self.sum += val
+        self.sumsq += val * val
+        if self.max is None or val > self.max:
+            self.max = val
+        if val > 0 and (self.min_positive is None or
+                        val < self.min_positive):
+            self.min_positive = val
+        self.sketch.add(val)
+
+    def merge(self, other):
+        """ Add statistics of later values """
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.first = other.first
+        self.count += other.count
+        self.sum += other.sum
+        self.sumsq += other.sumsq
+        self.max = max(self.max, other.max)
+        if other.min_positive is not None and \
+                (self.min_positive is None or
+                 other.min_positive < self.min_positive):
+            self.min_positive = other.min_positive
+        self.sketch.merge(other.sketch)
+
+    def result(self):
+        """ Return dict of final statistics """
+        avg = self.sum / self.count if self.count else 0.0
+        if self.min_positive is None:
+            min_val = self.first
+        else:
+            min_val = min(self.first, self.min_positive)
+        dev = max(self.sumsq / self.count - avg * avg, 0) ** 0.5 \
+            if self.count else 0.0
+        return {"avg": avg,
+                "dev": dev,
+                "max": self.max,
+                "min": min_val,
+                "count": self.count,
+                "p50": self.sketch.quantile(0.5),
+                "p95": self.sketch.quantile(0.95)}
+
+    def to_dict(self):
+        """ Serializable state """
+        return {"count": self.count,
+                "sum": self.sum,
+                "sumsq": self.sumsq,
+                "max": self.max,
+                "first": self.first,
+                "min_positive": self.min_positive,
+                "sketch": self.sketch.to_dict()}
+
+    @classmethod
+    def from_dict(cls, state):
+        """ Statistics from to_dict result """
+        result = cls()
+        for field in ("count", "sum", "sumsq", "max", "first",
+                      "min_positive"):
+            setattr(result, field, state[field])
+        result.sketch = DDSketch.from_dict(state["sketch"])
+        return result
+
+
+def pair_value(old, new):
+    """ Average latency between two (sum, avgcount) pairs """
+    n = new[1] - old[1]
+    if n != 0:
+        return float(new[0] - old[0]) / n
+    return 0.0
+
+
+def complete_end(data, size):
+    """ End of the last complete record in the first size bytes of data
+        Server can be writing the last record right now """
+    pos = data.rfind(RECORD_SEPARATOR, 0, size)
+    if pos < 0:
+        return 0
+    record = data[pos + len(RECORD_SEPARATOR):size]
+    try:
+        json.loads(record[record.find("{"):])
+    except ValueError:
+        return pos
+    return size
+
+
+def find_chunks(filename, count, start=0):
+    """ Return list of (start, end) byte ranges of complete records of file
+        after start, every range begins with record separator """
+    size = os.path.getsize(filename)
+    if size <= start:
+        return []
+    count = max(1, min(count, (size - start) // MIN_CHUNK))
+    with open(filename, "rb") as log:
+        data = mmap.mmap(log.fileno(), size, access=mmap.ACCESS_READ)
+        try:
+            end = complete_end(data, size)
+            borders = [start]
+            for index in range(1, count):
+                pos = data.find(RECORD_SEPARATOR,
+                                max(start + (end - start) * index // count,
+                                    borders[-1] + 1), end)
+                if pos < 0:
+                    break
+                borders.append(pos)
+        finally:
+            data.close()
+    if end <= start:
+        return []
+    borders.append(end)
+    return zip(borders[:-1], borders[1:])
+
+
+def iter_dumps(data, start, end, bad=None):
+    """ Yield dumps of records, which begin in [start, end) of data
+        Offsets of corrupt dumps are added to bad list """
+    pos = data.find(RECORD_SEPARATOR, start, end)
+    while 0 <= pos < end:
+        offset = pos + len(RECORD_SEPARATOR)
+        pos = data.find(RECORD_SEPARATOR, offset)
+        record = data[offset:pos if pos >= 0 else len(data)]
+        # alerts, rollups and other records are skipped
+        if record.startswith(DUMP_PREFIX):
+            try:
+                dump = json.loads(record[len(DUMP_PREFIX):])
+            except ValueError:
+                if bad is not None:
+                    bad.append(offset)
+                continue
+            yield dump
+
+
+class Partials(object):
+    """ Statistics of part of result file by time buckets
+        For latencies (avgcount/sum) values are averages in intervals
+        between dumps, so the first pair of every counter in chunk is kept
+        to compute its value on the border with previous chunk """
+
+    def __init__(self, step=None):
+        # bucket size in secs, None - the whole file is one bucket
+        self.step = step
+        # (bucket, node, group, counter) -> CounterStats
+        self.stats = {}
+        # (node, group, counter) -> (bucket, pair) of the first latency
+        self.first_pairs = {}
+        # (node, group, counter) -> the last latency (sum, avgcount)
+        self.last_pairs = {}
+        # bucket -> {daemon: (time, value)} of the last ops counter value
+        self.ops = {}
+        # offsets of corrupt records, they are skipped
+        self.bad_records = []
+
+    def bucket(self, dump):
+        """ Bucket of dump """
+        if self.step is None:
+            return 0
+        timestamp = dump.get("time", 0)
+        return timestamp - timestamp % self.step
+
+    def counter(self, bucket, key):
+        """ CounterStats of counter in bucket """
+        counter = self.stats.get((bucket,) + key)
+        if counter is None:
+            counter = CounterStats()
+            self.stats[(bucket,) + key] = counter
+        return counter
+
+    def add_dump(self, dump):
+        """ Add counters of dump """
+        bucket = self.bucket(dump)
+        for node, value in dump.items():
+            # time and other sample fields
+            if not isinstance(value, dict):
+                continue
+            if self.step is not None and samples.osd_name(node):
+                self.add_ops(bucket, node, dump.get("time"), value)
+            for group, cs in value.items():
+                if not isinstance(cs, dict):
+                    continue
+                for c, val in cs.items():
+                    if not ok(c, filterok, filterno):
+                        continue
+                    key = (node, group, c)
+                    if samples.is_pair(val):
+                        self.add_pair(bucket, key,
+                                      (val["sum"], val["avgcount"]))
+                    elif isinstance(val, (int, long, float)):
+                        self.counter(bucket, key).add(val)
+
+    def add_pair(self, bucket, key, pair):
+        """ Add latency pair (sum, avgcount) """
+        last = self.last_pairs.get(key)
+        if last is None:
+            # value is known only, when previous chunk is merged
+            self.first_pairs[key] = (bucket, pair)
+        else:
+            self.counter(bucket, key).add(pair_value(last, pair))
+        self.last_pairs[key] = pair
+
+    def add_ops(self, bucket, daemon, timestamp, groups):
+        """ Keep the last value of ops counter of daemon in bucket """
+        group, counter = OPS_COUNTER
+        value = groups.get(group, {}).get(counter)
+        if timestamp is not None and isinstance(value, (int, long, float)):
+            self.ops.setdefault(bucket, {})[daemon] = (timestamp, value)
+
+    def merge(self, other):
+        """ Add partials of the next chunk """
+        for key, (bucket, pair) in other.first_pairs.items():
+            # values of latencies are counted from zero
+            last = self.last_pairs.get(key, (0, 0))
+            self.counter(bucket, key).add(pair_value(last, pair))
+        self.last_pairs.update(other.last_pairs)
+        for key, counter in other.stats.items():
+            self.counter(key[0], key[1:]).merge(counter)
+        self.bad_records.extend(other.bad_records)
+        for bucket, values in other.ops.items():
+            ops = self.ops.setdefault(bucket, {})
+            for daemon, value in values.items():
+                if daemon not in ops or ops[daemon][0] < value[0]:
+                    ops[daemon] = value
+
+    def buckets(self):
+        """ Sorted buckets """
+        return sorted(set(key[0] for key in self.stats) | set(self.ops))
+
+    def results(self, start=None, end=None):
+        """ Return statistics of buckets in [start, end) as
+            {node: {group: {counter: dict}}} """
+        merged = {}
+        for key in sorted(self.stats):
+            bucket = key[0]
+            if (start is not None and bucket < start) or \
+                    (end is not None and bucket >= end):
+                continue
+            merged.setdefault(key[1:], CounterStats()).merge(self.stats[key])
+        fdata = {}
+        for (node, group, c), counter in merged.items():
+            if counter.count == 0:
+                continue
+            fdata.setdefault(node, {}).setdefault(group, {})[c] = \
+                counter.result()
+        return fdata
+
+    def rates(self):
+        """ Return list of (bucket, ops per sec of all osds) """
+        result = []
+        last = {}
+        for bucket in sorted(self.ops):
+            total, known = 0.0, False
+            for daemon, (timestamp, value) in self.ops[bucket].items():
+                old = last.get(daemon)
+                last[daemon] = (timestamp, value)
+                # the first value or daemon restart
+                if old is None or value < old[1] or timestamp <= old[0]:
+                    continue
+                total += float(value - old[1]) / (timestamp - old[0])
+                known = True
+            if known:
+                result.append((bucket, total))
+        return result
 
-def med_dev(vals, med):
-    dev = ((sum(abs(med - i) ** 2 for i in vals) / len(vals)) ** 0.5)
-    return dev
+    def to_dict(self):
+        """ Serializable state of merged partials """
+        return {"step": self.step,
+                "counters": [list(key) + [counter.to_dict()]
+                             for key, counter in self.stats.items()],
+                "last_pairs": [list(key) + [list(pair)]
+                               for key, pair in self.last_pairs.items()],
+                "ops": [[bucket, daemon, timestamp, value]
+                        for bucket, values in self.ops.items()
+                        for daemon, (timestamp, value) in values.items()]}
 
+    @classmethod
+    def from_dict(cls, state):
+        """ Partials from to_dict result """
+        result = cls(state["step"])
+        for bucket, node, group, c, counter in state["counters"]:
+            result.stats[(bucket, node, group, c)] = \
+                CounterStats.from_dict(counter)
+        for node, group, c, pair in state["last_pairs"]:
+            result.last_pairs[(node, group, c)] = tuple(pair)
+        for bucket, daemon, timestamp, value in state["ops"]:
+            result.ops.setdefault(bucket, {})[daemon] = (timestamp, value)
+        return result
 
-def percetile(vals, p):
-    indf = p * len(vals) / 100.0
-    ind = int(round(indf))
-    if indf == ind:
-        # print len(vals), ind
-        return (vals[ind - 1] + vals[ind]) / 2.0
+
+def process_chunk(job):
+    """ Return Partials of chunk """
+    filename, start, end, step = job
+    partials = Partials(step)
+    with open(filename, "rb") as log:
+        data = mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for dump in iter_dumps(data, start, end, partials.bad_records):
+                partials.add_dump(dump)
+        finally:
+            data.close()
+    return partials
+
+
+def load_checkpoint(checkpoint):
+    """ Return (offset, merged partials) from checkpoint file """
+    try:
+        with open(checkpoint) as state_file:
+            state = json.load(state_file)
+        if state.get("version") != CHECKPOINT_VERSION:
+            raise FilterException("Unknown version of checkpoint %s" %
+                                  checkpoint)
+        return state["offset"], Partials.from_dict(state["partials"])
+    except (ValueError, KeyError, TypeError, SketchException) as e:
+        raise FilterException("Bad checkpoint %s: %s" % (checkpoint, e))
+
+
+def save_checkpoint(checkpoint, offset, partials):
+    """ Save offset and merged partials, file is replaced atomically """
+    state = {"version": CHECKPOINT_VERSION,
+             "offset": offset,
+             "partials": partials.to_dict()}
+    with open(checkpoint + ".tmp", "w") as state_file:
+        json.dump(state, state_file)
+    os.rename(checkpoint + ".tmp", checkpoint)
+
+
+def collect(filename=logname, processes=None, checkpoint=None, step=None,
+            skip_bad=False):
+    """ Return Partials of file merged from chunks
+        If checkpoint file is given, only records after its offset are
+        processed and checkpoint is updated
+        Corrupt records raise FilterException, unless skip_bad is set """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    offset, merged = 0, Partials(step)
+    if checkpoint is not None and os.path.exists(checkpoint):
+        offset, merged = load_checkpoint(checkpoint)
+        if merged.step != step:
+            raise FilterException("Checkpoint %s has bucket %s secs, remove"
+                                  " it or use the same --bucket" %
+                                  (checkpoint, merged.step))
+        # file was truncated or replaced
+        if offset > os.path.getsize(filename):
+            offset, merged = 0, Partials(step)
+    jobs = [(filename, start, end, step)
+            for start, end in find_chunks(filename, processes, offset)]
+    if len(jobs) > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            chunks = pool.map(process_chunk, jobs)
+        finally:
+            pool.close()
+            pool.join()
     else:
-        return vals[ind - 1]
+        chunks = [process_chunk(job) for job in jobs]
+
+    for partials in chunks:
+        merged.merge(partials)
+    if merged.bad_records and not skip_bad:
+        raise FilterException("%i corrupt records in %s (the first one at"
+                              " byte %i), use --skip-bad to skip them" %
+                              (len(merged.bad_records), filename,
+                               merged.bad_records[0]))
+    if checkpoint is not None:
+        save_checkpoint(checkpoint, jobs[-1][2] if jobs else offset, merged)
+    return merged
+
 
+def filter_data(filename=logname, processes=None, checkpoint=None):
+    """ Return statistics of file as {node: {group: {counter: dict}}} """
+    return collect(filename, processes, checkpoint).results()
 
-def filter_data():
-    fdata = {}
-    saved = {}
 
-    for line in open(logname):
-        if line.startswith("---"):
+def detect_phases(rates, step, change=0.3, persist=3):
+    """ Split list of (bucket, throughput) into phases of stable throughput
+        New phase starts, when throughput differs from mean of current
+        phase more than change part of it during persist buckets.
+        Return list of (start, end, mean throughput) """
+    phases = []
+    # current phase and pending buckets are [start, end, sum, n]
+    current = None
+    pending = None
+    sign = 0
+    for bucket, rate in rates:
+        if current is None:
+            current = [bucket, bucket + step, rate, 1]
             continue
-        data, _, nextdata = line.partition("template")
-        while len(nextdata) > 0:
-            data, _, nextdata = nextdata.partition("template")
-            data = json.loads(data)
-            for node, value in data.items():
-                for group, cs in value.items():
-                    for c in cs.keys():
-                        if ok(c, filterok, filterno):
-                            val = data[node][group][c]
-
-                            if isinstance(val, dict):
-                                oldval = saved.setdefault(node+group+c, [0, 0])
-                                s = val["sum"]-oldval[0]
-                                n = val["avgcount"]-oldval[1]
-                                saved[node+group+c] = [val["sum"], val["avgcount"]]
-                                if n != 0:
-                                    val = float(s)/(n)
-                                else:
-                                    val = 0.0
-                            # if c == "commitcycle_latency" and "7" in node:
-                            #     print val
-                            nodedata = fdata.setdefault(node, {})
-                            groupdata = nodedata.setdefault(group, {})
-                            if c not in groupdata:
-                                groupdata[c] = {}
-                                groupdata[c]["sum"] = val
-                                groupdata[c]["count"] = 1
-                                groupdata[c]["avg"] = val
-                                groupdata[c]["max"] = val
-                                groupdata[c]["min"] = val
-                                groupdata[c]["val"] = [val]
-                            else:
-                                groupdata[c]["sum"] += val
-                                groupdata[c]["count"] += 1
-                                groupdata[c]["val"].append(val)
-                                if val > groupdata[c]["max"]:
-                                    groupdata[c]["max"] = val
-                                if val < groupdata[c]["min"] and val > 0:
-                                    groupdata[c]["min"] = val
-    return fdata
-
-def save_results(fdata):
-    if not os.path.exists("resses"):
-        os.mkdir("resses")
+        mean = current[2] / current[3]
+        diff = rate - mean
+        if abs(diff) > change * max(abs(mean), PHASE_MIN_RATE):
+            new_sign = 1 if diff > 0 else -1
+            if pending is None or new_sign != sign:
+                pending, sign = [bucket, bucket + step, rate, 1], new_sign
+            else:
+                pending[1:] = [bucket + step, pending[2] + rate,
+                               pending[3] + 1]
+            if pending[3] >= persist:
+                phases.append(current)
+                current, pending = pending, None
+            continue
+        # short spike is a part of current phase
+        if pending is not None:
+            current[2] += pending[2]
+            current[3] += pending[3]
+            pending = None
+        current[1:] = [bucket + step, current[2] + rate, current[3] + 1]
+    if current is not None:
+        if pending is not None:
+            current[1:] = [pending[1], current[2] + pending[2],
+                           current[3] + pending[3]]
+        phases.append(current)
+    return [(start, end, total / count) for start, end, total, count
+            in phases]
+
+
+def parse_window_time(text, origin):
+    """ Time of window edge: '+SECS' from the first sample, unix time or
+        local date and time """
+    if text.startswith("+"):
+        return origin + float(text[1:])
+    return resultlog.parse_time(text)
+
+
+def get_windows(partials, window_args, phases, change, persist):
+    """ Return list of (name, start, end, mean throughput) and list of
+        pairs of names to compare: consecutive windows and phases """
+    buckets = partials.buckets()
+    origin = buckets[0] if buckets else 0
+    rates = partials.rates()
+    windows = []
+    for name, start, end in window_args or []:
+        try:
+            start = parse_window_time(start, origin)
+            end = parse_window_time(end, origin)
+        except (ValueError, resultlog.ResultLogException) as e:
+            raise FilterException("Bad window %s: %s" % (name, e))
+        windows.append((name, start, end))
+    pairs = [(old[0], new[0]) for old, new in zip(windows[:-1], windows[1:])]
+    if phases:
+        found = detect_phases(rates, partials.step, change, persist)
+        if found:
+            # the first bucket has no throughput, it is in the first phase
+            found[0] = (origin,) + found[0][1:]
+        names = ["phase%i" % (index + 1) for index in range(len(found))]
+        windows.extend((name, start, end) for name, (start, end, _)
+                       in zip(names, found))
+        pairs.extend(zip(names[:-1], names[1:]))
+    result = []
+    for name, start, end in windows:
+        in_window = [rate for bucket, rate in rates if start <= bucket < end]
+        mean = sum(in_window) / len(in_window) if in_window else None
+        result.append((name, start, end, mean))
+    return result, pairs
+
+
+def compare_windows(partials, windows, pairs):
+    """ Return {name: {"start", "end", "ops", "stats"}} and
+        {node: {group: {counter: {"windows": {name: avg},
+                                  "deltas": {"A->B": relative change}}}}}
+        deltas are for pairs of windows names """
+    wdata = {}
+    for name, start, end, rate in windows:
+        wdata[name] = {"start": start, "end": end, "ops": rate,
+                       "stats": partials.results(start, end)}
+    names = [name for name, _, _, _ in windows]
+    cdata = {}
+    for name in names:
+        for node, groups in wdata[name]["stats"].items():
+            for group, counters in groups.items():
+                for c, stats in counters.items():
+                    item = cdata.setdefault(node, {}).setdefault(
+                        group, {}).setdefault(c, {"windows": {},
+                                                  "deltas": {}})
+                    item["windows"][name] = stats["avg"]
+    for groups in cdata.values():
+        for counters in groups.values():
+            for item in counters.values():
+                values = item["windows"]
+                for old, new in pairs:
+                    if old in values and new in values and values[old]:
+                        item["deltas"]["%s->%s" % (old, new)] = \
+                            (values[new] - values[old]) / abs(values[old])
+    return wdata, cdata
+
+
+def save_results(fdata, resdir="resses"):
+    import texttable
+    if not os.path.exists(resdir):
+        os.mkdir(resdir)
     header = {}
 
     rowkeys = [key for key in natural_sort(fdata.keys()) if "osd" in key]
@@ -122,19 +591,6 @@ def save_results(fdata):
         for name, groups in nodedata.items():
             line = header.setdefault(name, set())
             for cn, cs in groups.items():
-                # compute avg etc
-                s = float(cs["sum"])
-                if cs["count"] != 0:
-                    cs["avg"] = s / cs["count"]
-                else:
-                    cs["avg"] = 0.0
-                cs["dev"] = med_dev(cs["val"], cs["avg"])
-                pdata = sorted(cs["val"])
-                cs["p50"] = percetile(pdata, 50)
-                cs["p95"] = percetile(pdata, 95)
-                # del common data
-                cs.pop("sum")
-                cs.pop("count")
                 if cs["avg"] != 0:
                     # hl = get_type(cn)
                     line.add(cn)
@@ -145,7 +601,7 @@ def save_results(fdata):
         for group, counters in header.items():
             newrow = [rowkey.split(".")[1]]
             for counter in counters:
-                if group in nodedata:
+                if group in nodedata and counter in nodedata[group]:
                     frmt = schema[get_type(counter)]["format"]
                     newrow.append(frmt.format(nodedata[group][counter]))
                 else:
@@ -162,15 +618,131 @@ def save_results(fdata):
         tab.header = cur_header
         for row in value:
             tab.add_row(row)
-        with  open("resses/res_table_{0}".format(group), "w") as res:
+        with open(os.path.join(resdir, "res_table_{0}".format(group)),
+                  "w") as res:
             res.write(tab.draw())
 
-
-    with open("resses/res_json", "w") as res:
+    with open(os.path.join(resdir, "res_json"), "w") as res:
         res.write(json.dumps(fdata, indent=2))
 
 
+def save_comparison(windows, pairs, wdata, cdata, resdir="resses"):
+    """ Save stats of windows and side by side tables of counter averages
+        in windows with their changes between consecutive windows """
+    import texttable
+    if not os.path.exists(resdir):
+        os.mkdir(resdir)
+    names = [name for name, _, _, _ in windows]
+    deltas = ["%s->%s" % pair for pair in pairs]
+
+    summary = texttable.Texttable(1000)
+    summary.header(["window", "start", "end", "op/s"])
+    for name, start, end, rate in windows:
+        summary.add_row([name, start, end, "" if rate is None else rate])
+    with open(os.path.join(resdir, "res_windows"), "w") as res:
+        res.write(summary.draw())
+
+    header = {}
+    for nodedata in cdata.values():
+        for group, counters in nodedata.items():
+            line = header.setdefault(group, set())
+            for c, item in counters.items():
+                if any(item["windows"].values()):
+                    line.add(c)
+
+    rowkeys = [key for key in natural_sort(cdata.keys()) if "osd" in key]
+    for group, counters in header.items():
+        counters = sorted(counters)
+        tab = texttable.Texttable(1000)
+        tab.set_deco(tab.HEADER | tab.VLINES | tab.BORDER | tab.HLINES)
+        cur_header = ["osd / {0}".format(group)]
+        for c in counters:
+            cur_header.extend("{0}\n{1}".format(c, name) for name in names)
+            cur_header.extend("{0}\n{1}".format(c, delta)
+                              for delta in deltas)
+        tab.header(cur_header)
+        for rowkey in rowkeys:
+            nodedata = cdata[rowkey].get(group, {})
+            newrow = [rowkey.split(".")[1]]
+            for c in counters:
+                item = nodedata.get(c, {"windows": {}, "deltas": {}})
+                newrow.extend("{0:.3g}".format(item["windows"][name])
+                              if name in item["windows"] else ''
+                              for name in names)
+                newrow.extend("{0:+.1%}".format(item["deltas"][delta])
+                              if delta in item["deltas"] else ''
+                              for delta in deltas)
+            tab.add_row(newrow)
+        with open(os.path.join(resdir, "res_compare_{0}".format(group)),
+                  "w") as res:
+            res.write(tab.draw())
+
+    with open(os.path.join(resdir, "res_windows_json"), "w") as res:
+        res.write(json.dumps(wdata, indent=2))
+    with open(os.path.join(resdir, "res_compare_json"), "w") as res:
+        res.write(json.dumps(cdata, indent=2))
+
+
+def parse_command_args(argv):
+    """ Command line parser """
+    parser = argparse.ArgumentParser(description="Statistics of latency and"
+                                     " queue counters from result file")
+    parser.add_argument("logname", type=str, nargs="?", default=logname,
+                        help="Result file of perfserver (test.log by"
+                             " default)")
+    parser.add_argument("--jobs", "-j", type=int,
+                        help="Number of processes (number of cpus by"
+                             " default)")
+    parser.add_argument("--resdir", "-o", type=str, default="resses",
+                        help="Folder for results (resses by default)")
+    parser.add_argument("--skip-bad", action="store_true",
+                        help="Skip corrupt records instead of stopping")
+    parser.add_argument("--checkpoint", "-c", type=str,
+                        help="File with state of previous run, only new"
+                             " records of result file are processed")
+    parser.add_argument("--window", "-w", nargs=3, action="append",
+                        metavar=("NAME", "START", "END"),
+                        help="Time window to compare, START and END are"
+                             " +SECS from the first sample, unix time or"
+                             " 'YYYY-MM-DD HH:MM[:SS]'")
+    parser.add_argument("--phases", action="store_true",
+                        help="Find phases by changes of cluster throughput"
+                             " and compare them")
+    parser.add_argument("--bucket", type=float, default=10,
+                        help="Time resolution of windows and phases in secs"
+                             " (10 by default)")
+    parser.add_argument("--phase-change", type=float, default=0.3,
+                        help="Relative change of throughput, which starts"
+                             " new phase (0.3 by default)")
+    parser.add_argument("--phase-persist", type=int, default=3,
+                        help="Number of buckets, which new throughput must"
+                             " last to start new phase (3 by default)")
+    return parser.parse_args(argv)
+
 
+def main(argv):
+    """ Analyse file and save results """
+    args = parse_command_args(argv[1:])
+    windowed = args.window or args.phases
+    try:
+        partials = collect(args.logname, args.jobs, args.checkpoint,
+                           args.bucket if windowed else None, args.skip_bad)
+        if windowed:
+            windows, pairs = get_windows(partials, args.window,
+                                         args.phases, args.phase_change,
+                                         args.phase_persist)
+    except FilterException as e:
+        sys.stderr.write("%s\n" % e)
+        return 1
+    if partials.bad_records:
+        sys.stderr.write("%i corrupt records are skipped\n" %
+                         len(partials.bad_records))
+    save_results(partials.results(), args.resdir)
+    if windowed:
+        wdata, cdata = compare_windows(partials, windows, pairs)
+        save_comparison(windows, pairs, wdata, cdata, args.resdir)
+    return 0
 
-save_results(filter_data())
 
+if __name__ == '__main__':
+    exit(main(sys.argv))
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+""" Streaming of received counters to time series database by line protocol
+    graphite - plaintext protocol:
+        PREFIX.HOST.DAEMON.GROUP.COUNTER VALUE TIMESTAMP
+    influx - InfluxDB line protocol, counters of group are fields:
+        PREFIX,host=HOST,daemon=DAEMON,group=GROUP COUNTER=VALUE,... NSECS
+        (over udp fields are split to several lines, so every line fits
+        into datagram)
+    Latencies (avgcount/sum) are sent as their average in interval.
+    Dumps are queued without blocking and formatted, batched and sent
+    in background thread. Queue and send buffer are bounded, dropped dumps
+    and lines are counted. Lost connection is restored with backoff """
+
+import re
+import math
+import time
+import Queue
+import socket
+import logging
+import threading
+
+import samples
+from logger import define_logger
+
+
+PROTOCOLS = ("graphite", "influx")
+
+# max payload of udp datagram, which isn't fragmented on usual networks
+UDP_PAYLOAD = 1400
+
+# reconnect delays grow from min to max
+MIN_BACKOFF = 0.5
+MAX_BACKOFF = 30
+
+# chars, which are not allowed in graphite path parts
+GRAPHITE_BAD_CHARS = re.compile(r"[^A-Za-z0-9_\-]")
+
+
+class LineSinkException(Exception):
+    """ Bad sink address """
+    pass
+
+
+def parse_address(address):
+    """ Return (transport, host, port) from tcp://HOST:PORT or
+        udp://HOST:PORT """
+    transport, _, rest = address.partition("://")
+    host, _, port = rest.rpartition(":")
+    if transport not in ("tcp", "udp") or not host:
+        raise LineSinkException("Bad sink address '%s', tcp://HOST:PORT or"
+                                " udp://HOST:PORT expected" % address)
+    try:
+        return transport, host, int(port)
+    except ValueError:
+        raise LineSinkException("Bad port in sink address '%s'" % address)
+
+
+def graphite_part(name):
+    """ Part of graphite path """
+    return GRAPHITE_BAD_CHARS.sub("_", name)
+
+
+def influx_escape(name):
+    """ Escape measurement, tag or field name """
+    return name.replace("\\", "\\\\").replace(",", "\\,") \
+        .replace("=", "\\=").replace(" ", "\\ ")
+
+
+def format_number(value):
+    """ Value as float, so type of field doesn't change between samples """
+    return repr(float(value))
+
+
+class LineSink(object):
+    """ Sink, which sends dumps to graphite or influxdb in background """
+
+    def __init__(self, address, protocol="graphite", prefix="ceph",
+                 queue_size=1000, buffer_size=4 * 2 ** 20, batch_size=65536,
+                 flush_interval=1.0, diff=False):
+        if protocol not in PROTOCOLS:
+            raise LineSinkException("Unknown protocol %s, use one of %s" %
+                                     (protocol, ", ".join(PROTOCOLS)))
+        self.transport, self.host, self.port = parse_address(address)
+        self.protocol = protocol
+        self.prefix = prefix
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.averager = samples.PairAverager(diff)
+        self.queue = Queue.Queue(queue_size)
+        # lines, which wait for sending, and their size in bytes
+        self.lines = []
+        self.buffered = 0
+        self.sock = None
+        self.next_connect = 0
+        self.backoff = MIN_BACKOFF
+        self.stop_event = threading.Event()
+        self.thread = None
+        # counters of sent and dropped data
+        self.sent = 0
+        self.dropped_dumps = 0
+        self.dropped_lines = 0
+
+    def add(self, host, dump):
+        """ Queue dump, it is dropped, if queue is full """
+        try:
+            self.queue.put_nowait((host, dump))
+        except Queue.Full:
+            self.dropped_dumps += 1
+
+    def start(self):
+        """ Start sending in background thread """
+        logger = logging.getLogger(__name__)
+        logger.info("Sending data to %s://%s:%i by %s protocol",
+                    self.transport, self.host, self.port, self.protocol)
+        self.thread = threading.Thread(target=self.send_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=5.0):
+        """ Send queued data (during timeout at most) and stop """
+        logger = logging.getLogger(__name__)
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                # daemon thread dies with server
+                logger.warning("Line sink hasn't sent all data in %.1f"
+                               " secs", timeout)
+                return
+            self.thread = None
+        self.close()
+        logger.info("Line sink: %i lines sent, %i dumps and %i lines"
+                    " dropped", self.sent, self.dropped_dumps,
+                    self.dropped_lines)
+
+    def stats(self):
+        """ Return dict of counters """
+        return {"sent": self.sent,
+                "dropped dumps": self.dropped_dumps,
+                "dropped lines": self.dropped_lines,
+                "queued": self.queue.qsize(),
+                "buffered": len(self.lines)}
+
+    def send_loop(self):
+        """ Format queued dumps and send them by batches """
+        last_flush = time.time()
+        while True:
+            try:
+                host, dump = self.queue.get(timeout=self.flush_interval)
+                self.buffer(self.format(host, dump))
+            except Queue.Empty:
+                if self.stop_event.is_set():
+                    break
+            now = time.time()
+            if self.buffered >= self.batch_size or \
+                    now - last_flush >= self.flush_interval:
+                self.flush(now)
+                last_flush = now
+        self.flush(time.time(), force=True)
+        # sink is unavailable at stop
+        self.dropped_lines += len(self.lines)
+        self.lines = []
+        self.buffered = 0
+
+    def format(self, host, dump):
+        """ Return lines of dump """
+        timestamp = dump.get("time", time.time())
+        values = []
+        for daemon, group, counter, value in samples.iter_counters(dump):
+            value = self.averager.value((host, daemon, group, counter),
+                                        value)
+            # influxdb doesn't accept nan and infinity
+            if value is not None and not math.isnan(value) and \
+                    not math.isinf(value):
+                values.append((daemon, group, counter, value))
+        if self.protocol == "graphite":
+            return self.format_graphite(host, timestamp, values)
+        return self.format_influx(host, timestamp, values)
+
+    def format_graphite(self, host, timestamp, values):
+        """ Graphite plaintext lines """
+        suffix = " %i\n" % timestamp
+        start = "%s.%s." % (self.prefix, graphite_part(host))
+        return ["%s%s.%s.%s %s%s" % (start, graphite_part(daemon),
+                                     graphite_part(group),
+                                     graphite_part(counter),
+                                     format_number(value), suffix)
+                for daemon, group, counter, value in values]
+
+    def format_influx(self, host, timestamp, values):
+        """ InfluxDB lines, one per group of daemon
+            (several ones over udp, if group doesn't fit into datagram) """
+        fields = {}
+        for daemon, group, counter, value in values:
+            fields.setdefault((daemon, group), []).append(
+                "%s=%s" % (influx_escape(counter), format_number(value)))
+        suffix = " %i\n" % int(timestamp * 10 ** 9)
+        start = "%s,host=%s" % (influx_escape(self.prefix),
+                                influx_escape(host))
+        lines = []
+        for (daemon, group), group_fields in sorted(fields.items()):
+            head = "%s,daemon=%s,group=%s " % (start, influx_escape(daemon),
+                                               influx_escape(group))
+            if self.transport != "udp":
+                lines.append(head + ",".join(group_fields) + suffix)
+                continue
+            line_fields = []
+            size = len(head) + len(suffix)
+            for field in group_fields:
+                if line_fields and size + len(field) + 1 > UDP_PAYLOAD:
+                    lines.append(head + ",".join(line_fields) + suffix)
+                    line_fields = []
+                    size = len(head) + len(suffix)
+                line_fields.append(field)
+                size += len(field) + 1
+            lines.append(head + ",".join(line_fields) + suffix)
+        return lines
+
+    def buffer(self, lines):
+        """ Add lines to send buffer, the oldest ones are dropped,
+            when it is full """
+        for line in lines:
+            if isinstance(line, unicode):
+                line = line.encode("utf-8")
+            if self.transport == "udp" and len(line) > UDP_PAYLOAD:
+                # it would fail on every flush
+                self.dropped_lines += 1
+                continue
+            self.lines.append(line)
+            self.buffered += len(line)
+        dropped = 0
+        while self.buffered > self.buffer_size:
+            self.buffered -= len(self.lines[dropped])
+            dropped += 1
+        if dropped:
+            del self.lines[:dropped]
+            self.dropped_lines += dropped
+
+    def connect(self, now):
+        """ Open socket, if it is time to try, return True on success """
+        if self.sock is not None:
+            return True
+        if now < self.next_connect:
+            return False
+        logger = logging.getLogger(__name__)
+        try:
+            if self.transport == "tcp":
+                self.sock = socket.create_connection((self.host, self.port),
+                                                     timeout=MAX_BACKOFF)
+            else:
+                self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self.sock.connect((self.host, self.port))
+        except socket.error as e:
+            self.sock = None
+            self.next_connect = now + self.backoff
+            logger.warning("Can't connect to %s:%i: %s, retry in %.1f secs",
+                           self.host, self.port, e, self.backoff)
+            self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+            return False
+        self.backoff = MIN_BACKOFF
+        logger.info("Connected to %s:%i", self.host, self.port)
+        return True
+
+    def close(self):
+        """ Close socket """
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def flush(self, now, force=False):
+        """ Send buffered lines by batches, unsent lines stay in buffer """
+        logger = logging.getLogger(__name__)
+        if force:
+            # stop must not wait for backoff
+            self.next_connect = 0
+        while self.lines and self.connect(now):
+            size = UDP_PAYLOAD if self.transport == "udp" else self.batch_size
+            count, length = 0, 0
+            while count < len(self.lines) and \
+                    (count == 0 or length + len(self.lines[count]) <= size):
+                length += len(self.lines[count])
+                count += 1
+            try:
+                self.sock.sendall("".join(self.lines[:count]))
+            except socket.error as e:
+                logger.warning("Sending to %s:%i failed: %s", self.host,
+                               self.port, e)
+                self.close()
+                self.next_connect = now + self.backoff
+                return
+            del self.lines[:count]
+            self.buffered -= length
+            self.sent += count
+
+
+define_logger(__name__)
@@ -4,11 +4,17 @@
 import re
 import zlib
 import json
+import struct
 import binascii
 import logging
+from operator import itemgetter
 
 import umsgpack as msgpack
 
+# numpy is slow to import, so collector packs arrays by struct
+# and server turns numpy on by enable_numpy()
+numpy = None
+
 from logger import define_logger
 
 # protocol contains 2 type of packet:
@@ -16,6 +22,12 @@ from logger import define_logger
 # 2 - body, which contains only values in order as in template
 #       it uses msgpack for optimization
 #
+# typed header is "typedtemplate" + TYPES + "\n" + header, where TYPES
+# has 'i' or 'f' for every value in template. Body for typed header is
+# msgpack envelope [FRAME_VERSION, INTS, FLOATS], where INTS is packed
+# array of little endian int64 (counters) and FLOATS - of float64
+# (times and averages), both in template order.
+#
 # packet has format:
 # begin_data_prefixSIZE\n\nDATAend_data_postfix
 # packet part has format:
@@ -24,17 +36,60 @@ from logger import define_logger
 # DATA use archivation
 
 
+FRAME_VERSION = 2
+
+
 class PacketException(Exception):
     """ Exceptions from Packet"""
     pass
 
 
+def enable_numpy():
+    """ Use numpy for arrays, if it is installed
+        Return True, if numpy is used """
+    global numpy
+    try:
+        import numpy as numpy_module
+    except ImportError:
+        return False
+    numpy = numpy_module
+    return True
+
+
+def pack_array(vals, code):
+    """ Pack list of numbers to little endian array
+        code is 'q' for int64 or 'd' for float64 """
+    if numpy is not None:
+        return numpy.array(vals, dtype="<" + code).tostring()
+    return struct.pack("<%i%s" % (len(vals), code), *vals)
+
+
+def unpack_array(raw, code):
+    """ Unpack little endian array of numbers to list """
+    if numpy is not None:
+        return numpy.frombuffer(raw, dtype="<" + code).tolist()
+    return list(struct.unpack("<%i%s" % (len(raw) // 8, code), raw))
+
+
+def make_getter(indexes):
+    """ Return function, which selects tuple of items by indexes """
+    if len(indexes) == 0:
+        return lambda vals: ()
+    if len(indexes) == 1:
+        index = indexes[0]
+        return lambda vals: (vals[index],)
+    return itemgetter(*indexes)
+
+
 class Packet(object):
     """ Class proceed packet by protocol"""
 
     prefix = "begin_data_prefix"
     postfix = "end_data_postfix"
     header_prefix = "template"
+    typed_header_prefix = "typedtemplate"
+    # json numbers, which will be replaced in template
+    value_re = re.compile(r": -?[0-9]+(\.[0-9]*)?([eE][-+]?[0-9]+)?")
     # other fields
     # is_begin
     # is_end
@@ -52,6 +107,16 @@ class Packet(object):
         self.srv_template = None
         self.clt_template = None
         self.tmpl_size = 0
+        # value types by template ('i' or 'f'), client nodes
+        # and selectors of typed values
+        self.types = None
+        self.nodes = None
+        self.get_ints = None
+        self.get_floats = None
+        self.get_ordered = None
+        # (key path, value) of strings and other values, which stay
+        # literal in template
+        self.clt_literals = None
 
 
     def new_packet(self, part):
@@ -100,14 +165,32 @@ class Packet(object):
                     raise PacketException("CRC error")
 
                 # check, if it is template
+                if self.data.startswith(self.typed_header_prefix):
+                    types, _, template = self.data[
+                        len(self.typed_header_prefix):].partition("\n")
+                    self.set_types(types)
+                    self.srv_template = self.get_typed_template(template)
+                    # template is for internal use
+                    return None
                 if self.data.startswith(self.header_prefix):
+                    self.types = None
                     self.srv_template = self.data
                     # template is for internal use
                     return None
 
-                # decode values list
-                vals = msgpack.unpackb(self.data)
-                dump = self.srv_template % tuple(vals)
+                if self.types is None:
+                    # decode values list
+                    vals = msgpack.unpackb(self.data)
+                    return self.srv_template % tuple(vals)
+
+                # decode typed arrays
+                version, ints, floats = msgpack.unpackb(self.data)
+                if version != FRAME_VERSION:
+                    raise PacketException("Unknown frame version")
+                vals = unpack_array(ints, "q") + unpack_array(floats, "d")
+                if len(vals) != self.tmpl_size:
+                    raise PacketException("Values count error")
+                dump = self.srv_template % self.get_ordered(vals)
                 return dump
             else:
                 return None
@@ -162,60 +245,126 @@ class Packet(object):
 
 
     def create_packet_v2(self, data, part_size):
-        """ Create """
+        """ Create packets with values of data
+            (and with template header, if it is first data or schema
+            is changed) """
         result = []
+        body = None
+        if self.srv_template is not None and set(data) == self.nodes:
+            try:
+                body = self.create_typed_body(data)
+            except PacketException:
+                # schema or types of values is changed
+                body = None
+
         # create and add to result template header
-        if self.srv_template is None:
+        if body is None:
             perf_string = json.dumps(data)
             self.create_answer_template(perf_string)
-            template = self.header_prefix + self.srv_template
+            self.nodes = set(data)
+            template = self.typed_header_prefix + "".join(self.types) + \
+                "\n" + self.header_prefix + self.srv_template
             header = Packet.create_packet(template, part_size)
             result.extend(header)
+            body = self.create_typed_body(data)
 
-        vals = self.get_matching_value_list(data)
-        body = msgpack.packb(vals)
         parts = Packet.create_packet(body, part_size)
         result.extend(parts)
         return result
 
 
+    def create_typed_body(self, data):
+        """ Pack values by template types to msgpack envelope """
+        vals = self.get_matching_value_list(data)
+        ints = self.get_ints(vals)
+        floats = self.get_floats(vals)
+        # counter can become float (e.g. in system metrics)
+        if float in set(map(type, ints)):
+            raise PacketException("Value types don't match last schema")
+        try:
+            return msgpack.packb([FRAME_VERSION,
+                                  pack_array(ints, "q"),
+                                  pack_array(floats, "d")])
+        except (struct.error, TypeError, ValueError, OverflowError):
+            raise PacketException("Value types don't match last schema")
+
+
+    def set_types(self, types):
+        """ Prepare selectors of typed values by types string """
+        self.types = list(types)
+        self.tmpl_size = len(self.types)
+        int_idx = [i for i, t in enumerate(self.types) if t == "i"]
+        float_idx = [i for i, t in enumerate(self.types) if t == "f"]
+        self.get_ints = make_getter(int_idx)
+        self.get_floats = make_getter(float_idx)
+        # positions of template values in ints + floats list
+        order = [0] * self.tmpl_size
+        for pos, i in enumerate(int_idx + float_idx):
+            order[i] = pos
+        self.get_ordered = make_getter(order)
+
+
+    def get_typed_template(self, template):
+        """ Return server template, where floats are inserted by repr
+            to save their precision """
+        parts = template.split(": %s")
+        if len(parts) != self.tmpl_size + 1:
+            raise PacketException("Template doesn't match types")
+        result = [parts[0]]
+        for value_type, part in zip(self.types, parts[1:]):
+            result.append(": %r" if value_type == "f" else ": %s")
+            result.append(part)
+        return "".join(result)
+
+
     def get_matching_value_list(self, data):
         """ Get values in order server expect"""
         vals = range(0, self.tmpl_size)
 
         try:
-            for node, groups in self.clt_template.items():
-                for group, counters in groups.items():
-                    for counter, index in counters.items():
-                        if  not isinstance(index, dict):
-                            vals[index] = data[node][group][counter]
-                        else:
-                            for k, i in index.items():
-                                vals[i] = data[node][group][counter][k]
+            for path, index in self.clt_template:
+                value = data
+                for key in path:
+                    value = value[key]
+                vals[index] = value
+
+            # template must be resent, when literal value is changed
+            for path, literal in self.clt_literals:
+                value = data
+                for key in path:
+                    value = value[key]
+                if value != literal:
+                    raise PacketException("Literal value is changed")
 
             return vals
 
-        except (IndexError, KeyError):
+        except (IndexError, KeyError, TypeError):
             logger = logging.getLogger(__name__)
-            logger.error("Data don't match last schema")
+            logger.warning("Data don't match last schema")
             raise PacketException("Data don't match last schema")
-           
+
 
 
     def create_answer_template(self, perf_string):
         """ Create template for server to insert counter values
             Return tuple of server and clien templates + number of replaces"""
-        replacer = re.compile(": [0-9]+\.?[0-9]*")
         # replace all values by %s
-        finditer = replacer.finditer(perf_string)
+        finditer = self.value_re.finditer(perf_string)
         # server not need know positions
         self.srv_template = ""
         # client need positions
         clt_template = ""
+        types = []
         beg = 0
         k = 0
         # this could be done better?
         for match in finditer:
+            # floats are written with point or exponent in json
+            if match.group(1) or match.group(2):
+                types.append("f")
+            else:
+                types.append("i")
+
             # define input place in server template
             self.srv_template += perf_string[beg:match.start()]
             self.srv_template += ": %s"
@@ -230,8 +379,22 @@ class Packet(object):
         self.srv_template += perf_string[beg:]
         clt_template += perf_string[beg:]
 
-        self.tmpl_size = k
-        self.clt_template = json.loads(clt_template)
+        self.set_types(types)
+        # list of (key path, value index) pairs
+        self.clt_template = []
+        self.clt_literals = []
+        self.add_template_paths(json.loads(clt_template), ())
+
+
+    def add_template_paths(self, tmpl, path):
+        """ Add paths of all value indexes in client template """
+        for key, value in tmpl.items():
+            if isinstance(value, dict):
+                self.add_template_paths(value, path + (key,))
+            elif isinstance(value, (int, long)):
+                self.clt_template.append((path + (key,), value))
+            else:
+                self.clt_literals.append((path + (key,), value))
 
 
 
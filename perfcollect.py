@@ -2,29 +2,37 @@
 
 """ Local utility for collecting perf counters and system info """
 
+import time
+# for startup benchmark
+IMPORT_START_TIME = time.time()
+
 import os
 import sys
 import json
-import time
-import glob
-import tarfile
+import math
+import bisect
 import logging
 import argparse
 import threading
-
-from contextlib import closing
+import collections
 
 from daemonize import Daemonize
 
 import ceph
 import sender
-import system
-# import sysmets
+from execute import ExecuteError
+# sysmets, system, adaptive, tarfile, glob and texttable are imported
+# only when they are needed, to start faster
 from logger import define_logger
 
+IMPORT_TIME = time.time() - IMPORT_START_TIME
+
 
 LOGGER_NAME = "perfcollect_app"
 
+# message from server to stop tool in per-run mode
+DIE_MESSAGE = "Time to die"
+
 extra_data_commands = [
     ("config", "show"),
     ("mon_status"),
@@ -56,12 +64,43 @@ def parse_command_args(argv):
                     help="Return only schema")
     ag.add_argument("--sysmetrics", "-m", action="store_true",
                     help="Add info about cpu, memory and disk usage")
+    ag.add_argument("--pss", action="store_true",
+                    help="Add pss of daemons to system metrics (smaps"
+                         " reading is slow for big processes)")
     ag.add_argument("--diff", "-d", action="store_true",
                     help="Return counters difference instead of value"
-                         " (work only in timeout mode)")
+                         " (work only in timeout mode, system metrics are"
+                         " kept as is)")
     ag.add_argument("--extradata", "-e", action="store_true",
                     help="To collect common data about cluster "
                          " (logs, confs, etc)")
+    ag.add_argument("--adaptive", type=str, nargs="+",
+                    metavar="GROUP:COUNTER[:THRESHOLD]",
+                    help="Watch counters and sample with burst interval,"
+                         " when they spike over threshold (or over rolling"
+                         " baseline, if threshold isn't set)")
+    ag.add_argument("--burst-interval", type=float,
+                    default=0.5, dest="burstinterval",
+                    help="Interval in secs after spike (0.5 by default)")
+    ag.add_argument("--burst-window", type=float,
+                    default=30, dest="burstwindow",
+                    help="Time in secs of burst sampling after the last"
+                         " spike (30 by default)")
+    ag.add_argument("--align", action="store_true",
+                    help="Take samples at wall clock multiples of interval,"
+                         " so all nodes sample at the same moments"
+                         " (clocks must be synchronized)")
+    ag.add_argument("--agent", "-a", action="store_true",
+                    help="Stay resident and wait for control commands"
+                         " from servers (other arguments are ignored)")
+    ag.add_argument("--control-port", "-p", type=int,
+                    default=9097, dest="controlport",
+                    help="Port for control commands in agent mode"
+                         " (9097 by default)")
+    ag.add_argument("--startup-bench", action="store_true",
+                    dest="startupbench",
+                    help="Print import and first sample latency and exit"
+                         " (tool is not daemonized)")
     # strings
     ag.add_argument("--config", "-g", type=str,
                     metavar="FILENAME",
@@ -79,7 +118,7 @@ def parse_command_args(argv):
                     default="/var/run/ceph/",
                     help="Path to ceph sockets (/var/run/ceph/ by default)")
     # int
-    ag.add_argument("--timeout", "-w", type=int,
+    ag.add_argument("--timeout", "-w", type=float,
                     help="If specified, tool will work in cycle"
                     " with specified timeout in secs")
 
@@ -109,16 +148,23 @@ def main():
         logger.error("Program terminated because of command line errors")
         exit(1)
 
-    if args.sysmetrics:
-        import sysmets
+    if args.agent:
+        Agent(args.runpath, args.controlport).run()
+        return
+
+    if args.startupbench:
+        print get_json_output(startup_bench(args))
+        return
 
     # prepare folder for extradata
+    dirname = None
     if args.extradata:
         dirname = "/tmp/perfcollect{0}".format(time.time())
         os.mkdir(dirname)
 
 
     # prepare info for send
+    udp_sender = None
     if args.remote is not None:
         udp_sender = sender.Sender(url=args.remote)
 
@@ -133,83 +179,430 @@ def main():
     # get local ceph socket list
     sock_list = ceph.get_socket_list(args.runpath)
 
-    # if in cycle mode with udp output - start waiting for die
-    if args.remote is not None and args.timeout is not None:
-        die_event, stop_event = wait_for_die(udp_sender)
+    # in cycle mode with udp output tool is controlled by server
+    if udp_sender is not None and args.timeout is not None:
+        run_remote_cycle(args, udp_sender, perf_counters, dirname)
     else:
-        stop_event = None
-
-    cache = None
+        collect_loop(args, sock_list, perf_counters, udp_sender, dirname)
 
-    try:
-
-        while True:
-            # get metrics by timer
-            if args.schemaonly:
-                # Returns schemas of listed ceph creatures perfs
-                perf_list = ceph.get_perf_data(sock_list, ("perf", "schema"), args.runpath)
-            else:
-                # Returns perf dump of listed ceph creatures
-                perf_list = ceph.get_perf_data(sock_list, ("perf", "dump"), args.runpath)
-                if perf_counters is not None:
-                    perf_list = select_counters(perf_counters, perf_list)
+    # save logs if needed
+    # and make archive
+    if args.extradata:
+        import tarfile
+        from contextlib import closing
+        save_logs(dirname)
+        with closing(tarfile.open("/tmp/extra_data.tar.gz", "w:gz")) as tar:
+            tar.add(dirname)
 
-            if args.sysmetrics:
-                system_metrics = sysmets.get_system_metrics(args.runpath)
 
-            if args.extradata:
-                save_extra_data(sock_list, args.runpath, dirname)
+def collect_loop(args, sock_list, perf_counters, udp_sender, dirname):
+    """ Collect data to stdout or send it once by udp """
+    if args.sysmetrics:
+        import sysmets
 
-            if args.remote is None:
-                # local use
-                if not args.schemaonly and args.table:
-                    print get_table_output(perf_list)
-                else:
-                    if args.sysmetrics:
-                        perf_list["system metrics"] = system_metrics
-                    if args.diff:
-                        new_data = perf_list
-                        perf_list = values_difference(cache, new_data)
-                        cache = new_data
-                    print get_json_output(perf_list)
+    cache = None
 
+    while True:
+        # get metrics by timer
+        if args.schemaonly:
+            # Returns schemas of listed ceph creatures perfs
+            perf_list = ceph.get_perf_data(sock_list, ("perf", "schema"), args.runpath)
+        else:
+            # Returns perf dump of listed ceph creatures
+            perf_list = ceph.get_perf_data(sock_list, ("perf", "dump"), args.runpath)
+            if perf_counters is not None:
+                perf_list = select_counters(perf_counters, perf_list)
+
+        if args.sysmetrics:
+            system_metrics = sysmets.get_system_metrics(args.runpath,
+                                                        args.pss)
+
+        if args.extradata:
+            save_extra_data(sock_list, args.runpath, dirname)
+
+        if udp_sender is None:
+            # local use
+            if not args.schemaonly and args.table:
+                print get_table_output(perf_list)
             else:
-                perf_list["time"] = time.time()
                 if args.sysmetrics:
                     perf_list["system metrics"] = system_metrics
                 if args.diff:
-                    if cache is not None:
-                        new_data = perf_list
-                        perf_list = values_difference(cache, new_data)
-                        cache = new_data
-                        send_by_udp(udp_sender, perf_list)
-                    else:
-                        cache = perf_list
-                else:
-                    send_by_udp(udp_sender, perf_list)
+                    new_data = perf_list
+                    perf_list = values_difference(cache, new_data)
+                    cache = new_data
+                print get_json_output(perf_list)
 
-            if args.timeout is None:
-                break
-            else:
-                if args.remote is not None and die_event.is_set():
-                    break
-                time.sleep(args.timeout)
-    except Exception as e:
-        # if anything wrong - need to kill thread
-        if stop_event is not None:
-            stop_event.set()
-        raise e
+        else:
+            perf_list["time"] = time.time()
+            if args.sysmetrics:
+                perf_list["system metrics"] = system_metrics
+            # there is no previous values for diff in one call
+            if not args.diff:
+                send_by_udp(udp_sender, perf_list)
 
-    # save logs if needed
-    # and make archive
-    if args.extradata:
-        save_logs(dirname)
-        with closing(tarfile.open("/tmp/extra_data.tar.gz", "w:gz")) as tar:
-            tar.add(dirname)
+        if args.timeout is None:
+            break
+        time.sleep(args.timeout)
+
+
+def run_remote_cycle(args, udp_sender, perf_counters, dirname):
+    """ Send data by timer, until server stops tool
+        Server can change collection by commands on its port + 1 """
+    # use port+1 because of conflict with server in case of local use
+    agent = Agent(args.runpath, udp_sender.sendto[1] + 1,
+                  trusted_ip=udp_sender.sendto[0])
+    agent.udp_sender = udp_sender
+    agent.config.update({"url": args.remote,
+                         "interval": args.timeout,
+                         "sysmetrics": args.sysmetrics,
+                         "pss": args.pss,
+                         "diff": args.diff,
+                         "counters": perf_counters,
+                         "schemaonly": args.schemaonly,
+                         "extradata_dir": dirname,
+                         "align": args.align,
+                         "streaming": True})
+    if args.adaptive is not None:
+        agent.config["adaptive"] = {"watch": args.adaptive,
+                                    "burst_interval": args.burstinterval,
+                                    "burst_window": args.burstwindow}
+        agent.sampler = create_sampler(args.timeout, agent.config["adaptive"])
+    agent.run()
+
+
+def align_time(now, interval):
+    """ Return the next wall clock moment, which is multiple of interval """
+    return (math.floor(now / interval) + 1) * interval
+
+
+def create_sampler(interval, settings):
+    """ Return AdaptiveSampler by settings dict (None if not adaptive)
+        Bad settings raise ValueError """
+    if settings is None:
+        return None
+    import adaptive
+    try:
+        watch = [adaptive.parse_watch(item) for item in settings["watch"]]
+        return adaptive.AdaptiveSampler(interval, settings["burst_interval"],
+                                        settings["burst_window"], watch)
+    except adaptive.AdaptiveException as e:
+        raise ValueError(str(e))
+
+
+def startup_bench(args):
+    """ Measure import time and latency of the first sample
+        (with packing as for udp send) """
+    start = time.time()
+    sock_list = ceph.get_socket_list(args.runpath)
+    perf_list = ceph.get_perf_data(sock_list, ("perf", "dump"), args.runpath)
+    perf_list["time"] = time.time()
+    if args.sysmetrics:
+        import sysmets
+        perf_list["system metrics"] = sysmets.get_system_metrics(args.runpath,
+                                                                 args.pss)
+    import packet
+    parts = packet.Packet().create_packet_v2(perf_list, 4096)
+    sample_time = time.time() - start
+
+    return {"import time": IMPORT_TIME,
+            "first sample time": sample_time,
+            "sockets": len(sock_list),
+            "packet parts": len(parts),
+            "loaded modules": len(sys.modules)}
+
+
+class Agent(object):
+    """ Resident collector, which streams data to servers by their
+        control commands. Commands and answers are json dicts:
+        {"command": "start", "url": "UDP://IP:PORT/SIZE", "interval": 5,
+         "sysmetrics": false, "pss": false, "diff": false, "counters": null,
+         "adaptive": {"watch": ["osd:op_w_latency:0.1"],
+                      "burst_interval": 0.5, "burst_window": 30}}
+        {"command": "stop"}
+        {"command": "set-interval", "interval": 0.5}
+        {"command": "set-filter", "counters": {"osd": ["op_w_latency"]}}
+        {"command": "set-adaptive", "adaptive": null or {...}}
+        {"command": "pause"}
+        {"command": "resume"}
+        {"command": "snapshot-now"}
+        {"command": "sample-at", "time": 1450000000.5}
+        {"command": "extradata"}
+        {"command": "status"}
+        {"command": "shutdown"}
+        answer is {"status": "ok" or "error", "config": {...}}
+        Command can have "id", a resent command with known id is not
+        done again, it gets the saved answer
+        Plain DIE_MESSAGE is shutdown too, it is answered by 'ok'
+        Samples, which have target time (sample-at or aligned schedule),
+        also have "target time" and "skew" - delay of collection start
+    """
+
+    # Event.wait polls in python 2, so the rest of it is slept
+    wait_precision = 0.05
+
+    # number of answers, which are kept for resent commands
+    saved_answers = 64
+
+
+    def __init__(self, runpath, control_port, trusted_ip=None):
+        self.runpath = runpath
+        self.control = sender.Sender(port=control_port, size=65535)
+        # if specified, commands from other hosts are ignored
+        self.trusted_ip = trusted_ip
+        self.lock = threading.Lock()
+        # set, when sampling loop must wake up before interval ends
+        self.wakeup = threading.Event()
+        self.stop_event = threading.Event()
+        self.config = {"url": None,
+                       "interval": 5,
+                       "sysmetrics": False,
+                       "pss": False,
+                       "diff": False,
+                       "counters": None,
+                       "schemaonly": False,
+                       "extradata_dir": None,
+                       "adaptive": None,
+                       "align": False,
+                       "streaming": False}
+        self.udp_sender = None
+        # AdaptiveSampler in adaptive mode
+        self.sampler = None
+        self.cache = None
+        # one sample is requested out of schedule
+        self.snapshot = False
+        # sorted target times of requested samples
+        self.sample_times = []
+        # command id -> answer
+        self.answers = collections.OrderedDict()
+
+    def run(self):
+        """ Agent loop: sample, while streaming is started """
+        logger = logging.getLogger(LOGGER_NAME)
+        logger.info("Agent is waiting for commands on port %i",
+                    self.control.bindto[1])
+        control = threading.Thread(target=self.control_thread)
+        control.start()
+        # target time of next aligned sample
+        next_time = None
+        try:
+            while not self.stop_event.is_set():
+                now = time.time()
+                with self.lock:
+                    config = dict(self.config)
+                    udp_sender = self.udp_sender
+                    sampler = self.sampler
+                    snapshot = self.snapshot
+                    self.snapshot = False
+                    target = None
+                    while self.sample_times and self.sample_times[0] <= now:
+                        target = self.sample_times.pop(0)
+                    first_request = self.sample_times[0] \
+                        if self.sample_times else None
+                if config["streaming"] and config["align"]:
+                    if next_time is not None and now >= next_time:
+                        target = next_time
+                    do_sample = target is not None or snapshot
+                else:
+                    do_sample = config["streaming"] or snapshot or \
+                        target is not None
+                if do_sample and udp_sender is not None:
+                    try:
+                        self.sample(config, udp_sender, sampler, target)
+                    except Exception as e:
+                        # daemon restart must not kill agent
+                        logger.error("Sample failed: %s", e)
+
+                if sampler is not None:
+                    interval = sampler.get_interval(time.time())
+                else:
+                    interval = config["interval"]
+                if config["streaming"] and config["align"]:
+                    next_time = align_time(time.time(), interval)
+                    deadline = next_time
+                elif config["streaming"]:
+                    deadline = time.time() + interval
+                else:
+                    deadline = None
+                if first_request is not None:
+                    deadline = min(deadline or first_request, first_request)
+                self.wait_until(deadline)
+        finally:
+            self.stop_event.set()
+            control.join()
+
+    def wait_until(self, deadline):
+        """ Wait till deadline (forever, if it is None) or wakeup """
+        if deadline is None:
+            self.wakeup.wait()
+        else:
+            timeout = deadline - time.time() - self.wait_precision
+            if timeout > 0:
+                self.wakeup.wait(timeout)
+            rest = deadline - time.time()
+            if not self.wakeup.is_set() and rest > 0:
+                time.sleep(rest)
+        self.wakeup.clear()
+
+    def sample(self, config, udp_sender, sampler=None, target=None):
+        """ Collect and send one sample with given config
+            Sample is tagged by interval, which is in force now """
+        start = time.time()
+        sock_list = ceph.get_socket_list(self.runpath)
+        if config["schemaonly"]:
+            perf_list = ceph.get_perf_data(sock_list, ("perf", "schema"),
+                                           self.runpath)
+        else:
+            perf_list = ceph.get_perf_data(sock_list, ("perf", "dump"),
+                                           self.runpath)
+        if config["counters"] is not None and not config["schemaonly"]:
+            perf_list = select_counters(config["counters"], perf_list)
+        if config["extradata_dir"] is not None:
+            save_extra_data(sock_list, self.runpath, config["extradata_dir"])
+        if config["sysmetrics"]:
+            import sysmets
+            perf_list["system metrics"] = \
+                sysmets.get_system_metrics(self.runpath, config["pss"])
+        now = time.time()
+        perf_list["time"] = now
+        if sampler is not None:
+            perf_list["interval"] = sampler.get_interval(now)
+            sampler.update(perf_list, now)
+        else:
+            perf_list["interval"] = config["interval"]
+        if target is not None:
+            perf_list["target time"] = target
+            perf_list["skew"] = start - target
+
+        if config["diff"]:
+            cache, self.cache = self.cache, perf_list
+            if cache is None:
+                return
+            perf_list = values_difference(cache, perf_list)
+        send_by_udp(udp_sender, perf_list)
+
+    def control_thread(self):
+        """ Receive commands and answer with effective config """
+        logger = logging.getLogger(LOGGER_NAME)
+        while not self.stop_event.is_set():
+            command = self.control.recv_command(self.stop_event)
+            if command is None:
+                break
+            data, remote_addr = command
+            if self.trusted_ip is not None and \
+                    remote_addr[0] != self.trusted_ip:
+                logger.warning("Command from %s is ignored", remote_addr[0])
+                continue
+            if data == DIE_MESSAGE:
+                logger.info("Stopped by server with message: %s", data)
+                self.handle_command({"command": "shutdown"})
+                self.control.answer("ok", remote_addr)
+                continue
+            try:
+                command = json.loads(data)
+                request_id = command.get("id")
+                if request_id is not None and request_id in self.answers:
+                    # answer was lost, command is done already
+                    logger.info("Command %s is resent", request_id)
+                    answer = self.answers[request_id]
+                else:
+                    answer = self.handle_command(command)
+                    if request_id is not None:
+                        self.save_answer(request_id, answer)
+            except (ValueError, KeyError, TypeError, AttributeError,
+                    sender.SenderException) as e:
+                logger.warning("Bad command %r: %s", data, e)
+                answer = {"status": "error", "message": str(e)}
+            except (EnvironmentError, ExecuteError) as e:
+                logger.warning("Command %r failed: %s", data, e)
+                answer = {"status": "error", "message": str(e)}
+            except Exception as e:
+                # agent without control thread can't be stopped by server
+                logger.exception("Command %r failed", data)
+                answer = {"status": "error", "message": str(e)}
+            self.control.answer(json.dumps(answer), remote_addr)
+
+    def save_answer(self, request_id, answer):
+        """ Keep answer for resent command, the oldest one is dropped """
+        self.answers[request_id] = answer
+        if len(self.answers) > self.saved_answers:
+            self.answers.popitem(last=False)
+
+    def handle_command(self, command):
+        """ Apply command and return answer """
+        logger = logging.getLogger(LOGGER_NAME)
+        name = command["command"]
+        logger.info("Command: %s", name)
+        if name == "extradata":
+            # archive of logs is long, sampling must not wait for it
+            save_extra_archive(ceph.get_socket_list(self.runpath),
+                               self.runpath)
+        with self.lock:
+            if name == "start":
+                sampler = create_sampler(command.get("interval",
+                                                     self.config["interval"]),
+                                         command.get("adaptive",
+                                                     self.config["adaptive"]))
+                if command["url"] != self.config["url"]:
+                    self.udp_sender = sender.Sender(url=command["url"])
+                    self.config["url"] = command["url"]
+                for key in ("interval", "sysmetrics", "pss", "diff",
+                            "counters", "adaptive", "align"):
+                    if key in command:
+                        self.config[key] = command[key]
+                self.sampler = sampler
+                self.cache = None
+                self.config["streaming"] = True
+            elif name in ("stop", "pause"):
+                self.config["streaming"] = False
+            elif name == "resume":
+                self.config["streaming"] = self.udp_sender is not None
+            elif name == "snapshot-now":
+                self.snapshot = self.udp_sender is not None
+            elif name == "sample-at":
+                if self.udp_sender is None:
+                    raise ValueError("Sample target is unknown, start first")
+                bisect.insort(self.sample_times, float(command["time"]))
+            elif name == "set-interval":
+                interval = float(command["interval"])
+                if interval <= 0:
+                    raise ValueError("Interval must be positive")
+                self.config["interval"] = interval
+                if self.sampler is not None:
+                    self.sampler.base_interval = interval
+            elif name == "set-adaptive":
+                self.sampler = create_sampler(self.config["interval"],
+                                              command["adaptive"])
+                self.config["adaptive"] = command["adaptive"]
+            elif name == "set-filter":
+                self.config["counters"] = command["counters"]
+                self.cache = None
+            elif name == "shutdown":
+                self.config["streaming"] = False
+                self.stop_event.set()
+            elif name not in ("status", "extradata"):
+                return {"status": "error",
+                        "message": "Unknown command %s" % name}
+            config = dict(self.config)
+        self.wakeup.set()
+        return {"status": "ok", "config": config}
+
+
+def save_extra_archive(socket_list, run_path):
+    """ Save extradata snapshot with logs to archive """
+    import tarfile
+    from contextlib import closing
+    dirname = "/tmp/perfcollect{0}".format(time.time())
+    os.mkdir(dirname)
+    save_extra_data(socket_list, run_path, dirname)
+    save_logs(dirname)
+    with closing(tarfile.open("/tmp/extra_data.tar.gz", "w:gz")) as tar:
+        tar.add(dirname)
 
 
 def save_extra_data(socket_list, run_path, dirname):
     """ Get and save extradata to files"""
+    import system
     cur_time = time.time()
     frmt = "{0} : {1} :\n{2}"
     for command in extra_data_commands:
@@ -227,6 +620,9 @@ def save_extra_data(socket_list, run_path, dirname):
 
 def save_logs(dirname):
     """ Prepare ceph logs to copy"""
+    import glob
+    import tarfile
+    from contextlib import closing
     logs_path = "/var/log/ceph/*.log"
     logs_name = "logs.tar.gz"
     full_path = os.path.join(dirname, logs_name)
@@ -236,18 +632,37 @@ def save_logs(dirname):
 
 
 def values_difference(cache, current):
-    """ Calculate difference between old values and new"""
+    """ Calculate difference between old values and new
+        Entities, groups and counters missing in either are skipped """
     if cache is None:
         return {"No later values" : "first iteration"}
     diff = {}
-    for block, values in cache.items():
+    for block, new_values in current.items():
+        # values without groups (like time, skew) and system metrics, which
+        # are rates and gauges already, are not changed
+        if not isinstance(new_values, dict) or block == "system metrics":
+            diff[block] = new_values
+            continue
+        values = cache.get(block)
+        if not isinstance(values, dict):
+            continue
         diff[block] = {}
-        for group, counters in values.items():
+        for group, new_group in new_values.items():
+            counters = values.get(group)
+            if not isinstance(new_group, dict) or \
+                    not isinstance(counters, dict):
+                continue
             diff[block][group] = {}
-            for counter, value in counters.items():
-                new_data = current[block][group][counter]
+            for counter, new_data in new_group.items():
+                if counter not in counters:
+                    continue
+                value = counters[counter]
                 # check for complex counters
-                if  not isinstance(value, dict):
+                if isinstance(value, basestring) or \
+                        (isinstance(value, dict) and "avgcount" not in value):
+                    # strings and metadata (devices) are passed as they are
+                    diff[block][group][counter] = new_data
+                elif not isinstance(value, dict):
                     diff[block][group][counter] = new_data - value
                 else:
                     diff[block][group][counter] = {}
@@ -351,32 +766,11 @@ def get_perfcounters_list_from_sysargs(args):
     return pc
 
 
-def wait_for_die(udp_sender):
-    """ Create socket in separate thread for to wait die signal"""
-    die_event = threading.Event()
-    stop_event = threading.Event()
-    server = threading.Thread(target=listening_thread,
-                              args=(udp_sender, die_event, stop_event))
-    server.start()
-    return die_event, stop_event
-
-
-def listening_thread(die_sender, die_event, stop_event):
-    """ Wait message from parent and set event to die """
-    # use port+1 because of conflict with server in case of local use
-    #die_sender = sender.Sender(port=port, host=host)
-
-    command = die_sender.recv_with_answer(stop_event)
-    # check, that it is not interruption
-    if command is not None:
-        data, remote_ip = command
-        if remote_ip == die_sender.sendto[0]:
-            logger = logging.getLogger(LOGGER_NAME)
-            logger.info("Stopped by server with message: %s", data)
-            die_event.set()
-
-
 if __name__ == '__main__':
-    pid = "/tmp/perfcollect_app%i.pid" % time.time()
-    daemon = Daemonize(app="perfcollect_app", pid=pid, action=main)
-    daemon.start()
+    if "--startup-bench" in sys.argv[1:]:
+        # benchmark prints to terminal, so it is not daemonized
+        main()
+    else:
+        pid = "/tmp/perfcollect_app%i.pid" % time.time()
+        daemon = Daemonize(app="perfcollect_app", pid=pid, action=main)
+        daemon.start()
@@ -3,21 +3,41 @@
 
 import os
 import sys
+import json
 import time
 import Queue
 import socket
 import logging
 import argparse
 import threading
+import uuid
 
+import packet
 import sender
+import sketch
+import rollup
+import anomaly
+import retention
+import resultlog
+import samples
+import linesink
+import exposition
+import queryserver
 from execute import execute, ExecuteError
 from logger import define_logger
-from ceph import get_osds_list, get_mons_or_mds_ips, get_osds_ips
+from ceph import get_osds_list, get_mons_or_mds_ips, get_osds_ips, \
+    get_osd_domains, CephException
 
 
 LOGGER_NAME = "io-perf-tool"
 
+# secs between sample-at command and its target time,
+# command is sent to all nodes at once, so it is enough for one resend
+SAMPLE_AT_LEAD = 1.0
+
+# secs between checks for termination
+TERM_POLL = 1.0
+
 
 def listen_thread(udp_sender, result, term_event):
     """ Main listenig thread for socket
@@ -29,10 +49,10 @@ def listen_thread(udp_sender, result, term_event):
 
         try:
             # return not None, if packet is ready
-            ready = udp_sender.recv_by_protocol()
+            remote_ip, ready = udp_sender.recv_packet()
 
             if ready is not None:
-                result.put(ready)
+                result.put((remote_ip, ready))
 
         except sender.Timeout:
             # no answer yet - check, if server want to kill us
@@ -54,16 +74,17 @@ def parse_command_args(argv):
     arg.add_argument("--user", "-u", type=str,
                      default="root",
                      help="User name for all hosts (root by default)")
-    arg.add_argument("--timeout", "-w", type=int,
+    arg.add_argument("--timeout", "-w", type=float,
                      default=5,
                      help="Time between collecting (5 by default)")
     arg.add_argument("--partsize", "-b", type=int,
                      default=4096,
                      help="Part size for udp packet (4096 by default)")
     # required params
-    arg.add_argument("--path-to-tool", "-t", type=str, required=True,
+    arg.add_argument("--path-to-tool", "-t", type=str,
                      metavar="PATH_TO_TOOL", dest="pathtotool",
-                     help="Path to remote utility perfcollect.py")
+                     help="Path to remote utility perfcollect.py"
+                          " (required, if --command is not used)")
     # params with value
     arg.add_argument("--save-to-file", "-s", type=str,
                      metavar="FILENAME", dest="savetofile",
@@ -75,9 +96,12 @@ def parse_command_args(argv):
     # flag params
     arg.add_argument("--sysmetrics", "-m", action="store_true",
                      help="Include info about cpu, memory and disk usage")
+    arg.add_argument("--pss", action="store_true",
+                     help="Include pss of daemons in system metrics (smaps"
+                          " reading is slow for big processes)")
     arg.add_argument("--diff", "-d", action="store_true",
                      help="Get not counters values, but their difference "
-                          "time by time")
+                          "time by time (system metrics are kept as is)")
     arg.add_argument("--copytool", "-y", action="store_true",
                      help="Copy tool to all nodes to path from -t")
     arg.add_argument("--totaltime", "-a", type=int,
@@ -86,8 +110,112 @@ def parse_command_args(argv):
     arg.add_argument("--extradata", "-e", action="store_true",
                     help="To collect common data about cluster "
                          " (logs, confs, etc)")
+    arg.add_argument("--adaptive", type=str, nargs="+",
+                     metavar="GROUP:COUNTER[:THRESHOLD]",
+                     help="Tools sample with burst interval, when watched"
+                          " counters spike")
+    arg.add_argument("--burst-interval", type=float,
+                     default=0.5, dest="burstinterval",
+                     help="Interval in secs after spike (0.5 by default)")
+    arg.add_argument("--burst-window", type=float,
+                     default=30, dest="burstwindow",
+                     help="Burst sampling time in secs after the last spike"
+                          " (30 by default)")
+    arg.add_argument("--query-port", "-q", type=int,
+                     metavar="PORT", dest="queryport",
+                     help="Keep recent counters in memory and answer"
+                          " queries on http://127.0.0.1:PORT/")
+    arg.add_argument("--anomaly", action="store_true",
+                     help="Find OSDs with latencies much bigger than peers"
+                          " have, alerts are logged and saved to file")
+    arg.add_argument("--anomaly-threshold", type=float,
+                     default=3.5, dest="anomalythreshold",
+                     help="Robust z-score of outlier (3.5 by default)")
+    arg.add_argument("--anomaly-sustain", type=int,
+                     default=5, dest="anomalysustain",
+                     help="Intervals in a row for sustained deviation"
+                          " alert (5 by default)")
+    arg.add_argument("--rollup", action="store_true",
+                     help="Save sum, mean and max of OSD counters over"
+                          " cluster, nodes and crush domains every interval")
+    arg.add_argument("--rollup-counters", type=str, nargs="+",
+                     metavar="GROUP:COUNTER", dest="rollupcounters",
+                     help="Counters for rollups (main osd op counters"
+                          " by default)")
+    arg.add_argument("--crush-domains", type=str, nargs="+",
+                     default=["rack"], metavar="TYPE", dest="crushdomains",
+                     help="Crush bucket types for rollups (rack by default)")
+    arg.add_argument("--retention-dir", type=str,
+                     metavar="DIR", dest="retentiondir",
+                     help="Store received data in DIR by hour segments,"
+                          " which are compacted by retention tiers")
+    arg.add_argument("--retention", type=str, nargs="+",
+                     default=retention.DEFAULT_TIERS, metavar="STEP:KEEP",
+                     help="Retention tiers: raw data is kept KEEP time,"
+                          " then it is aggregated by the next STEP"
+                          " (%s by default)" %
+                          " ".join(retention.DEFAULT_TIERS))
+    arg.add_argument("--sketch-file", type=str,
+                     metavar="FILENAME", dest="sketchfile",
+                     help="Save latency quantile sketches of the run to"
+                          " file (merge runs by sketch.py)")
+    arg.add_argument("--ring-size", type=int,
+                     default=3600, dest="ringsize",
+                     help="Points per counter in memory (3600 by default)")
+    arg.add_argument("--line-sink", type=str,
+                     metavar="tcp|udp://HOST:PORT", dest="linesink",
+                     help="Send received counters to graphite or influxdb")
+    arg.add_argument("--line-protocol", type=str,
+                     default="graphite", choices=linesink.PROTOCOLS,
+                     dest="lineprotocol",
+                     help="Protocol of --line-sink (graphite by default)")
+    arg.add_argument("--line-prefix", type=str,
+                     default="ceph", dest="lineprefix",
+                     help="Graphite path prefix or influxdb measurement"
+                          " (ceph by default)")
+    arg.add_argument("--top", action="store_true",
+                     help="Show live table of OSDs sorted by the worst"
+                          " latency instead of log")
+    arg.add_argument("--align", action="store_true",
+                     help="Tools sample at wall clock multiples of timeout,"
+                          " so samples of all nodes are taken together")
+    arg.add_argument("--agent-port", "-g", type=int,
+                     metavar="PORT", dest="agentport",
+                     help="Control resident tools (perfcollect.py --agent)"
+                          " on PORT instead of starting them by ssh")
+    arg.add_argument("--start-agents", action="store_true",
+                     dest="startagents",
+                     help="Start resident tools by ssh before run"
+                          " (--agent-port required)")
+    arg.add_argument("--command", "-c", type=str,
+                     metavar="COMMAND",
+                     help="Send command to running tools and exit: pause,"
+                          " resume, snapshot-now, status, 'set-interval SECS',"
+                          " 'set-filter FILENAME', 'sample-at [SECS]' (sample"
+                          " on all nodes in SECS, 1 by default)"
+                          " or json command")
+    arg.add_argument("--hosts", type=str, nargs="+",
+                     metavar="IP",
+                     help="Hosts for --command (all ceph nodes by default)")
 
-    return arg.parse_args(argv)
+    args = arg.parse_args(argv)
+    if args.command is None and args.pathtotool is None:
+        arg.error("argument --path-to-tool/-t is required")
+    try:
+        args.retention = retention.parse_tiers(args.retention)
+    except retention.RetentionException as e:
+        arg.error(str(e))
+    if args.linesink is not None:
+        try:
+            linesink.parse_address(args.linesink)
+        except linesink.LineSinkException as e:
+            arg.error(str(e))
+    if args.rollupcounters is not None:
+        try:
+            args.rollupcounters = rollup.parse_counters(args.rollupcounters)
+        except ValueError as e:
+            arg.error(str(e))
+    return args
 
 
 def real_main(args, term_event):
@@ -116,6 +244,9 @@ def real_main(args, term_event):
     if args.copytool:
         copy_tool(ip_list, args.pathtotool, args.user, localy)
 
+    # decode values by numpy, if it is installed
+    packet.enable_numpy()
+
     # start socket listening
     udp_sender = sender.Sender(port=int(args.port), size=int(args.partsize))
     result = Queue.Queue()
@@ -124,20 +255,124 @@ def real_main(args, term_event):
                                     result, term_event))
     server.start()
     start_time = time.time()
+
+    # result file with index
+    result_log = None
+    if args.savetofile is not None:
+        result_log = resultlog.ResultLog(args.savetofile)
+
+    # consumers of decoded dumps
+    sinks = []
+    query_server = None
+    if args.queryport is not None:
+        store = samples.RingStore(args.ringsize, args.diff)
+        sinks.append(store)
+        metrics = exposition.Exposition(args.diff)
+        sinks.append(metrics)
+    sketches = None
+    if args.queryport is not None or args.sketchfile is not None:
+        sketches = samples.SketchStore(args.diff)
+        sinks.append(sketches)
+    rollups = None
+    if args.rollup:
+        rollups = create_rollups(args, result_log)
+        sinks.append(rollups)
+    detector = None
+    if args.anomaly:
+        detector = create_anomaly_detector(args, result_log)
+        sinks.append(detector)
+    line_sink = None
+    if args.linesink is not None:
+        line_sink = linesink.LineSink(args.linesink, args.lineprotocol,
+                                      args.lineprefix, diff=args.diff)
+        sinks.append(line_sink)
+        line_sink.start()
+    if args.queryport is not None:
+        query_server = queryserver.QueryServer(store, args.queryport,
+                                               sketches=sketches,
+                                               metrics=metrics)
+        query_server.start()
     if args.totaltime is not None:
         logger.info("Tests will be finished in a %d sec", args.totaltime)
 
     # begin to collect counters
 
-    # supress connection to localhost
-    cmd = prepare_tool_cmd(args)
-    if localy:
-        start_tool_localy(cmd)
-
-    get_perfs_from_all_nodes(args.user, cmd, ip_list)
+    if args.agentport is not None:
+        agent_ips = list(ip_list)
+        if localy:
+            agent_ips.append(args.localip)
+        if args.startagents:
+            start_agents(args, ip_list, localy)
+        start_command = prepare_agent_start_command(args)
+        control_agents(agent_ips, udp_sender, args.agentport, start_command)
+    else:
+        # supress connection to localhost
+        cmd = prepare_tool_cmd(args)
+        if localy:
+            start_tool_localy(cmd)
+
+        get_perfs_from_all_nodes(args.user, cmd, ip_list)
 
     logger.info("Collect daemons started, now waiting for answer...")
 
+    dashboard = None
+    if args.top:
+        import dashboard as dashboard_view
+        dashboard = dashboard_view.Dashboard(args.timeout or 1, args.diff)
+        sinks.append(dashboard)
+        dashboard.start()
+    retention_store = None
+    if args.retentiondir is not None:
+        retention_store = retention.RetentionStore(args.retentiondir,
+                                                   args.retention,
+                                                   diff=args.diff)
+        retention_store.start()
+    try:
+        receive_loop(args, result, sinks, term_event, start_time,
+                     result_log, retention_store)
+    finally:
+        if retention_store is not None:
+            retention_store.stop()
+        if dashboard is not None:
+            dashboard.stop()
+
+    # wait for server termination
+    server.join()
+    if detector is not None:
+        detector.flush()
+    if rollups is not None:
+        rollups.flush()
+    for name, sink in (("Anomaly detector", detector), ("Rollups", rollups)):
+        if sink is not None and sink.buckets.dropped:
+            logger.warning("%s: %i dumps came after their interval and"
+                           " were dropped", name, sink.buckets.dropped)
+    if result_log is not None:
+        result_log.close()
+    if query_server is not None:
+        query_server.stop()
+    if line_sink is not None:
+        line_sink.stop()
+    if args.sketchfile is not None:
+        sketch.save_sketch_file(args.sketchfile, sketches.items())
+        logger.info("Latency sketches are saved to %s", args.sketchfile)
+    if args.agentport is not None:
+        # agents stay resident, only streaming is stopped
+        control_agents(agent_ips, udp_sender, args.agentport,
+                       {"command": "stop"})
+        if args.extradata:
+            control_agents(agent_ips, udp_sender, args.agentport,
+                           {"command": "extradata"})
+    else:
+        # kill remote tool (if it is not killed yet)
+        send_die_to_tools(ip_list, udp_sender, localy, args.localip)
+    if args.extradata:
+        collect_extra_results(ip_list, args.user, localy)
+
+
+def receive_loop(args, result, sinks, term_event, start_time,
+                 result_log=None, retention_store=None):
+    """ Save received data and give it to sinks, until run is over """
+    logger = logging.getLogger(LOGGER_NAME)
     while not term_event.is_set():
         # stop if timeout is setted
         if args.totaltime is not None:
@@ -148,30 +383,27 @@ def real_main(args, term_event):
                 logger.info("Test time is over")
                 break
             # wait not more than remaining
-            really_big_timeout = args.totaltime - time_now
+            really_big_timeout = min(args.totaltime - time_now, TERM_POLL)
         else:
-            # without any timeout KeyboardInterrupt will not raise
-            really_big_timeout = sys.maxint
+            # check for ctrl+c from main thread from time to time
+            really_big_timeout = TERM_POLL
         try:
-            data = result.get(timeout=really_big_timeout)
+            remote_ip, data = result.get(timeout=really_big_timeout)
             # proceed returned data
-            if args.savetofile is None:
-                logger.info(data)
+            if result_log is None:
+                # dashboard shows data instead of log
+                if not args.top:
+                    logger.info(data)
             else:
-                with open(args.savetofile, 'a') as f:
-                    f.write("\n---\n")
-                    f.write(data)
+                result_log.write(data, remote_ip)
+            if retention_store is not None:
+                retention_store.write(remote_ip, data)
+            if sinks:
+                feed_sinks(sinks, remote_ip, data)
         except Queue.Empty:
             # no matter - timeout finish before info come
             continue
 
-    # wait for server termination
-    server.join()
-    # kill remote tool (if it is not killed yet)
-    send_die_to_tools(ip_list, udp_sender, localy, args.localip)
-    if args.extradata:
-        collect_extra_results(ip_list, args.user, localy)
-
 
 def main(argv):
     """ Shell for main because of ctrl-c exit """
@@ -179,6 +411,8 @@ def main(argv):
     logger = define_logger(LOGGER_NAME)
     # parse command line
     args = parse_command_args(argv[1:])
+    if args.command is not None:
+        return send_control_command(args)
     # create termination event
     term_event = threading.Event()
     # start main thread
@@ -190,8 +424,9 @@ def main(argv):
     try:
         # this part only waits for ctrl+c
         # or for timeout termination from main thread
+        # (wait with timeout, because only it can be interrupted)
         while not term_event.is_set():
-            pass
+            term_event.wait(TERM_POLL)
 
     except KeyboardInterrupt:
         logger.info("Finalization...")
@@ -228,12 +463,58 @@ def test_ips(ip_list):
     ip_list = ips
 
 
+def create_anomaly_detector(args, result_log=None):
+    """ Return detector, which logs alerts and saves them to result file """
+    def emit(alert):
+        anomaly.log_alert(alert)
+        if result_log is not None:
+            result_log.write(anomaly.format_alert(alert))
+    return anomaly.AnomalyDetector(args.timeout or 1, emit,
+                                   threshold=args.anomalythreshold,
+                                   sustain=args.anomalysustain,
+                                   diff=args.diff)
+
+
+def create_rollups(args, result_log=None):
+    """ Return rollups sink, which saves records to result file """
+    logger = logging.getLogger(LOGGER_NAME)
+    def emit(record):
+        if result_log is not None:
+            result_log.write(rollup.format_rollup(record))
+        elif not args.top:
+            logger.info(rollup.format_rollup(record))
+    try:
+        domains = get_osd_domains()
+    except CephException:
+        logger.warning("Crush tree is unknown, rollups are done"
+                       " only for cluster and nodes")
+        domains = {}
+    return rollup.Rollups(args.timeout or 1, emit,
+                          counters=args.rollupcounters,
+                          domains=domains,
+                          domain_types=args.crushdomains,
+                          diff=args.diff)
+
+
+def feed_sinks(sinks, remote_ip, data):
+    """ Give decoded dump to all sinks """
+    logger = logging.getLogger(LOGGER_NAME)
+    try:
+        dump = samples.parse_dump(data)
+    except samples.SamplesException as e:
+        logger.warning("Data from %s is skipped: %s", remote_ip, e)
+        return
+    for sink in sinks:
+        sink.add(remote_ip, dump)
+
+
 def copy_tool(ip_list, path, user, localy=False):
     """ Copy tool and libs to specified ips on path"""
     logger = logging.getLogger(LOGGER_NAME)
     tool_names = ["perfcollect.py", "sysmets.py", "ceph_srv_info.py",
                   "sender.py", "packet.py", "logger.py", "ceph.py",
-                  "daemonize.py", "umsgpack.py", "sh.py", "execute.py"]
+                  "daemonize.py", "umsgpack.py", "sh.py", "execute.py",
+                  "procfs.py", "adaptive.py"]
     bad_ips = []
     for ip in ip_list:
         try:
@@ -290,19 +571,128 @@ def prepare_tool_cmd(args):
     extra_data = args.extradata
 
     # prepare args
-    params = "-u UDP://%s:%s/%s -w %i" % (local_ip, port, part_size, timeout)
+    params = "-u UDP://%s:%s/%s -w %s" % (local_ip, port, part_size, timeout)
     if sysmets:
         params += " -m"
+    if args.pss:
+        params += " --pss"
     if get_diff:
         params += " -d"
     if extra_data:
         params += " -e"
+    if args.align:
+        params += " --align"
+    if args.adaptive is not None:
+        params += " --adaptive %s --burst-interval %s --burst-window %s" % \
+            (" ".join(args.adaptive), args.burstinterval, args.burstwindow)
 
     cmd = "python %s/perfcollect.py %s" % (path, params)
 
     return cmd
 
 
+def parse_control_command(text):
+    """ Return command dict from command line text """
+    if text.startswith("{"):
+        return json.loads(text)
+    name, _, value = text.partition(" ")
+    command = {"command": name}
+    if name == "set-interval":
+        command["interval"] = float(value)
+    elif name == "set-filter":
+        with open(value.strip()) as config:
+            command["counters"] = json.load(config)
+    elif name == "sample-at":
+        # lead time lets command reach all nodes before target
+        lead = float(value) if value.strip() else SAMPLE_AT_LEAD
+        command["time"] = time.time() + lead
+    return command
+
+
+def send_control_command(args):
+    """ Send command to running tools and print their answers
+        Tools from the current run listen on port + 1,
+        resident tools - on agent port """
+    logger = logging.getLogger(LOGGER_NAME)
+    command = parse_control_command(args.command)
+    if args.hosts is not None:
+        ip_list = args.hosts
+    else:
+        ip_list = get_osds_ips(get_osds_list()) | \
+            get_mons_or_mds_ips("mon") | get_mons_or_mds_ips("mds")
+
+    if args.agentport is not None:
+        port = args.agentport
+    else:
+        port = args.port + 1
+    udp_sender = sender.Sender(port=int(args.port), size=int(args.partsize))
+    answers = control_agents(ip_list, udp_sender, port, command)
+    for ip, answer in sorted(answers.items()):
+        logger.info("%s: %s", ip, json.dumps(answer["config"]))
+    return 0 if len(answers) == len(ip_list) else 1
+
+
+def prepare_agent_start_command(args):
+    """ Return start command for resident tools """
+    url = "UDP://%s:%s/%s" % (args.localip, args.port, args.partsize)
+    command = {"command": "start",
+               "url": url,
+               "interval": args.timeout,
+               "sysmetrics": args.sysmetrics,
+               "pss": args.pss,
+               "diff": args.diff,
+               "align": args.align}
+    if args.adaptive is not None:
+        command["adaptive"] = {"watch": args.adaptive,
+                               "burst_interval": args.burstinterval,
+                               "burst_window": args.burstwindow}
+    return command
+
+
+def control_agents(ip_list, udp_sender, port, command):
+    """ Send command to resident tools on all ips
+        Command is sent to all of them in parallel, so slow node doesn't
+        delay others (and their sample-at target isn't missed)
+        Return dict ip -> answer of agent (without failed ones) """
+    logger = logging.getLogger(LOGGER_NAME)
+    # agents don't repeat command, which is resent after lost answer
+    message = json.dumps(dict(command, id=uuid.uuid4().hex))
+    raw_answers = {}
+
+    def send(ip):
+        """ Send command to one agent """
+        raw_answers[ip] = udp_sender.send_command(ip, port, message)
+
+    threads = [threading.Thread(target=send, args=(ip,)) for ip in ip_list]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    answers = {}
+    for ip in ip_list:
+        raw = raw_answers[ip]
+        if raw is None:
+            logger.error("Agent on %s doesn't answer to '%s'",
+                         ip, command["command"])
+            continue
+        answer = json.loads(raw)
+        if answer["status"] != "ok":
+            logger.error("Agent on %s: %s", ip, answer.get("message"))
+            continue
+        answers[ip] = answer
+    return answers
+
+
+def start_agents(args, ip_list, localy=False):
+    """ Start resident tools on all nodes by ssh """
+    cmd = "python %s/perfcollect.py --agent -p %i" % (args.pathtotool,
+                                                      args.agentport)
+    if localy:
+        start_tool_localy(cmd)
+    get_perfs_from_all_nodes(args.user, cmd, ip_list)
+
+
 def start_tool_localy(cmd):
     """ Start tool localy on current node """
     execute(cmd)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+""" Direct /proc readers for system metrics, psutil is not required """
+
+import os
+import errno
+from collections import namedtuple
+
+
+CLK_TCK = float(os.sysconf("SC_CLK_TCK"))
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+# fields of /proc/diskstats after major, minor and name
+DISKSTATS_FIELDS = ('rd_cnt', 'rd_merged', 'rd_sectors', 'rd_time',
+                    'wr_cnt', 'wr_merged', 'wr_sectors', 'wr_time',
+                    'in_flight', 'io_time', 'weighted_io_time')
+
+# fields of /proc/net/dev after interface name
+NETDEV_FIELDS = ('rx_bytes', 'rx_packets', 'rx_errs', 'rx_drop',
+                 'rx_fifo', 'rx_frame', 'rx_compressed', 'rx_multicast',
+                 'tx_bytes', 'tx_packets', 'tx_errs', 'tx_drop',
+                 'tx_fifo', 'tx_colls', 'tx_carrier', 'tx_compressed')
+
+# fields of cpu line in /proc/stat
+CPU_FIELDS = ('user', 'nice', 'system', 'idle', 'iowait',
+              'irq', 'softirq', 'steal')
+
+
+Partition = namedtuple('Partition', 'device mountpoint fstype')
+
+
+class ProcFile(object):
+    """ File in /proc, which is opened once and reread after seek """
+
+    bufsize = 65536
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+
+    def read(self):
+        """ Return current content of file """
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        chunks = []
+        while True:
+            chunk = os.read(self.fd, self.bufsize)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return "".join(chunks)
+
+    def close(self):
+        """ Close file descriptor """
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __del__(self):
+        self.close()
+
+
+class ProcReader(object):
+    """ Reader of /proc files with reused file descriptors
+        All methods return tuples of numbers (or dict of them)
+        in order of corresponding *_FIELDS
+    """
+
+    def __init__(self, root="/proc"):
+        self.root = root
+        self.files = {}
+
+    def read(self, *path):
+        """ Read /proc file, open it only on first use """
+        full_path = os.path.join(self.root, *path)
+        proc_file = self.files.get(full_path)
+        try:
+            if proc_file is None:
+                proc_file = ProcFile(full_path)
+                self.files[full_path] = proc_file
+            return proc_file.read()
+        except (IOError, OSError):
+            # process is gone - file can't be reused anymore
+            self.close(full_path)
+            raise
+
+    def close(self, full_path):
+        """ Close file and forget about it """
+        proc_file = self.files.pop(full_path, None)
+        if proc_file is not None:
+            proc_file.close()
+
+    def forget_pid(self, pid):
+        """ Close all files of process """
+        prefix = os.path.join(self.root, str(pid)) + os.sep
+        for full_path in self.files.keys():
+            if full_path.startswith(prefix):
+                self.close(full_path)
+
+    def pid_stat(self, pid):
+        """ Return (user time, system time, threads, start time, rss) """
+        raw = self.read(str(pid), "stat")
+        # comm field can contain spaces, so skip it
+        fields = raw.rpartition(')')[2].split()
+        return (int(fields[11]) / CLK_TCK,
+                int(fields[12]) / CLK_TCK,
+                int(fields[17]),
+                int(fields[19]),
+                int(fields[21]) * PAGE_SIZE)
+
+    def pid_ctx_switches(self, pid):
+        """ Return (voluntary, involuntary) context switches """
+        vol = invol = 0
+        for line in self.read(str(pid), "status").splitlines():
+            if line.startswith("voluntary_ctxt_switches"):
+                vol = int(line.split()[1])
+            elif line.startswith("nonvoluntary_ctxt_switches"):
+                invol = int(line.split()[1])
+        return vol, invol
+
+    def pid_io(self, pid):
+        """ Return (read bytes, write bytes) from storage """
+        rd_bytes = wr_bytes = 0
+        for line in self.read(str(pid), "io").splitlines():
+            if line.startswith("read_bytes"):
+                rd_bytes = int(line.split()[1])
+            elif line.startswith("write_bytes"):
+                wr_bytes = int(line.split()[1])
+        return rd_bytes, wr_bytes
+
+    def pid_pss(self, pid):
+        """ Return proportional set size (0 if kernel can't say it fast) """
+        try:
+            raw = self.read(str(pid), "smaps_rollup")
+        except (IOError, OSError) as e:
+            if e.errno == errno.ENOENT and \
+                    os.path.exists(os.path.join(self.root, str(pid))):
+                return 0
+            raise
+        for line in raw.splitlines():
+            if line.startswith("Pss:"):
+                return int(line.split()[1]) * 1024
+        return 0
+
+    def diskstats(self):
+        """ Return dict device name -> DISKSTATS_FIELDS values """
+        stats = {}
+        nfields = len(DISKSTATS_FIELDS)
+        for line in self.read("diskstats").splitlines():
+            fields = line.split()
+            if len(fields) < 3 + nfields:
+                continue
+            stats[fields[2]] = tuple(int(val)
+                                     for val in fields[3:3 + nfields])
+        return stats
+
+    def cpu_stat(self):
+        """ Return CPU_FIELDS values of all cpus in clock ticks """
+        for line in self.read("stat").splitlines():
+            if line.startswith("cpu "):
+                fields = line.split()[1:1 + len(CPU_FIELDS)]
+                fields += ['0'] * (len(CPU_FIELDS) - len(fields))
+                return tuple(int(val) for val in fields)
+        return (0,) * len(CPU_FIELDS)
+
+    def net_dev(self):
+        """ Return dict interface -> NETDEV_FIELDS values """
+        stats = {}
+        # two lines of header
+        for line in self.read("net", "dev").splitlines()[2:]:
+            name, _, values = line.partition(":")
+            stats[name.strip()] = tuple(int(val) for val in values.split())
+        return stats
+
+    def net_snmp(self, name="snmp"):
+        """ Return dict 'Section:Field' -> value
+            from /proc/net/snmp or /proc/net/netstat (name='netstat')
+        """
+        stats = {}
+        lines = self.read("net", name).splitlines()
+        # every section is a line of names and a line of values
+        for header, values in zip(lines[::2], lines[1::2]):
+            section, _, names = header.partition(":")
+            for field, val in zip(names.split(), values.split()[1:]):
+                stats[section + ":" + field] = int(val)
+        return stats
+
+    def partitions(self):
+        """ Return list of Partition for all mounted filesystems """
+        parts = []
+        for line in self.read("mounts").splitlines():
+            fields = line.split()
+            if len(fields) < 3:
+                continue
+            # spaces in mount points are escaped as \\040
+            mountpoint = fields[1].replace("\\040", " ")
+            parts.append(Partition(fields[0], mountpoint, fields[2]))
+        return parts
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+""" Local HTTP interface for live queries to counters ring buffers
+    GET /series?[host=&daemon=&group=&counter=]
+        - list of series keys
+    GET /range?[fields][&start=&end=][&step=&agg=]
+        - points of matched series, downsampled, if step is given
+    GET /top?[fields]&k=5[&start=&end=&agg=]
+        - k series with the biggest aggregate
+    GET /quantiles?[fields][&q=0.5,0.95,0.99][&merge=1]
+        - latency quantiles of the whole run by series
+          or of all matched series together
+    GET /metrics
+        - the last values of all counters in Prometheus text format
+    start and end are unix times, negative ones are secs back from now
+    Answers are json, errors are {"error": message} with code 400 """
+
+import json
+import time
+import urlparse
+import logging
+import threading
+import BaseHTTPServer
+import SocketServer
+
+import sketch
+import samples
+import exposition
+from logger import define_logger
+
+
+SERIES_FIELDS = sketch.SERIES_FIELDS
+
+DEFAULT_QUANTILES = "0.5,0.95,0.99"
+
+
+class QueryException(Exception):
+    """ Bad query parameters """
+    pass
+
+
+def get_param(params, name, convert=str, default=None):
+    """ Return query parameter converted by function """
+    if name not in params:
+        return default
+    try:
+        return convert(params[name][-1])
+    except ValueError:
+        raise QueryException("Bad value of %s: %s" % (name,
+                                                      params[name][-1]))
+
+
+def get_time_param(params, name):
+    """ Return time parameter, negative values are relative to now """
+    value = get_param(params, name, float)
+    if value is not None and value < 0:
+        value += time.time()
+    return value
+
+
+def series_fields(params):
+    """ Return dict of series key fields from query """
+    return dict((field, get_param(params, field))
+                for field in SERIES_FIELDS)
+
+
+def query_series(server, params):
+    """ List of series keys """
+    return [samples.key_to_dict(key)
+            for key in server.store.select(**series_fields(params))]
+
+
+def query_range(server, params):
+    """ Points of series in time range """
+    start = get_time_param(params, "start")
+    end = get_time_param(params, "end")
+    step = get_param(params, "step", float)
+    agg = get_param(params, "agg", default="avg")
+    result = []
+    for key in server.store.select(**series_fields(params)):
+        points = server.store.points(key, start, end)
+        if step is not None:
+            points = samples.downsample(points, step, agg)
+        answer = samples.key_to_dict(key)
+        answer["points"] = points
+        result.append(answer)
+    return result
+
+
+def query_top(server, params):
+    """ Series with the biggest aggregate in time range """
+    result = []
+    for value, key in server.store.top(get_param(params, "k", int, 10),
+                                       get_time_param(params, "start"),
+                                       get_time_param(params, "end"),
+                                       get_param(params, "agg",
+                                                 default="avg"),
+                                       **series_fields(params)):
+        answer = samples.key_to_dict(key)
+        answer["value"] = value
+        result.append(answer)
+    return result
+
+
+def query_quantiles(server, params):
+    """ Quantiles of series sketches """
+    sketches = server.sketches
+    if sketches is None:
+        raise QueryException("Sketches are not collected")
+    try:
+        quantiles = [float(q) for q in
+                     get_param(params, "q", default=DEFAULT_QUANTILES)
+                     .split(",")]
+    except ValueError:
+        raise QueryException("Bad quantiles, comma separated list expected")
+    keys = sketches.select(**series_fields(params))
+    if get_param(params, "merge", int, 0):
+        fields = dict((field, value) for field, value
+                      in series_fields(params).items() if value is not None)
+        groups = [(fields, keys)]
+    else:
+        groups = [(samples.key_to_dict(key), [key]) for key in keys]
+    result = []
+    for fields, group in groups:
+        merged = sketches.merged(group)
+        if merged is None:
+            continue
+        answer = dict(fields)
+        answer["series"] = len(group)
+        answer["count"] = merged.count
+        answer["avg"] = merged.avg()
+        answer["quantiles"] = dict((str(q), merged.quantile(q))
+                                   for q in quantiles)
+        result.append(answer)
+    return result
+
+
+QUERIES = {"/series": query_series,
+           "/range": query_range,
+           "/top": query_top,
+           "/quantiles": query_quantiles}
+
+
+class QueryHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Handler of GET queries, stores are taken from server """
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        if url.path == "/metrics" and self.server.exposition is not None:
+            self.send_text(200, self.server.exposition.render())
+            return
+        query = QUERIES.get(url.path)
+        if query is None:
+            self.send_json(404, {"error": "Unknown query %s, use one of %s" %
+                                 (url.path, ", ".join(sorted(QUERIES)))})
+            return
+        params = urlparse.parse_qs(url.query)
+        try:
+            answer = query(self.server, params)
+        except (QueryException, samples.SamplesException,
+                sketch.SketchException) as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        self.send_json(200, answer)
+
+    def send_json(self, code, answer):
+        """ Send answer as json """
+        self.send_body(code, json.dumps(answer), "application/json")
+
+    def send_text(self, code, text):
+        """ Send Prometheus exposition text """
+        self.send_body(code, text, exposition.CONTENT_TYPE)
+
+    def send_body(self, code, body, content_type):
+        """ Send answer """
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, log_format, *args):
+        logger = logging.getLogger(__name__)
+        logger.debug(log_format, *args)
+
+
+class QueryServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ HTTP server for queries to RingStore and SketchStore and
+        for scrapes of Exposition, it listens only localhost """
+
+    daemon_threads = True
+
+    def __init__(self, store, port, host="127.0.0.1", sketches=None,
+                 metrics=None):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), QueryHandler)
+        self.store = store
+        self.sketches = sketches
+        self.exposition = metrics
+        self.thread = None
+
+    def start(self):
+        """ Serve in background thread """
+        logger = logging.getLogger(__name__)
+        logger.info("Query interface on http://%s:%i/", *self.server_address)
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """ Stop serving and close socket """
+        if self.thread is not None:
+            self.shutdown()
+            self.thread.join()
+            self.thread = None
+        self.server_close()
+
+
+define_logger(__name__)
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+""" Result file of server with sidecar index for fast lookups
+    Result file is a stream of records separated by '\\n---\\n'.
+    Index FILENAME.idx has entry for every record:
+        time (float64), offset (uint64), length (uint32), node id (uint32)
+    Node names are lines 'ID NAME' in FILENAME.nodes
+    Time is time of writing, so entries are sorted and searched by bisect.
+    Also can be used as tool:
+    python resultlog.py test.log --start '2015-12-01 14:00' \\
+        --end '2015-12-01 14:05' --node 192.168.0.5 --daemon osd.7 """
+
+import os
+import sys
+import mmap
+import json
+import time
+import struct
+import argparse
+
+import samples
+
+
+RECORD_SEPARATOR = "\n---\n"
+
+INDEX_ENTRY = struct.Struct("<dQII")
+
+# node id of records, which are not from nodes (alerts, rollups)
+NO_NODE = 0xffffffff
+
+INDEX_SUFFIX = ".idx"
+NODES_SUFFIX = ".nodes"
+
+TIME_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M")
+
+
+class ResultLogException(Exception):
+    """ Bad result file or its index """
+    pass
+
+
+def read_nodes(filename):
+    """ Return dict node id -> name from nodes file """
+    nodes = {}
+    if os.path.exists(filename + NODES_SUFFIX):
+        with open(filename + NODES_SUFFIX) as nodes_file:
+            for line in nodes_file:
+                node_id, _, name = line.strip().partition(" ")
+                if name:
+                    nodes[int(node_id)] = name
+    return nodes
+
+
+class ResultLog(object):
+    """ Appends records to result file and entries to its index """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.data = open(filename, "ab")
+        # append mode doesn't move position before the first write
+        self.data.seek(0, os.SEEK_END)
+        self.index = open(filename + INDEX_SUFFIX, "ab")
+        self.nodes = dict((name, node_id) for node_id, name
+                          in read_nodes(filename).items())
+        self.nodes_file = open(filename + NODES_SUFFIX, "a")
+
+    def node_id(self, node):
+        """ Return id of node, new nodes are saved to nodes file """
+        if node is None:
+            return NO_NODE
+        node_id = self.nodes.get(node)
+        if node_id is None:
+            node_id = len(self.nodes)
+            self.nodes[node] = node_id
+            self.nodes_file.write("%i %s\n" % (node_id, node))
+            self.nodes_file.flush()
+        return node_id
+
+    def write(self, record, node=None, timestamp=None):
+        """ Append record, index entry is written after data,
+            so it never points to unwritten data """
+        if timestamp is None:
+            timestamp = time.time()
+        self.data.write(RECORD_SEPARATOR)
+        offset = self.data.tell()
+        self.data.write(record)
+        self.data.flush()
+        self.index.write(INDEX_ENTRY.pack(timestamp, offset, len(record),
+                                          self.node_id(node)))
+        self.index.flush()
+
+    def close(self):
+        """ Close all files """
+        for log_file in (self.data, self.index, self.nodes_file):
+            log_file.close()
+
+
+class ResultLogReader(object):
+    """ Reads records of result file by time range and node via index """
+
+    def __init__(self, filename):
+        self.filename = filename
+        if not os.path.exists(filename + INDEX_SUFFIX):
+            raise ResultLogException("No index for %s, create it by"
+                                     " --reindex" % filename)
+        self.data_file = open(filename, "rb")
+        self.index_file = open(filename + INDEX_SUFFIX, "rb")
+        # index is mapped first, so its entries point to mapped data,
+        # which running server wrote before them
+        self.index = self.map(self.index_file)
+        self.data = self.map(self.data_file)
+        # entry can be written partially by running server
+        self.count = len(self.index) // INDEX_ENTRY.size
+        # entries, which point past mapped data, are not read
+        while self.count > 0:
+            _, offset, length, _ = self.entry(self.count - 1)
+            if offset + length <= len(self.data):
+                break
+            self.count -= 1
+        self.nodes = read_nodes(filename)
+
+    @staticmethod
+    def map(log_file):
+        """ Map file to memory (empty string for empty file) """
+        if os.fstat(log_file.fileno()).st_size == 0:
+            return ""
+        return mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def entry(self, index):
+        """ Return (time, offset, length, node id) of entry """
+        return INDEX_ENTRY.unpack_from(self.index, index * INDEX_ENTRY.size)
+
+    def find(self, timestamp):
+        """ Index of the first entry not older than timestamp """
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if self.entry(mid)[0] < timestamp:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def records(self, start=None, end=None, node=None):
+        """ Yield (time, node name, record) in time range """
+        first = 0 if start is None else self.find(start)
+        for index in xrange(first, self.count):
+            timestamp, offset, length, node_id = self.entry(index)
+            if end is not None and timestamp > end:
+                break
+            name = self.nodes.get(node_id)
+            if node is not None and name != node:
+                continue
+            yield timestamp, name, self.data[offset:offset + length]
+
+    def dumps(self, start=None, end=None, node=None):
+        """ Yield (time, node name, dump dict) of collectors data """
+        for timestamp, name, record in self.records(start, end, node):
+            if record.startswith(samples.DUMP_PREFIX):
+                yield timestamp, name, samples.parse_dump(record)
+
+    def close(self):
+        """ Unmap and close files """
+        for mapped in (self.data, self.index):
+            if mapped:
+                mapped.close()
+        self.data_file.close()
+        self.index_file.close()
+
+
+def build_index(filename):
+    """ Create index for result file without it (written by old server)
+        Record time is the latest sample time of dumps till the record,
+        so times grow like times of writing do, nodes are unknown """
+    last_time = 0
+    with open(filename, "rb") as data_file:
+        data = ResultLogReader.map(data_file)
+        with open(filename + INDEX_SUFFIX, "wb") as index:
+            pos = data.find(RECORD_SEPARATOR) if data else -1
+            while pos >= 0:
+                offset = pos + len(RECORD_SEPARATOR)
+                pos = data.find(RECORD_SEPARATOR, offset)
+                end = pos if pos >= 0 else len(data)
+                record = data[offset:end]
+                try:
+                    # dumps of nodes come not in order of their time,
+                    # binary search needs growing times
+                    last_time = max(last_time, samples.parse_dump(record)
+                                    .get("time", last_time))
+                except samples.SamplesException:
+                    # alerts and other records get time of previous dump
+                    pass
+                index.write(INDEX_ENTRY.pack(last_time, offset, end - offset,
+                                             NO_NODE))
+        if data:
+            data.close()
+
+
+def parse_time(text):
+    """ Return unix time from text: unix time or local date and time """
+    if text is None:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    for time_format in TIME_FORMATS:
+        try:
+            return time.mktime(time.strptime(text, time_format))
+        except ValueError:
+            continue
+    raise ResultLogException("Bad time '%s', use unix time or"
+                             " 'YYYY-MM-DD HH:MM[:SS]'" % text)
+
+
+def parse_command_args(argv):
+    """ Command line parser """
+    parser = argparse.ArgumentParser(description="Print records of result"
+                                     " file in time range by index")
+    parser.add_argument("filename", type=str,
+                        help="Result file of perfserver")
+    parser.add_argument("--start", type=str,
+                        help="Unix time or 'YYYY-MM-DD HH:MM[:SS]'")
+    parser.add_argument("--end", type=str,
+                        help="Unix time or 'YYYY-MM-DD HH:MM[:SS]'")
+    parser.add_argument("--node", type=str,
+                        help="Only records from node with this ip")
+    parser.add_argument("--daemon", type=str,
+                        help="Print only counters of this daemon"
+                             " (admin socket name or osd.ID)")
+    parser.add_argument("--reindex", action="store_true",
+                        help="Create index for result file and exit")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    """ Print records as json lines """
+    args = parse_command_args(argv[1:])
+    if args.reindex:
+        build_index(args.filename)
+        return 0
+    try:
+        start, end = parse_time(args.start), parse_time(args.end)
+        reader = ResultLogReader(args.filename)
+    except ResultLogException as e:
+        sys.stderr.write("%s\n" % e)
+        return 1
+    try:
+        if args.daemon is None:
+            for _, _, record in reader.records(start, end, args.node):
+                print record
+        else:
+            for timestamp, name, dump in reader.dumps(start, end, args.node):
+                for daemon, groups in dump.items():
+                    if daemon == args.daemon or \
+                            samples.osd_name(daemon) == args.daemon:
+                        print json.dumps({"time": dump.get("time",
+                                                           timestamp),
+                                          "node": name,
+                                          daemon: groups})
+    except samples.SamplesException as e:
+        sys.stderr.write("%s\n" % e)
+        return 1
+    finally:
+        reader.close()
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv))
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+""" On-disk storage of received data with retention tiers
+    Raw data of every node is appended to hour segments:
+        DIR/raw/HOST/START.log
+    When segment becomes older then keep time of its tier, it is compacted
+    in background into segment of the next tier with bigger step:
+        DIR/10s/HOST/START.log
+    Aggregates are records 'agg{json}' with stats for every counter:
+    numbers - {"min", "max", "avg", "last", "n"},
+    latencies - {"sum", "avgcount"} of interval, so their averages stay
+    correct after any number of compactions """
+
+import os
+import json
+import time
+import logging
+import threading
+
+import samples
+from logger import define_logger
+
+
+RAW = "raw"
+
+# prefix of aggregated records
+AGG_PREFIX = "agg"
+
+# separator of records, as in result file of server
+RECORD_SEPARATOR = "\n---\n"
+
+# secs in segment file
+SEGMENT = 3600
+
+DEFAULT_TIERS = ["raw:6h", "10s:2d", "1m:inf"]
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+class RetentionException(Exception):
+    """ Bad tiers settings """
+    pass
+
+
+def parse_duration(text):
+    """ Return secs from text like 10s, 5m, 6h, 2d (None for 'inf') """
+    if text == "inf":
+        return None
+    try:
+        if text[-1] in DURATION_UNITS:
+            return float(text[:-1]) * DURATION_UNITS[text[-1]]
+        return float(text)
+    except (ValueError, IndexError):
+        raise RetentionException("Bad duration '%s'" % text)
+
+
+def parse_tiers(items):
+    """ Return list of (name, step, keep) from 'STEP:KEEP' strings
+        The first tier must be raw, steps must grow """
+    tiers = []
+    for item in items:
+        name, _, keep = item.partition(":")
+        step = None if name == RAW else parse_duration(name)
+        tiers.append((name, step, parse_duration(keep or "inf")))
+    if not tiers or tiers[0][0] != RAW:
+        raise RetentionException("The first tier must be raw")
+    steps = [step for _, step, _ in tiers[1:]]
+    if RAW in [name for name, _, _ in tiers[1:]] or steps != sorted(steps):
+        raise RetentionException("Steps of tiers must grow")
+    for _, _, keep in tiers[:-1]:
+        if keep is None:
+            raise RetentionException("Only the last tier can be kept"
+                                     " forever")
+    return tiers
+
+
+def iter_records(filename):
+    """ Yield records of segment file """
+    with open(filename) as segment:
+        for line in segment:
+            line = line.rstrip("\n")
+            if line and line != RECORD_SEPARATOR.strip():
+                yield line
+
+
+def number_stats(value):
+    """ Stats of one number """
+    return {"min": value, "max": value, "avg": value, "last": value, "n": 1}
+
+
+def merge_stats(old, new):
+    """ Merge stats of later values into old ones """
+    if "avgcount" in old:
+        old["sum"] += new["sum"]
+        old["avgcount"] += new["avgcount"]
+        return
+    count = old["n"] + new["n"]
+    old["avg"] = float(old["avg"] * old["n"] + new["avg"] * new["n"]) / count
+    old["n"] = count
+    old["min"] = min(old["min"], new["min"])
+    old["max"] = max(old["max"], new["max"])
+    old["last"] = new["last"]
+
+
+class Aggregator(object):
+    """ Aggregates raw dumps or aggregates of one node in buckets of step """
+
+    def __init__(self, step, diff=False):
+        self.step = step
+        # in diff mode latencies are already differences
+        self.diff = diff
+        # key -> the last (sum, avgcount) of raw latency
+        self.last_pairs = {}
+        # bucket start -> {daemon: {group: {counter: stats}}}
+        self.buckets = {}
+
+    def get_stats(self, timestamp, daemon, group, counter):
+        """ Return stats dict of counter in bucket (None if not created) """
+        bucket = self.buckets.setdefault(timestamp - timestamp % self.step,
+                                         {})
+        counters = bucket.setdefault(daemon, {}).setdefault(group, {})
+        return counters, counters.get(counter)
+
+    def add_stats(self, timestamp, daemon, group, counter, stats):
+        """ Merge stats into bucket """
+        counters, old = self.get_stats(timestamp, daemon, group, counter)
+        if old is None:
+            counters[counter] = stats
+        else:
+            merge_stats(old, stats)
+
+    def add_dump(self, dump):
+        """ Add raw dump """
+        timestamp = dump.get("time")
+        if timestamp is None:
+            return
+        for daemon, group, counter, value in samples.iter_counters(dump):
+            if samples.is_pair(value):
+                stats = self.pair_stats((daemon, group, counter), value)
+                if stats is None:
+                    continue
+            else:
+                stats = number_stats(value)
+            self.add_stats(timestamp, daemon, group, counter, stats)
+
+    def pair_stats(self, key, value):
+        """ Stats of latency in interval from raw value """
+        if self.diff:
+            return {"sum": value["sum"], "avgcount": value["avgcount"]}
+        pair = (value["sum"], value["avgcount"])
+        last = self.last_pairs.get(key)
+        self.last_pairs[key] = pair
+        # the first value or daemon restart
+        if last is None or pair[1] < last[1]:
+            return None
+        return {"sum": pair[0] - last[0], "avgcount": pair[1] - last[1]}
+
+    def add_aggregate(self, record):
+        """ Add aggregated record of smaller step """
+        for daemon, groups in record["counters"].items():
+            for group, counters in groups.items():
+                for counter, stats in counters.items():
+                    self.add_stats(record["time"], daemon, group, counter,
+                                   stats)
+
+    def pop_records(self):
+        """ Remove and return aggregated records sorted by time """
+        records = [{"time": start, "step": self.step,
+                    "counters": self.buckets[start]}
+                   for start in sorted(self.buckets)]
+        self.buckets = {}
+        return records
+
+
+class RetentionStore(object):
+    """ Writer of raw segments and background compactor of them """
+
+    def __init__(self, path, tiers, segment=SEGMENT, diff=False,
+                 check_period=60):
+        self.path = path
+        self.tiers = tiers
+        self.segment = segment
+        self.diff = diff
+        self.check_period = check_period
+        # host -> (segment start, opened file)
+        self.files = {}
+        self.lock = threading.Lock()
+        # host -> Aggregator of raw data, it keeps last latency values
+        self.raw_aggregators = {}
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def segment_path(self, tier, host, start):
+        """ Path of segment file """
+        return os.path.join(self.path, tier, host, "%i.log" % start)
+
+    def write(self, host, data, timestamp=None):
+        """ Append received data of host to raw segment """
+        if timestamp is None:
+            timestamp = time.time()
+        start = int(timestamp - timestamp % self.segment)
+        with self.lock:
+            current = self.files.get(host)
+            if current is None or current[0] != start:
+                if current is not None:
+                    current[1].close()
+                filename = self.segment_path(RAW, host, start)
+                if not os.path.isdir(os.path.dirname(filename)):
+                    os.makedirs(os.path.dirname(filename))
+                current = (start, open(filename, "a"))
+                self.files[host] = current
+            current[1].write(RECORD_SEPARATOR)
+            current[1].write(data)
+            current[1].write("\n")
+
+    def start(self):
+        """ Start compaction in background thread """
+        self.thread = threading.Thread(target=self.compact_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """ Stop compaction and close segments """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        with self.lock:
+            for _, segment_file in self.files.values():
+                segment_file.close()
+            self.files = {}
+
+    def compact_loop(self):
+        """ Compact old segments from time to time """
+        logger = logging.getLogger(__name__)
+        while not self.stop_event.is_set():
+            try:
+                self.compact(time.time())
+            except (IOError, OSError, ValueError) as e:
+                logger.error("Compaction failed: %s", e)
+            self.stop_event.wait(self.check_period)
+
+    def compact(self, now):
+        """ Compact or remove all segments, which are older than keep time
+            of their tier """
+        logger = logging.getLogger(__name__)
+        for index, (tier, _, keep) in enumerate(self.tiers):
+            if keep is None:
+                continue
+            tier_path = os.path.join(self.path, tier)
+            if not os.path.isdir(tier_path):
+                continue
+            for host in sorted(os.listdir(tier_path)):
+                for start in self.old_segments(tier, host, now - keep):
+                    if self.stop_event.is_set():
+                        return
+                    source = self.segment_path(tier, host, start)
+                    if index + 1 < len(self.tiers):
+                        next_tier, step, _ = self.tiers[index + 1]
+                        self.compact_segment(source, host, start,
+                                             next_tier, step,
+                                             raw=(tier == RAW))
+                        logger.debug("%s is compacted to %s", source,
+                                     next_tier)
+                    os.remove(source)
+
+    def old_segments(self, tier, host, older):
+        """ Sorted starts of segments, which end before older time """
+        starts = []
+        for name in os.listdir(os.path.join(self.path, tier, host)):
+            # unfinished compaction results are skipped too
+            if not name.endswith(".log"):
+                continue
+            try:
+                start = int(name[:-len(".log")])
+            except ValueError:
+                continue
+            if start + self.segment <= older:
+                starts.append(start)
+        starts.sort()
+        # segment, which is written now, is not touched
+        with self.lock:
+            current = self.files.get(host)
+        if tier == RAW and current is not None and current[0] in starts:
+            starts.remove(current[0])
+        return starts
+
+    def compact_segment(self, source, host, start, tier, step, raw):
+        """ Write aggregates of source segment to segment of next tier """
+        if raw:
+            aggregator = self.raw_aggregators.setdefault(
+                host, Aggregator(step, self.diff))
+        else:
+            aggregator = Aggregator(step, self.diff)
+        for record in iter_records(source):
+            try:
+                if raw and record.startswith(samples.DUMP_PREFIX):
+                    aggregator.add_dump(samples.parse_dump(record))
+                elif not raw and record.startswith(AGG_PREFIX):
+                    aggregator.add_aggregate(
+                        json.loads(record[len(AGG_PREFIX):]))
+            except (samples.SamplesException, ValueError, KeyError):
+                # broken record must not stop compaction
+                continue
+        target = self.segment_path(tier, host, start)
+        if not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        # segment appears only when it is complete
+        with open(target + ".tmp", "w") as target_file:
+            for record in aggregator.pop_records():
+                target_file.write(RECORD_SEPARATOR)
+                target_file.write(AGG_PREFIX + json.dumps(record))
+                target_file.write("\n")
+        os.rename(target + ".tmp", target)
+
+
+define_logger(__name__)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+""" Cluster level aggregates of OSD counters computed on receive
+    Every interval sum, mean and max over OSDs are computed for the whole
+    cluster, for every node (by ip of sender) and for crush domains.
+    Growing counters are aggregated as rates per second,
+    latencies (avgcount/sum) - as average in interval """
+
+import json
+
+import samples
+
+
+# prefix of rollup records in result file
+ROLLUP_PREFIX = "rollup"
+
+# osd counters, which are aggregated by default
+DEFAULT_COUNTERS = [("osd", counter) for counter in
+                    ("op", "op_r", "op_w", "op_rw",
+                     "op_in_bytes", "op_out_bytes",
+                     "op_r_out_bytes", "op_w_in_bytes",
+                     "op_latency", "op_r_latency", "op_w_latency",
+                     "op_rw_latency", "op_r_process_latency",
+                     "op_w_process_latency", "subop_w_latency")]
+
+# intervals, which the last value of OSD is used for, if OSD has no dump
+# in them (collectors are not aligned or drift)
+CARRY_INTERVALS = 2
+
+
+class Rollups(object):
+    """ Sink, which aggregates OSD counters over cluster, nodes and
+        crush domains. Records are dicts:
+        {"time": interval start, "interval": secs,
+         "scope": "cluster", "node" or crush type, "name": scope name,
+         "counters": {"group/counter": {"sum", "mean", "max", "count"}}}
+        They are given to emit function """
+
+    def __init__(self, interval, emit, counters=None, domains=None,
+                 domain_types=(), diff=False):
+        self.interval = interval
+        self.emit = emit
+        self.counters = DEFAULT_COUNTERS if counters is None else counters
+        # osd name -> {crush type: bucket name}
+        self.domains = domains or {}
+        self.domain_types = domain_types
+        self.rates = samples.RateTracker(diff)
+        self.averager = samples.PairAverager(diff)
+        # every interval is {(group, counter): {daemon: (node, value)}}
+        self.buckets = samples.IntervalBuckets(interval)
+        # (group, counter) -> {daemon: (node, value, interval start)}
+        self.last_values = {}
+
+    def add(self, host, dump):
+        """ Add OSD counters of dump, aggregate finished intervals """
+        timestamp = dump.get("time")
+        if timestamp is None:
+            return
+        values = self.buckets.get(timestamp)
+        if values is None:
+            # interval is rolled up already, late dump is dropped
+            return
+        for daemon, groups in dump.items():
+            if samples.osd_name(daemon) is None or \
+                    not isinstance(groups, dict):
+                continue
+            for group, counter in self.counters:
+                value = groups.get(group, {}).get(counter)
+                key = (daemon, group, counter)
+                if samples.is_pair(value):
+                    value = self.averager.value(key, value)
+                elif samples.is_number(value):
+                    value = self.rates.rate(key, value, timestamp)
+                else:
+                    continue
+                if value is not None:
+                    values.setdefault((group, counter), {})[daemon] = \
+                        (host, value)
+        for start, finished in self.buckets.finished():
+            self.roll(start, finished)
+
+    def flush(self):
+        """ Aggregate all pending intervals """
+        for start, values in self.buckets.flush():
+            self.roll(start, values)
+
+    def scopes(self, daemon, host):
+        """ Return list of (scope, name), which OSD belongs to """
+        result = [("cluster", "cluster"), ("node", host)]
+        osd_domains = self.domains.get(samples.osd_name(daemon), {})
+        for domain_type in self.domain_types:
+            if domain_type in osd_domains:
+                result.append((domain_type, osd_domains[domain_type]))
+        return result
+
+    def carry(self, timestamp, values):
+        """ Add the last values of OSDs, which have no dump in interval,
+            so sums don't dip, when dumps are late for interval """
+        for key, by_daemon in values.items():
+            last = self.last_values.setdefault(key, {})
+            for daemon, (host, value) in by_daemon.items():
+                last[daemon] = (host, value, timestamp)
+        oldest = timestamp - CARRY_INTERVALS * self.interval
+        for key, last in self.last_values.items():
+            by_daemon = values.setdefault(key, {})
+            for daemon, (host, value, start) in last.items():
+                if start < oldest:
+                    del last[daemon]
+                elif daemon not in by_daemon:
+                    by_daemon[daemon] = (host, value)
+
+    def roll(self, timestamp, values):
+        """ Emit records for one interval """
+        self.carry(timestamp, values)
+        # (scope, name) -> {"group/counter": stats}
+        records = {}
+        for (group, counter), by_daemon in values.items():
+            name = group + "/" + counter
+            for daemon, (host, value) in by_daemon.items():
+                for scope in self.scopes(daemon, host):
+                    counters = records.setdefault(scope, {})
+                    stats = counters.get(name)
+                    if stats is None:
+                        counters[name] = {"sum": value, "max": value,
+                                          "count": 1}
+                    else:
+                        stats["sum"] += value
+                        stats["max"] = max(stats["max"], value)
+                        stats["count"] += 1
+        for (scope, name), counters in sorted(records.items()):
+            for stats in counters.values():
+                stats["mean"] = stats["sum"] / stats["count"]
+            self.emit({"time": timestamp,
+                       "interval": self.interval,
+                       "scope": scope,
+                       "name": name,
+                       "counters": counters})
+
+
+def parse_counters(items):
+    """ Return list of (group, counter) from 'group:counter' strings """
+    counters = []
+    for item in items:
+        group, _, counter = item.partition(":")
+        if not counter:
+            raise ValueError("Bad counter '%s', group:counter expected" %
+                             item)
+        counters.append((group, counter))
+    return counters
+
+
+def format_rollup(record):
+    """ Rollup as record of result file """
+    return ROLLUP_PREFIX + json.dumps(record)
@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+""" Decoding of received dumps and in-memory time series of counters """
+
+import re
+import json
+import time
+import array
+import threading
+
+import sketch
+
+
+# prefix of dumps from collectors
+DUMP_PREFIX = "template"
+
+# daemons are named by their admin sockets: CLUSTER-osd.ID
+OSD_NAME = re.compile(r"(?:^|-)(osd\.\d+)$")
+
+
+def avg(values):
+    """ Mean of list """
+    return sum(values) / float(len(values))
+
+
+AGGREGATES = {"avg": avg,
+              "min": min,
+              "max": max,
+              "sum": sum,
+              "last": lambda values: values[-1],
+              "count": len}
+
+
+class SamplesException(Exception):
+    """ Bad query or dump """
+    pass
+
+
+def parse_dump(data):
+    """ Return dump dict from received string """
+    if not data.startswith(DUMP_PREFIX):
+        raise SamplesException("Not a dump: %r" % data[:20])
+    try:
+        return json.loads(data[len(DUMP_PREFIX):])
+    except ValueError as e:
+        raise SamplesException("Bad dump: %s" % e)
+
+
+def osd_name(daemon):
+    """ Return 'osd.ID' for OSD daemon (e.g. ceph-osd.3), None for others """
+    match = OSD_NAME.search(daemon)
+    return match.group(1) if match else None
+
+
+def is_number(value):
+    """ Check, that counter value is a number """
+    return isinstance(value, (int, long, float)) and \
+        not isinstance(value, bool)
+
+
+def is_pair(value):
+    """ Check, that counter value is avgcount/sum pair """
+    return isinstance(value, dict) and "avgcount" in value and "sum" in value
+
+
+def iter_counters(dump):
+    """ Yield (daemon, group, counter, value) for all counters of dump
+        System metrics are yielded with daemon 'system metrics'
+        Value is a number or avgcount/sum pair dict """
+    for daemon, groups in dump.items():
+        if not isinstance(groups, dict):
+            continue
+        for group, counters in groups.items():
+            if not isinstance(counters, dict):
+                continue
+            for counter, value in counters.items():
+                if is_number(value) or is_pair(value):
+                    yield daemon, group, counter, value
+
+
+class PairAverager(object):
+    """ Turns avgcount/sum pairs into average of the last interval
+        (e.g. mean latency of ops, which were done in interval) """
+
+    def __init__(self, diff=False):
+        # in diff mode pairs are already differences
+        self.diff = diff
+        # key -> (sum, avgcount) of previous dump
+        self.last = {}
+
+    def value(self, key, value):
+        """ Return number for counter value or None, if it is unknown yet """
+        if not is_pair(value):
+            return value
+        if self.diff:
+            if value["avgcount"] <= 0:
+                return None
+            return float(value["sum"]) / value["avgcount"]
+        pair = (value["sum"], value["avgcount"])
+        last = self.last.get(key)
+        self.last[key] = pair
+        if last is None or pair[1] <= last[1]:
+            return None
+        return float(pair[0] - last[0]) / (pair[1] - last[1])
+
+
+class RateTracker(object):
+    """ Turns growing counters into per second rates of the last interval """
+
+    def __init__(self, diff=False):
+        # in diff mode values are already differences
+        self.diff = diff
+        # key -> (value, time) of previous dump
+        self.last = {}
+
+    def rate(self, key, value, timestamp):
+        """ Return rate or None, if it is unknown yet """
+        last = self.last.get(key)
+        self.last[key] = (value, timestamp)
+        if last is None or timestamp <= last[1]:
+            return None
+        if self.diff:
+            return value / (timestamp - last[1])
+        # counter is reset by daemon restart
+        if value < last[0]:
+            return None
+        return (value - last[0]) / (timestamp - last[1])
+
+
+class IntervalBuckets(object):
+    """ Groups data of all nodes by intervals of sample time
+        Interval is finished, when dumps of the next but one have come,
+        so dumps of other nodes can be late for one interval """
+
+    def __init__(self, interval):
+        self.interval = interval
+        # interval number -> dict of data
+        self.pending = {}
+        self.last = None
+        # the last finished interval and number of dumps, which came
+        # after their interval was finished
+        self.last_finished = None
+        self.dropped = 0
+
+    def get(self, timestamp):
+        """ Return data dict of interval of timestamp
+            (None, if the interval is finished already) """
+        bucket = int(timestamp // self.interval)
+        if self.last_finished is not None and bucket <= self.last_finished:
+            self.dropped += 1
+            return None
+        if self.last is None or bucket > self.last:
+            self.last = bucket
+        return self.pending.setdefault(bucket, {})
+
+    def finished(self):
+        """ Remove and return list of (interval start, data) of finished
+            intervals """
+        result = []
+        for bucket in sorted(self.pending):
+            if bucket >= self.last - 1:
+                break
+            result.append((bucket * self.interval, self.pending.pop(bucket)))
+            self.last_finished = bucket
+        return result
+
+    def flush(self):
+        """ Remove and return all intervals as finished ones """
+        result = [(bucket * self.interval, self.pending[bucket])
+                  for bucket in sorted(self.pending)]
+        if self.pending:
+            self.last_finished = max(self.pending)
+        self.pending = {}
+        return result
+
+
+class SeriesRing(object):
+    """ Time series of fixed size, the oldest points are overwritten """
+
+    def __init__(self, size):
+        self.size = size
+        # arrays grow up to size, so memory is taken by received points only
+        self.times = array.array('d')
+        self.values = array.array('d')
+        self.start = 0
+        self.count = 0
+
+    def append(self, timestamp, value):
+        """ Add point, points older then the last one are dropped """
+        if self.count > 0 and timestamp < self.get_time(self.count - 1):
+            return
+        if self.count < self.size:
+            self.times.append(timestamp)
+            self.values.append(value)
+            self.count += 1
+        else:
+            self.times[self.start] = timestamp
+            self.values[self.start] = value
+            self.start = (self.start + 1) % self.size
+
+    def get_time(self, index):
+        """ Time of point by index from the oldest one """
+        return self.times[(self.start + index) % self.size]
+
+    def find(self, timestamp):
+        """ Index of the first point not older then timestamp """
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if self.get_time(mid) < timestamp:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def points(self, start=None, end=None):
+        """ Return list of (time, value) for start <= time <= end """
+        first = 0 if start is None else self.find(start)
+        result = []
+        for index in range(first, self.count):
+            pos = (self.start + index) % self.size
+            if end is not None and self.times[pos] > end:
+                break
+            result.append((self.times[pos], self.values[pos]))
+        return result
+
+
+def match_keys(keys, host=None, daemon=None, group=None, counter=None):
+    """ Return sorted series keys, which match all given fields """
+    pattern = (host, daemon, group, counter)
+    return sorted(key for key in keys
+                  if all(field is None or field == value
+                         for field, value in zip(pattern, key)))
+
+
+def key_to_dict(key):
+    """ Series key as dict """
+    return dict(zip(sketch.SERIES_FIELDS, key))
+
+
+def downsample(points, step, agg="avg"):
+    """ Aggregate points in buckets of step secs
+        Return list of (bucket start, aggregated value) """
+    func = get_aggregate(agg)
+    if step <= 0:
+        raise SamplesException("Step must be positive")
+    result = []
+    bucket = None
+    values = []
+    for timestamp, value in points:
+        current = timestamp - timestamp % step
+        if current != bucket and values:
+            result.append((bucket, func(values)))
+            values = []
+        bucket = current
+        values.append(value)
+    if values:
+        result.append((bucket, func(values)))
+    return result
+
+
+def get_aggregate(name):
+    """ Return aggregate function by name """
+    try:
+        return AGGREGATES[name]
+    except KeyError:
+        raise SamplesException("Unknown aggregate %s, use one of %s" %
+                               (name, ", ".join(sorted(AGGREGATES))))
+
+
+class RingStore(object):
+    """ Ring buffers of all counters of all nodes
+        Series key is (host, daemon, group, counter) """
+
+    def __init__(self, size, diff=False):
+        self.size = size
+        self.lock = threading.Lock()
+        self.series = {}
+        self.averager = PairAverager(diff)
+
+    def add(self, host, dump):
+        """ Add all counters of dump received from host """
+        timestamp = dump.get("time", time.time())
+        with self.lock:
+            for daemon, group, counter, value in iter_counters(dump):
+                key = (host, daemon, group, counter)
+                value = self.averager.value(key, value)
+                if value is None:
+                    continue
+                ring = self.series.get(key)
+                if ring is None:
+                    ring = SeriesRing(self.size)
+                    self.series[key] = ring
+                ring.append(timestamp, value)
+
+    def select(self, **fields):
+        """ Return sorted keys of series, which match all given fields """
+        with self.lock:
+            keys = self.series.keys()
+        return match_keys(keys, **fields)
+
+    def points(self, key, start=None, end=None):
+        """ Return points of series in time range """
+        with self.lock:
+            return self.series[key].points(start, end)
+
+    def top(self, k, start=None, end=None, agg="avg", **fields):
+        """ Return k series with the biggest aggregate in time range
+            as list of (value, key) """
+        func = get_aggregate(agg)
+        result = []
+        for key in self.select(**fields):
+            points = self.points(key, start, end)
+            if points:
+                result.append((func([value for _, value in points]), key))
+        result.sort(reverse=True)
+        return result[:k]
+
+
+class SketchStore(object):
+    """ Quantile sketches of latency (avgcount/sum) counters of all nodes
+        Sketch gets average of every interval, its memory doesn't depend
+        on run length. Series key is (host, daemon, group, counter) """
+
+    def __init__(self, diff=False, alpha=0.01):
+        self.alpha = alpha
+        self.lock = threading.Lock()
+        self.sketches = {}
+        self.averager = PairAverager(diff)
+
+    def add(self, host, dump):
+        """ Add latencies of dump received from host """
+        with self.lock:
+            for daemon, group, counter, value in iter_counters(dump):
+                if not is_pair(value):
+                    continue
+                key = (host, daemon, group, counter)
+                value = self.averager.value(key, value)
+                if value is None:
+                    continue
+                series = self.sketches.get(key)
+                if series is None:
+                    series = sketch.DDSketch(self.alpha)
+                    self.sketches[key] = series
+                series.add(value)
+
+    def select(self, **fields):
+        """ Return sorted keys of series, which match all given fields """
+        with self.lock:
+            keys = self.sketches.keys()
+        return match_keys(keys, **fields)
+
+    def merged(self, keys):
+        """ Return one sketch with values of all series """
+        with self.lock:
+            return sketch.merge_all(self.sketches[key] for key in keys)
+
+    def items(self):
+        """ Return list of (series fields dict, sketch copy) """
+        return [(key_to_dict(key), self.merged([key]))
+                for key in self.select()]
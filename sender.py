@@ -118,57 +118,68 @@ class Sender(object):
 
     def recv_by_protocol(self):
         """ Receive data from udp socket by Packet protocol"""
+        return self.recv_packet()[1]
+
+
+    def recv_packet(self):
+        """ Receive data from udp socket by Packet protocol
+            Return ip of sender and data (None, if it is not ready) """
         data, remote_ip = self.recv()
 
         if remote_ip not in self.all_data:
             self.all_data[remote_ip] = packet.Packet()
 
-        return self.all_data[remote_ip].new_packet(data)
+        return remote_ip, self.all_data[remote_ip].new_packet(data)
 
 
-    def recv_with_answer(self, stop_event=None):
-        """ Receive data from udp socket and send 'ok' back
-            Command port = local port + 1
-            Answer port = local port
-            Waiting for command is blocking """
-        # create command socket
-        command_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        command_port = self.bindto[1]+1
-        command_sock.bind(("0.0.0.0", command_port))
-        command_sock.settimeout(1)
-        # try to recv
+    def recv_command(self, stop_event=None):
+        """ Receive command on binded port
+            Return data and address of sender
+            or None if we are interrupted """
+        if not self.binded:
+            self.bind()
         while True:
             try:
-                data, (remote_ip, remote_port) = command_sock.recvfrom(self.size)
-                self.send("ok")
-                return data, remote_ip
+                return self.sock.recvfrom(self.size)
             except socket.timeout:
                 if stop_event is not None and stop_event.is_set():
-                    # return None if we are interrupted
                     return None
 
 
+    def answer(self, message, remote_addr):
+        """ Send answer to address, from which command came """
+        self.sock.sendto(message, remote_addr)
+
+
+    def send_command(self, send_host, send_port, message, max_repeat=20):
+        """ Send command to host:port and wait for answer
+            not more then max_repeat times
+            Return answer or None """
+        logger = logging.getLogger(__name__)
+        send_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        send_sock.settimeout(0.5)
+        try:
+            for repeat in range(0, max_repeat):
+                send_sock.sendto(message, (send_host, send_port))
+                try:
+                    data, _ = send_sock.recvfrom(65535)
+                    return data
+                except socket.timeout:
+                    logger.warning("No answer from %s, try %i",
+                                   send_host, repeat)
+        finally:
+            send_sock.close()
+
+        return None
+
+
     def verified_send(self, send_host, message, max_repeat=20):
         """ Send and verify it by answer not more then max_repeat
             Send port = local port + 1
-            Answer port = local port
             Return True if send is verified """
-        # create send socket
-        send_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         send_port = self.sendto[1]+1
-        logger = logging.getLogger(__name__)
-        for repeat in range(0, max_repeat):
-            send_sock.sendto(message, (send_host, send_port))
-            try:
-                data, remote_ip = self.recv()
-                if remote_ip == send_host and data == "ok":
-                    return True
-                else:
-                    logger.warning("No answer from %s, try %i", send_host, repeat)
-            except Timeout:
-                logger.warning("No answer from %s, try %i", send_host, repeat)
-
-        return False
+        answer = self.send_command(send_host, send_port, message, max_repeat)
+        return answer == "ok"
 
 
 define_logger(__name__)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+""" Mergeable quantile sketch with relative accuracy (DDSketch)
+    Values are counted in logarithmic bins, so quantile error is bounded
+    by alpha * value, memory is bounded by max_bins.
+    Also can be used as tool for sketch files of runs:
+    python sketch.py run1.json run2.json --counter op_w_latency -q 0.5 0.99 """
+
+import sys
+import json
+import math
+import argparse
+
+
+# fields of series in sketch files
+SERIES_FIELDS = ("host", "daemon", "group", "counter")
+
+
+class SketchException(Exception):
+    """ Sketches can't be merged or loaded """
+    pass
+
+
+class DDSketch(object):
+    """ Quantile sketch, sketches with equal alpha can be merged """
+
+    def __init__(self, alpha=0.01, max_bins=2048):
+        if not 0 < alpha < 1:
+            raise SketchException("Alpha must be in (0, 1)")
+        self.alpha = alpha
+        self.max_bins = max_bins
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.log_gamma = math.log(self.gamma)
+        # bin index -> count, for positive and negative values
+        self.positive = {}
+        self.negative = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def key(self, value):
+        """ Bin index of positive value """
+        return int(math.ceil(math.log(value) / self.log_gamma))
+
+    def bin_value(self, key):
+        """ Value, which represents bin with relative error alpha """
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def add(self, value, count=1):
+        """ Add value count times """
+        if value > 0:
+            key = self.key(value)
+            self.positive[key] = self.positive.get(key, 0) + count
+            self.collapse(self.positive)
+        elif value < 0:
+            key = self.key(-value)
+            self.negative[key] = self.negative.get(key, 0) + count
+            self.collapse(self.negative)
+        else:
+            self.zero_count += count
+        self.count += count
+        self.sum += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def collapse(self, bins):
+        """ Merge the smallest bins, while there are too many of them
+            (accuracy is lost only for the smallest values) """
+        while len(bins) > self.max_bins:
+            lowest, second = sorted(bins)[:2]
+            bins[second] += bins.pop(lowest)
+
+    def merge(self, other):
+        """ Add all values of other sketch """
+        if other.gamma != self.gamma:
+            raise SketchException("Sketches with different alpha"
+                                  " can't be merged")
+        for bins, other_bins in ((self.positive, other.positive),
+                                 (self.negative, other.negative)):
+            for key, count in other_bins.items():
+                bins[key] = bins.get(key, 0) + count
+            self.collapse(bins)
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        for value in (other.min, other.max):
+            if value is None:
+                continue
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def quantile(self, q):
+        """ Return value of quantile q in [0, 1] or None for empty sketch """
+        if self.count == 0:
+            return None
+        if not 0 <= q <= 1:
+            raise SketchException("Quantile must be in [0, 1]")
+        rank = q * (self.count - 1)
+        seen = 0
+        # from the biggest negative values to the biggest positive ones
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return max(-self.bin_value(key), self.min)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return min(self.bin_value(key), self.max)
+        return self.max
+
+    def avg(self):
+        """ Mean of values or None for empty sketch """
+        if self.count == 0:
+            return None
+        return self.sum / self.count
+
+    def to_dict(self):
+        """ Serializable state (bins keys are strings in json) """
+        return {"alpha": self.alpha,
+                "max_bins": self.max_bins,
+                "positive": self.positive,
+                "negative": self.negative,
+                "zero_count": self.zero_count,
+                "count": self.count,
+                "sum": self.sum,
+                "min": self.min,
+                "max": self.max}
+
+    @classmethod
+    def from_dict(cls, state):
+        """ Sketch from to_dict result """
+        try:
+            result = cls(state["alpha"], state["max_bins"])
+            result.positive = dict((int(key), count) for key, count
+                                   in state["positive"].items())
+            result.negative = dict((int(key), count) for key, count
+                                   in state["negative"].items())
+            for field in ("zero_count", "count", "sum", "min", "max"):
+                setattr(result, field, state[field])
+        except (KeyError, ValueError, AttributeError) as e:
+            raise SketchException("Bad sketch: %s" % e)
+        return result
+
+
+def merge_all(sketches):
+    """ Return new sketch with values of all sketches (None, if no one) """
+    result = None
+    for item in sketches:
+        if result is None:
+            result = DDSketch(item.alpha, item.max_bins)
+        result.merge(item)
+    return result
+
+
+def load_sketch_file(filename):
+    """ Return list of (series fields dict, sketch) from sketch file """
+    with open(filename) as sketch_file:
+        records = json.load(sketch_file)
+    return [(record["series"], DDSketch.from_dict(record["sketch"]))
+            for record in records]
+
+
+def save_sketch_file(filename, items):
+    """ Save list of (series fields dict, sketch) """
+    records = [{"series": fields, "sketch": item.to_dict()}
+               for fields, item in items]
+    with open(filename, "w") as sketch_file:
+        json.dump(records, sketch_file)
+
+
+def parse_command_args(argv):
+    """ Command line parser """
+    parser = argparse.ArgumentParser(description="Merge sketch files"
+                                     " of runs and print quantiles")
+    parser.add_argument("files", type=str, nargs="+",
+                        metavar="FILENAME",
+                        help="Sketch files saved by perfserver")
+    for field in SERIES_FIELDS:
+        parser.add_argument("--" + field, type=str,
+                            help="Use only series with this %s" % field)
+    parser.add_argument("--quantiles", "-q", type=float, nargs="+",
+                        default=[0.5, 0.95, 0.99],
+                        help="Quantiles to print (0.5 0.95 0.99 by default)")
+    parser.add_argument("--per-series", action="store_true",
+                        dest="perseries",
+                        help="Print every series instead of merged one")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    """ Print quantiles of sketches from files """
+    args = parse_command_args(argv[1:])
+    fields = dict((field, getattr(args, field))
+                  for field in SERIES_FIELDS
+                  if getattr(args, field) is not None)
+    # series of different runs are merged
+    series = {}
+    for filename in args.files:
+        for series_fields, item in load_sketch_file(filename):
+            if all(series_fields.get(field) == value
+                   for field, value in fields.items()):
+                key = tuple(sorted(series_fields.items()))
+                series.setdefault(key, []).append(item)
+    if args.perseries:
+        groups = [(dict(key), items) for key, items in sorted(series.items())]
+    else:
+        groups = [(fields, [item for items in series.values()
+                            for item in items])]
+    for series_fields, items in groups:
+        merged = merge_all(items)
+        if merged is None:
+            continue
+        print json.dumps({"series": series_fields,
+                          "count": merged.count,
+                          "avg": merged.avg(),
+                          "quantiles": dict((str(q), merged.quantile(q))
+                                            for q in args.quantiles)})
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv))
@@ -1,18 +1,47 @@
 #!/usr/bin/env python
 """ Module for system metrics collecting """
 
+import procfs
 import ceph_srv_info
 
+# psutil is missing on some nodes - read /proc directly there
+if ceph_srv_info.psutil is not None:
+    BACKEND = "psutil"
+else:
+    BACKEND = "procfs"
 
-def get_system_metrics(ceph_socket_path):
-    """ get memory, cpu and disk usage for all ceph processes"""
-    met = {}
+# entity with devices of daemons (config key -> device), it is metadata
+# and is kept apart from numeric metrics
+DEVICES = "devices"
 
-    srv_info = ceph_srv_info.get_ceph_srv_info(ceph_socket_path)
+_proc_reader = procfs.ProcReader()
+# previous /proc/stat cpu sample
+_last_cpu_stat = {}
+
+
+def get_system_metrics(ceph_socket_path, pss=False):
+    """ get memory, cpu, disk and network usage for all ceph processes
+        pss of processes is reported only on request """
+    met = {DEVICES: {}}
+
+    srv_info = ceph_srv_info.get_ceph_srv_info(ceph_socket_path, BACKEND,
+                                               pss)
     for srv in srv_info:
         met[srv.name] = {}
         met[srv.name]["cpu"] = srv.cpu
         met[srv.name]["mem"] = srv.mem
+        met[srv.name]["user time"] = srv.user_time
+        met[srv.name]["system time"] = srv.sys_time
+        met[srv.name]["voluntary ctx switches"] = srv.vol_ctx
+        met[srv.name]["involuntary ctx switches"] = srv.invol_ctx
+        met[srv.name]["threads"] = srv.threads
+        met[srv.name]["rss"] = srv.rss
+        if pss:
+            met[srv.name]["pss"] = srv.pss
+        met[srv.name]["read bytes"] = srv.rd_bytes
+        met[srv.name]["write bytes"] = srv.wr_bytes
+        # devices to match with disk metrics
+        met[DEVICES][srv.name] = dict(srv.disks)
 
     drv_info = ceph_srv_info.get_ceph_drv_info(ceph_socket_path)
     for disk in drv_info:
@@ -23,5 +52,44 @@ def get_system_metrics(ceph_socket_path):
         met[disk.name]["write bytes"] = disk.wr_bytes
         met[disk.name]["read time"] = disk.rd_time
         met[disk.name]["write time"] = disk.wr_time
+        met[disk.name]["read iops"] = disk.rd_iops
+        met[disk.name]["write iops"] = disk.wr_iops
+        met[disk.name]["read bytes/s"] = disk.rd_bps
+        met[disk.name]["write bytes/s"] = disk.wr_bps
+        met[disk.name]["read await"] = disk.rd_await
+        met[disk.name]["write await"] = disk.wr_await
+        met[disk.name]["await"] = disk.avg_await
+        met[disk.name]["queue size"] = disk.avg_queue
+        met[disk.name]["util"] = disk.util
+
+    net_info = ceph_srv_info.get_ceph_net_info(ceph_socket_path)
+    for net in net_info:
+        name = "net " + net.name
+        met[name] = {}
+        met[name]["rx bytes/s"] = net.rx_bytes
+        met[name]["tx bytes/s"] = net.tx_bytes
+        met[name]["rx packets/s"] = net.rx_packets
+        met[name]["tx packets/s"] = net.tx_packets
+        met[name]["rx drops/s"] = net.rx_drop
+        met[name]["tx drops/s"] = net.tx_drop
+        met[name]["rx errors/s"] = net.rx_errs
+        met[name]["tx errors/s"] = net.tx_errs
+
+    met["tcp"] = ceph_srv_info.get_tcp_info()
+    met["node cpu"] = get_node_cpu_usage()
 
     return met
+
+
+def get_node_cpu_usage():
+    """ Return usage of all node cpus in percents since previous call """
+    cpu_stat = _proc_reader.cpu_stat()
+    last = _last_cpu_stat.get("cpu", cpu_stat)
+    _last_cpu_stat["cpu"] = cpu_stat
+
+    deltas = [new - old for new, old in zip(cpu_stat, last)]
+    total = float(sum(deltas))
+    usage = {}
+    for field, delta in zip(procfs.CPU_FIELDS, deltas):
+        usage[field] = 100.0 * delta / total if total > 0 else 0.0
+    return usage